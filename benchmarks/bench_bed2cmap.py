@@ -0,0 +1,130 @@
+"""
+Benchmark of `traces_export_utils.bed2cmap` against the former implementation
+(one pass over the raster per bedrock kind).
+
+    python benchmarks/bench_bed2cmap.py                 # synthetic 5000x5000
+    python benchmarks/bench_bed2cmap.py -b BEDrst.npy   # raster of a project
+
+The outputs of both implementations are checked to be identical, and to the
+output of the categorical raster (see `categories`) of the same bedrock.
+"""
+
+import os
+import time
+
+import click
+import numpy as np
+
+from tietoolbox.scripts.categories import CategoricalRaster
+from tietoolbox.scripts.traces_export_utils import bed2cmap
+
+LEGENDFILE = os.path.join(
+    os.path.dirname(__file__), "..", "toolbox", "tietoolbox", "scripts", "symbols.tsv"
+)
+
+
+def bed2cmap_loop(BEDrst, legendfile, leg_labels=False):
+    """Former `bed2cmap`, O(kinds x pixels)."""
+    kind = np.unique(BEDrst.flatten())
+    kind = np.extract(np.isnan(kind) == False, kind)  # noqa: E712
+    cm = np.zeros(np.size(BEDrst.flatten()))
+    leg = np.loadtxt(legendfile, usecols=(0, 1, 2, 3))
+    k_col = np.zeros(np.shape(kind))
+
+    for k in range(len(kind)):
+        i = (BEDrst.flatten() == kind[k]).nonzero()
+        cm[i] = k + 1
+        matching_rows = np.where(leg[:, 0] == kind[k])[0]
+        if matching_rows.size > 0:
+            k_col[k] = matching_rows[0]
+
+    cm = cm.reshape(np.shape(BEDrst))
+    cm = np.fliplr(cm)
+
+    cmap = np.zeros((255, 4))
+
+    if any(np.isnan(BEDrst.flatten())):
+        c_step = np.linspace(0, 255, np.size(k_col) + 2)
+        c_step = np.round(c_step, 0).astype(int)
+        cmap[0 : int(c_step[1]), 0:3] = np.ones((int(c_step[1]), 3)) * [230, 230, 230]
+
+        for ci in range(1, len(c_step) - 1):
+            ind1 = int(c_step[ci])
+            ind2 = int(c_step[ci + 1])
+            rgb_c = leg[int(k_col[ci - 1]), 1:4]
+            cmap[ind1:ind2, 0:3] = np.ones((ind2 - ind1, 3)) * rgb_c
+    else:
+        c_step = np.linspace(0, 255, np.size(k_col) + 1)
+        c_step = np.round(c_step, 0).astype(int)
+
+        for ci in range(len(c_step) - 1):
+            ind1 = int(c_step[ci])
+            ind2 = int(c_step[ci + 1])
+            rgb_c = leg[int(k_col[ci]), 1:4]
+            cmap[ind1:ind2, 0:3] = np.ones((ind2 - ind1, 3)) * rgb_c
+    cmap[:, 3] = (np.ones((255, 1)) * 255).flatten()
+
+    return cm, cmap
+
+
+def synthetic_bedrock(size, n_kinds, seed=0):
+    """Bedrock raster made of blocky units, with NaN outside a polygon."""
+    rng = np.random.default_rng(seed)
+    codes = np.loadtxt(LEGENDFILE, usecols=(0,))
+    # A few kinds missing from the legend, as in real data
+    codes = np.concatenate((rng.choice(codes, n_kinds - 2, replace=False), [1, 2]))
+
+    cells = 100
+    units = rng.choice(codes, (cells, cells))
+    BEDrst = np.kron(units, np.ones((size // cells + 1, size // cells + 1)))
+    BEDrst = BEDrst[:size, :size].astype(float)
+
+    rows, cols = np.ogrid[:size, :size]
+    BEDrst[(rows - size / 2) ** 2 + (cols - size / 2) ** 2 > (size / 2) ** 2] = np.nan
+    return BEDrst
+
+
+def timeit(func, *args, repeat=1):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+@click.command()
+@click.option("-b", "--bedrst", help="BEDrst.npy of a project", default=None)
+@click.option("-s", "--size", default=5000, show_default=True)
+@click.option("-k", "--kinds", default=40, show_default=True)
+@click.option("-r", "--repeat", default=3, show_default=True)
+def main(bedrst, size, kinds, repeat):
+    if bedrst:
+        # Categories and their lookup table (BEDrst.json), or codes
+        BEDrst = CategoricalRaster.load(os.path.splitext(bedrst)[0]).to_float()
+    else:
+        BEDrst = synthetic_bedrock(size, kinds)
+    n_kinds = np.unique(BEDrst[~np.isnan(BEDrst)]).size
+    print(f"BEDrst: {BEDrst.shape}, {n_kinds} kinds")
+
+    t_loop, (cm_loop, cmap_loop) = timeit(bed2cmap_loop, BEDrst, LEGENDFILE)
+    t_vec, (cm_vec, cmap_vec) = timeit(bed2cmap, BEDrst, LEGENDFILE, repeat=repeat)
+    BEDcat = CategoricalRaster.from_float(BEDrst)
+    t_cat, (cm_cat, cmap_cat) = timeit(bed2cmap, BEDcat, LEGENDFILE, repeat=repeat)
+
+    assert np.array_equal(cm_loop, cm_vec) and cm_loop.dtype == cm_vec.dtype
+    assert np.array_equal(cmap_loop, cmap_vec) and cmap_loop.dtype == cmap_vec.dtype
+    assert np.array_equal(cm_loop, cm_cat) and cm_loop.dtype == cm_cat.dtype
+    assert np.array_equal(cmap_loop, cmap_cat)
+
+    print(f"loop:       {t_loop:8.3f} s")
+    print(f"vectorized: {t_vec:8.3f} s  (x{t_loop / t_vec:.1f}, identical output)")
+    print(
+        f"{BEDcat.data.dtype}:      {t_cat:8.3f} s  (x{t_loop / t_cat:.1f}, "
+        f"{BEDrst.nbytes // BEDcat.data.nbytes}x smaller raster)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark of `traces_export_utils.export_traces` against the former
+implementation (DEM sized meshgrids, one LineString per trace).
+
+    python benchmarks/bench_export_traces.py
+    python benchmarks/bench_export_traces.py -d <project>/cache   # real outputs
+
+The geometries of both implementations are checked to be identical.
+"""
+
+import time
+from types import SimpleNamespace
+
+import click
+import geopandas as gpd
+import numpy as np
+import shapely
+from affine import Affine
+from rasterio.crs import CRS
+from shapely.geometry import LineString
+
+from tietoolbox.scripts.trace_store import open_dem, open_traces
+from tietoolbox.scripts.traces_export_utils import export_traces
+
+
+def export_traces_loop(DEM, BTraces=[]):
+    """Former `export_traces`."""
+    mx, my = np.meshgrid(DEM["x"], DEM["y"])
+    mz = np.flipud(DEM["z"].copy())
+    mx = mx.astype(float)
+    my = my.astype(float)
+
+    vx = np.fliplr(mx).flatten()
+    vy = my.flatten()
+    vz = np.fliplr(mz).flatten()
+
+    crs = DEM["meta"]["crs"]
+
+    txx = []
+    tyy = []
+    tzz = []
+    if len(BTraces) > 0:
+        for tr in BTraces:
+            txx.append(vx[tr.index.astype(int)])
+            tyy.append(vy[tr.index.astype(int)])
+            tzz.append(vz[tr.index.astype(int)])
+    line_strings = [LineString(list(zip(x, y, z))) for x, y, z in zip(txx, tyy, tzz)]
+
+    authority_str = "epsg:{}".format(crs.to_epsg())
+    return gpd.GeoDataFrame(geometry=line_strings, crs=authority_str)
+
+
+def synthetic_project(size, n_traces, seed=0):
+    """DEM dict (as `utils.load_dem_window`) and random walk traces."""
+    rng = np.random.default_rng(seed)
+    res = 2.0
+    trans = Affine(res, 0.0, 2600000.0, 0.0, -res, 1200000.0 + size * res)
+    DEM = {
+        "z": rng.uniform(500, 3000, (size, size)).astype("float32"),
+        "x": np.arange(trans.c + 1, trans.c + res * size + 1, res),
+        "y": np.arange(trans.f - res * size + 1, trans.f + 1, res),
+        "meta": {"crs": CRS.from_epsg(2056), "transform": trans},
+    }
+
+    traces = []
+    for _ in range(n_traces):
+        length = rng.integers(20, 400)
+        steps = rng.integers(-1, 2, (length, 2))
+        start = rng.integers(0, size, 2)
+        rc = np.clip(start + np.cumsum(steps, axis=0), 0, size - 1)
+        index = (rc[:, 0] * size + rc[:, 1]).astype(float)
+        traces.append(SimpleNamespace(index=index))
+    return DEM, traces
+
+
+@click.command()
+@click.option("-d", "--data-dir", help="Outputs of an analysis (cache)", default=None)
+@click.option("-s", "--size", default=4000, show_default=True)
+@click.option("-n", "--traces", "n_traces", default=20000, show_default=True)
+def main(data_dir, size, n_traces):
+    if data_dir:
+        DEM = open_dem(data_dir)
+        BTraces = open_traces(data_dir, "traces")
+    else:
+        DEM, BTraces = synthetic_project(size, n_traces)
+    print(f"DEM: {np.shape(DEM['z'])}, {len(BTraces)} traces")
+
+    start = time.perf_counter()
+    gdf_loop = export_traces_loop(DEM, BTraces)
+    t_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gdf_vec = export_traces(DEM, BTraces)
+    t_vec = time.perf_counter() - start
+
+    assert gdf_loop.crs == gdf_vec.crs
+    for geoms in (gdf_loop.geometry.values, gdf_vec.geometry.values):
+        assert shapely.get_type_id(geoms).tolist() == [1] * len(BTraces)
+    assert np.array_equal(
+        shapely.get_num_coordinates(gdf_loop.geometry.values),
+        shapely.get_num_coordinates(gdf_vec.geometry.values),
+    )
+    assert np.array_equal(
+        shapely.get_coordinates(gdf_loop.geometry.values, include_z=True),
+        shapely.get_coordinates(gdf_vec.geometry.values, include_z=True),
+    )
+
+    print(f"loop:       {t_loop:8.3f} s")
+    print(f"vectorized: {t_vec:8.3f} s  (x{t_loop / t_vec:.1f}, identical output)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Benchmark of the whole analysis chain on synthetic geology.
+
+For each scale (area in km²), a synthetic project is generated in the work
+directory: a DEM (GeoTIFF), bedrock polygons and fault lines (FileGDB or
+GeoPackage) and a config. The pipeline (`TIEDataProcessor`) is run on it and
+the stage metrics of ``run_metrics.json`` are collected, then `bed2cmap`,
+`export_traces` and `rasterizeGPD` (single call and by strips) are timed on its
+outputs.
+
+The results are written to ``benchmarks/results/<commit>_<date>.json``;
+``--compare`` prints the ratios to a former result file::
+
+    python benchmarks/bench_pipeline.py --scales 1,10
+    python benchmarks/bench_pipeline.py --scales 1 --compare results/abc123_....json
+
+Runs headless (Agg backend), without network nor ArcGIS. The trace
+extraction dominates and grows quickly with the area: a 100 km² scale
+(``--scales 100``) takes hours.
+"""
+
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import click  # noqa: E402
+import geopandas as gpd  # noqa: E402
+import numpy as np  # noqa: E402
+import rasterio as rst  # noqa: E402
+from rasterio.transform import from_origin  # noqa: E402
+from shapely.geometry import LineString, Polygon  # noqa: E402
+
+from tietoolbox.scripts.categories import CategoricalRaster  # noqa: E402
+from tietoolbox.scripts.config import Config  # noqa: E402
+from tietoolbox.scripts.tie_analysis_dask import TIEDataProcessor  # noqa: E402
+from tietoolbox.scripts.trace_store import open_dem, open_traces  # noqa: E402
+from tietoolbox.scripts.traces_export_utils import (  # noqa: E402
+    bed2cmap,
+    export_traces,
+)
+from tietoolbox.scripts.utils import rasterizeGPD  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LEGENDFILE = os.path.join(
+    BENCH_DIR, "..", "toolbox", "tietoolbox", "scripts", "symbols.tsv"
+)
+BEDROCK_ATTRIBUTE = "TOPGIS_GC_GC_BED_FORM_ATT_FMAT_LITSTRAT"
+LINES_ATTRIBUTE = "KIND"
+
+# Lower left corner of the synthetic projects (LV95)
+X0, Y0 = 2600000.0, 1200000.0
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_project(directory, area_km2, res=2.0, vector_format="gdb", seed=0):
+    """Write a synthetic project of `area_km2` in `directory`, return its config.
+
+    - DEM: smooth hills on a tilted plane, with a margin of 200 m.
+    - Bedrock: bands of formations, about 200 m thick, with wavy contacts.
+    - Lines: about 2 faults per km², crossing the bedrock contacts.
+    """
+    rng = np.random.default_rng(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    width = np.sqrt(area_km2) * 1000.0
+    margin = 200.0
+    n_pix = int(round((width + 2 * margin) / res))
+
+    transform = from_origin(X0 - margin, Y0 + width + margin, res, res)
+    rows, cols = np.mgrid[0:n_pix, 0:n_pix].astype("float32") * res
+    phases = rng.uniform(0, 2 * np.pi, 4)
+    z = (
+        1500.0
+        + 0.15 * (n_pix * res - rows)
+        + 80.0 * np.sin(cols / 400.0 + phases[0])
+        + 60.0 * np.cos(rows / 550.0 + phases[1])
+        + 25.0 * np.sin((cols + rows) / 170.0 + phases[2])
+    ).astype("float32")
+    dem_path = os.path.join(directory, "dem.tif")
+    with rst.open(
+        dem_path,
+        "w",
+        driver="GTiff",
+        height=n_pix,
+        width=n_pix,
+        count=1,
+        dtype="float32",
+        crs="EPSG:2056",
+        transform=transform,
+    ) as dst:
+        dst.write(z, 1)
+
+    # Bedrock bands
+    codes = np.loadtxt(LEGENDFILE, usecols=(0,))
+    n_bands = max(int(width // 200), 2)
+    xs = np.linspace(X0 - margin, X0 + width + margin, max(int(width // 20), 20))
+    contacts = [np.full(xs.shape, Y0 - margin)]
+    for i in range(1, n_bands):
+        amp = rng.uniform(5, 40)
+        wavelength = rng.uniform(80, 300)
+        phase = rng.uniform(0, 2 * np.pi)
+        y = Y0 + i * width / n_bands
+        contacts.append(y + amp * np.sin(xs / wavelength + phase))
+    contacts.append(np.full(xs.shape, Y0 + width + margin))
+    polygons = [
+        Polygon(
+            list(zip(xs, contacts[i])) + list(zip(xs[::-1], contacts[i + 1][::-1]))
+        )
+        for i in range(n_bands)
+    ]
+    bedrock = gpd.GeoDataFrame(
+        {BEDROCK_ATTRIBUTE: rng.choice(codes, n_bands)},
+        geometry=polygons,
+        crs="EPSG:2056",
+    )
+
+    # Faults, crossing the contacts
+    n_faults = max(int(round(2 * area_km2)), 1)
+    faults = []
+    for _ in range(n_faults):
+        x = rng.uniform(X0, X0 + width)
+        y = rng.uniform(Y0, Y0 + width)
+        length = rng.uniform(0.1, 0.5) * width
+        angle = rng.uniform(np.pi / 4, 3 * np.pi / 4)
+        dx, dy = np.cos(angle) * length / 2, np.sin(angle) * length / 2
+        bend = rng.uniform(-0.1, 0.1) * length
+        faults.append(LineString([(x - dx, y - dy), (x + bend, y), (x + dx, y + dy)]))
+    lines = gpd.GeoDataFrame(
+        {LINES_ATTRIBUTE: rng.choice([14901001, 14901002, 14901004], n_faults)},
+        geometry=faults,
+        crs="EPSG:2056",
+    )
+
+    if vector_format == "gpkg":
+        geodata, driver = "geology.gpkg", "GPKG"
+    else:
+        geodata, driver = "geology.gdb", "OpenFileGDB"
+    geodata_path = os.path.join(directory, geodata)
+    bedrock.to_file(geodata_path, layer="Bedrock", driver=driver)
+    lines.to_file(geodata_path, layer="Lines", driver=driver)
+
+    return {
+        "name": f"synthetic_{area_km2}km2",
+        "project_dir": directory,
+        "bbox": [X0, Y0, X0 + width, Y0 + width],
+        # On the DEM grid: the grid of rasterizeSHP follows the extent of the
+        # features, which does not match the DEM at every scale
+        "rasterize_method": "rasterizeGPD",
+        "cache": {"enabled": False},
+        "settings": {"num_processes": os.cpu_count()},
+        "DEM": {"source": dem_path, "resolution": str(res)},
+        "Bedrock": {
+            "source": geodata_path,
+            "layer": "Bedrock",
+            "attribute": BEDROCK_ATTRIBUTE,
+        },
+        "Lines": {
+            "source": geodata_path,
+            "layer": "Lines",
+            "attribute": LINES_ATTRIBUTE,
+        },
+    }
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def run_scale(work_dir, area_km2, vector_format, scheduler):
+    directory = os.path.join(work_dir, f"{area_km2}km2_{vector_format}")
+    cfg = synthetic_project(directory, area_km2, vector_format=vector_format)
+    if scheduler:
+        cfg["scheduler"] = {"type": scheduler}
+    with open(os.path.join(directory, "config.json"), "w") as f:
+        json.dump(cfg, f, indent=2)
+    cfg = Config(cfg)
+
+    processor = TIEDataProcessor(cfg)
+    wall, _ = timed(processor.process_geodata)
+    with open(os.path.join(processor.cache_dir, "run_metrics.json")) as f:
+        metrics = json.load(f)
+
+    # Functions run outside of the pipeline
+    cache_dir = processor.cache_dir
+    BEDrst = CategoricalRaster.load(os.path.join(cache_dir, "BEDrst"))
+    DEM = open_dem(cache_dir)
+    traces = open_traces(cache_dir, "traces")
+    bedrock = gpd.read_file(cfg.Bedrock.source, layer="Bedrock")
+    trans = DEM["meta"]["transform"]
+    height, width = np.shape(DEM["z"])
+    bounds = (trans.c, trans.f + trans.e * height, trans.c + trans.a * width, trans.f)
+
+    functions = {
+        "bed2cmap": timed(bed2cmap, BEDrst, LEGENDFILE)[0],
+        "export_traces": timed(export_traces, DEM, traces)[0],
+        "rasterizeGPD": timed(
+            rasterizeGPD, bedrock, BEDROCK_ATTRIBUTE, bounds, trans.a
+        )[0],
+        "rasterizeGPD_strips": timed(
+            rasterizeGPD,
+            bedrock,
+            BEDROCK_ATTRIBUTE,
+            bounds,
+            trans.a,
+            strip_rows=256,
+            num_workers=os.cpu_count(),
+        )[0],
+    }
+
+    return {
+        "area_km2": area_km2,
+        "vector_format": vector_format,
+        "dem_shape": [height, width],
+        "traces": len(traces),
+        "faults": len(open_traces(cache_dir, "faults")),
+        "wall": wall,
+        "peak_rss_mb": metrics["peak_rss_mb"],
+        "scheduler": metrics["scheduler"],
+        "stages": metrics["totals"],
+        "functions": functions,
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, reference):
+    """Print the wall times of `results` relative to `reference`."""
+    ref_scales = {
+        (s["area_km2"], s["vector_format"]): s for s in reference["scales"]
+    }
+    print(f"Compared to {reference['commit']} ({reference['date']}):")
+    for scale in results["scales"]:
+        ref = ref_scales.get((scale["area_km2"], scale["vector_format"]))
+        if ref is None:
+            continue
+        print(f"  {scale['area_km2']} km² ({scale['vector_format']})")
+        rows = [("pipeline", scale["wall"], ref["wall"])]
+        rows += [
+            (name, t["wall"], ref["stages"][name]["wall"])
+            for name, t in scale["stages"].items()
+            if name in ref["stages"]
+        ]
+        rows += [
+            (name, t, ref["functions"][name])
+            for name, t in scale["functions"].items()
+            if name in ref["functions"]
+        ]
+        for name, new, old in rows:
+            ratio = new / old if old else float("nan")
+            print(f"    {name:<20} {old:9.3f}s -> {new:9.3f}s  (x{ratio:.2f})")
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--scales",
+    default="1,10",
+    show_default=True,
+    help="Areas in km², comma separated",
+)
+@click.option(
+    "-f",
+    "--format",
+    "vector_format",
+    type=click.Choice(["gdb", "gpkg"]),
+    default="gdb",
+    show_default=True,
+)
+@click.option(
+    "-w",
+    "--work-dir",
+    default=os.path.join(BENCH_DIR, "work"),
+    show_default=True,
+    help="Directory of the synthetic projects",
+)
+@click.option(
+    "--scheduler",
+    type=click.Choice(["threads", "processes", "synchronous", "distributed"]),
+    default=None,
+    help="Dask scheduler (default: the one of the pipeline)",
+)
+@click.option("-c", "--compare", "reference", default=None, help="Former result file")
+@click.option("-l", "--log-level", default="WARNING", show_default=True)
+def main(scales, vector_format, work_dir, scheduler, reference, log_level):
+    logging.getLogger().setLevel(log_level.upper())
+
+    results = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scales": [],
+    }
+    for area in [float(s) if "." in s else int(s) for s in scales.split(",")]:
+        print(f"Running {area} km² ({vector_format})...")
+        scale = run_scale(work_dir, area, vector_format, scheduler)
+        results["scales"].append(scale)
+        print(
+            f"  {scale['wall']:.2f}s, DEM {scale['dem_shape']}, "
+            f"{scale['traces']} traces, {scale['faults']} faults"
+        )
+
+    results_dir = os.path.join(BENCH_DIR, "results")
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(results_dir, f"{results['commit']}_{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {path}")
+
+    if reference:
+        with open(reference) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
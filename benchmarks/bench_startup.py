@@ -0,0 +1,148 @@
+"""
+Startup time of the scripts: ``--help`` and time to the first log line.
+
+For `tie_analysis_dask.py` and `tie_viewer.py`:
+
+- ``python -X importtime <script> --help`` is run `--repeat` times: its best
+  wall time and its slowest imports are reported, and it must not import any
+  of `HEAVY_MODULES` (they are imported on first use, see `scripts/lazy.py`);
+- the script is started on a small synthetic project (see `bench_pipeline`)
+  and stopped at its first log line, which must come within `--max-seconds`.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --max-seconds 1.5 --top 20
+
+Exits with 1 when a check fails.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from bench_pipeline import synthetic_project
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TOOLBOX_DIR = os.path.join(BENCH_DIR, "..", "toolbox")
+SCRIPTS_DIR = os.path.join(TOOLBOX_DIR, "tietoolbox", "scripts")
+SCRIPTS = ("tie_analysis_dask.py", "tie_viewer.py")
+
+# Must not be imported by ``--help`` nor before the first log line
+HEAVY_MODULES = (
+    "geopandas",
+    "rasterio",
+    "matplotlib",
+    "pyogrio",
+    "pyarrow",
+    "untie.TIE_load",
+    "untie.TIE_visual",
+)
+
+
+def script_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.abspath(TOOLBOX_DIR)] + [p for p in [env.get("PYTHONPATH")] if p]
+    )
+    env["MPLBACKEND"] = "Agg"
+    return env
+
+
+def parse_importtime(stderr):
+    """{module: (cumulative import time (s), nesting level)} of ``-X importtime``."""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Imported modules are indented by 2 spaces per level
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        imports[name.strip()] = (int(cumulative) / 1e6, level)
+    return imports
+
+
+def time_help(script, repeat):
+    """Best wall time of ``script --help`` and the modules it imports."""
+    cmd = [sys.executable, "-X", "importtime", os.path.join(SCRIPTS_DIR, script)]
+    best, imports = None, {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run(
+            cmd + ["--help"], env=script_env(), capture_output=True, text=True
+        )
+        wall = time.perf_counter() - start
+        if out.returncode != 0:
+            raise RuntimeError(f"{script} --help failed:\n{out.stderr[-2000:]}")
+        if best is None or wall < best:
+            best, imports = wall, parse_importtime(out.stderr)
+    return best, imports
+
+
+def time_first_log(script, args, timeout=120):
+    """Seconds until the first line written by `script`, then stop it."""
+    cmd = [sys.executable, "-u", os.path.join(SCRIPTS_DIR, script)] + args
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        cmd, env=script_env(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    try:
+        line = process.stdout.readline()
+        elapsed = time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait(timeout)
+    return elapsed, line.decode("utf-8", "replace").strip()
+
+
+@click.command()
+@click.option("-r", "--repeat", default=5, show_default=True)
+@click.option(
+    "-m",
+    "--max-seconds",
+    default=1.0,
+    show_default=True,
+    help="Maximal time to the first log line",
+)
+@click.option("-t", "--top", default=10, show_default=True, help="Slowest imports")
+def main(repeat, max_seconds, top):
+    failures = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        cfg = synthetic_project(os.path.join(work_dir, "project"), 0.04)
+        config_path = os.path.join(work_dir, "config.json")
+        with open(config_path, "w") as f:
+            json.dump(cfg, f)
+        data_dir = os.path.join(cfg["project_dir"], "cache")
+        first_log_args = {
+            "tie_analysis_dask.py": ["-c", config_path],
+            "tie_viewer.py": ["-c", config_path, "-d", data_dir],
+        }
+
+        for script in SCRIPTS:
+            wall, imports = time_help(script, repeat)
+            print(f"{script} --help: {wall:.2f}s")
+            top_level = {k: t for k, (t, level) in imports.items() if level == 0}
+            for name, t in sorted(top_level.items(), key=lambda i: -i[1])[:top]:
+                print(f"    {name:<40} {t:7.3f}s")
+            heavy = [m for m in HEAVY_MODULES if m in imports]
+            if heavy:
+                failures.append(f"{script} --help imports {', '.join(heavy)}")
+
+            elapsed, line = time_first_log(script, first_log_args[script])
+            print(f"  first log line after {elapsed:.2f}s: {line}")
+            if elapsed > max_seconds:
+                failures.append(
+                    f"{script}: first log line after {elapsed:.2f}s "
+                    f"(max {max_seconds}s)"
+                )
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
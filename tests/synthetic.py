@@ -0,0 +1,137 @@
+"""
+Synthetic project of the end-to-end tests: a DEM (GeoTIFF) and the 'Bedrock'
+and 'Lines' layers (GeoPackage) of its bbox. `assert_same` compares the
+traces of the outputs.
+"""
+
+import os
+
+import numpy as np
+
+import geopandas as gpd
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import LineString, Polygon
+
+from tietoolbox.scripts.config import Config
+
+X0, Y0 = 2600000.0, 1200000.0
+RES = 2.0
+# Margin of the DEM around the bbox (m)
+MARGIN = 100.0
+
+BED_ATTRIBUTE = "LITSTRAT"
+BED_CODES = [15203580, 15203579, 15202604, 15202601]
+LINE_KINDS = [14901001, 14901002]
+
+
+def write_dem(path, size):
+    """Hills of `size` + margin pixels, the bbox being (X0, Y0) + size."""
+    n = size + int(2 * MARGIN / RES)
+    rows, cols = np.mgrid[0:n, 0:n]
+    z = 1500 + 40 * np.sin(cols / 20.0) + 30 * np.cos(rows / 27.0) + 0.3 * rows
+    transform = from_origin(X0 - MARGIN, Y0 + size * RES + MARGIN, RES, RES)
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        height=n,
+        width=n,
+        count=1,
+        dtype="float32",
+        crs="EPSG:2056",
+        transform=transform,
+    ) as dst:
+        dst.write(z.astype(np.float32), 1)
+
+
+def bedrock(size):
+    """Bands of formations with wavy boundaries, across the bbox."""
+    width = size * RES
+    xs = np.linspace(X0 - MARGIN, X0 + width + MARGIN, 60)
+    n = len(BED_CODES)
+    polygons = []
+    for i in range(n):
+        ya, yb = Y0 + i * width / n, Y0 + (i + 1) * width / n
+        top = (
+            [(x, yb + 0.05 * width * np.sin(x / 45.0)) for x in xs]
+            if i < n - 1
+            else [(x, yb + MARGIN) for x in xs]
+        )
+        bottom = (
+            [(x, ya + 0.05 * width * np.sin(x / 45.0)) for x in xs[::-1]]
+            if i > 0
+            else [(x, ya - MARGIN) for x in xs[::-1]]
+        )
+        polygons.append(Polygon(top + bottom))
+    return gpd.GeoDataFrame(
+        {BED_ATTRIBUTE: BED_CODES}, geometry=polygons, crs="EPSG:2056"
+    )
+
+
+def lines(size):
+    """A fault across the bbox (S-N) and a short one in its south-east."""
+    width = size * RES
+    geometries = [
+        LineString(
+            [
+                (X0 + 0.3 * width, Y0 - 10),
+                (X0 + 0.36 * width, Y0 + 0.5 * width),
+                (X0 + 0.32 * width, Y0 + width + 10),
+            ]
+        ),
+        LineString(
+            [(X0 + 0.6 * width, Y0 + 0.15 * width), (X0 + 0.9 * width, Y0 + 0.3 * width)]
+        ),
+    ]
+    return gpd.GeoDataFrame({"KIND": LINE_KINDS}, geometry=geometries, crs="EPSG:2056")
+
+
+def write_project(directory, size=150, **sections):
+    """Write the sources of a project of `size` x `size` pixels to `directory`.
+
+    Returns its configuration (synchronous scheduler, no stage cache),
+    updated by `sections`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    dem_path = os.path.join(directory, "dem.tif")
+    gpkg_path = os.path.join(directory, "geo.gpkg")
+    write_dem(dem_path, size)
+    bedrock(size).to_file(gpkg_path, layer="Bedrock", driver="GPKG")
+    lines(size).to_file(gpkg_path, layer="Lines", driver="GPKG")
+
+    cfg = {
+        "name": "synthetic",
+        "project_dir": os.path.join(directory, "project"),
+        "bbox": [X0, Y0, X0 + size * RES, Y0 + size * RES],
+        "DEM": {"source": dem_path, "resolution": str(RES)},
+        "Bedrock": {"source": gpkg_path, "layer": "Bedrock", "attribute": BED_ATTRIBUTE},
+        "Lines": {"source": gpkg_path, "layer": "Lines", "attribute": "KIND"},
+        "scheduler": {"type": "synchronous"},
+        "cache": {"enabled": False},
+    }
+    cfg.update(sections)
+    return Config(cfg)
+
+
+def assert_same(loaded, original, path="trace"):
+    """Compare TIE objects attribute by attribute, values as float arrays."""
+    if hasattr(original, "__dict__"):
+        assert type(loaded) is type(original), path
+        assert set(vars(loaded)) == set(vars(original)), path
+        for name, value in vars(original).items():
+            assert_same(getattr(loaded, name), value, f"{path}.{name}")
+    elif original is None:
+        assert loaded is None, path
+    elif isinstance(original, (list, tuple)) and any(
+        hasattr(v, "__dict__") or np.ndim(v) > 0 for v in original
+    ):
+        assert len(loaded) == len(original), path
+        for i, (a, b) in enumerate(zip(loaded, original)):
+            assert_same(a, b, f"{path}[{i}]")
+    else:
+        np.testing.assert_array_equal(
+            np.asarray(loaded, dtype=float),
+            np.asarray(original, dtype=float),
+            err_msg=path,
+        )
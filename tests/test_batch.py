@@ -0,0 +1,202 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from tietoolbox.scripts import tie_analysis_dask, tie_batch  # noqa: E402
+from tietoolbox.scripts.categories import CategoricalRaster  # noqa: E402
+from tietoolbox.scripts.config import config_to_dict  # noqa: E402
+from tietoolbox.scripts.sparse_raster import SparseRaster  # noqa: E402
+from tietoolbox.scripts.tie_analysis_dask import TIEDataProcessor  # noqa: E402
+from tietoolbox.scripts.tie_batch import (  # noqa: E402
+    load_shared_layers,
+    read_manifest,
+    run_batch,
+    write_summary,
+)
+from tietoolbox.scripts.trace_store import open_traces  # noqa: E402
+from tietoolbox.scripts.utils import read_layer  # noqa: E402
+
+import synthetic  # noqa: E402
+
+X0, Y0 = synthetic.X0, synthetic.Y0
+
+BASE_CONFIG = {
+    "name": "base",
+    "project_dir": "base",
+    "bbox": [0, 0, 1, 1],
+    "DEM": {"source": "dem.tif", "resolution": "2.0"},
+}
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = self.write("base.json", json.dumps(BASE_CONFIG))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_extents(self):
+        manifest = self.write(
+            "sheets.csv",
+            "name,minx,miny,maxx,maxy\nA 1,10,20,30,40\nB,0,0,5,5\n",
+        )
+        projects = read_manifest(manifest, self.config, "out")
+        self.assertEqual([p.name for p in projects], ["A 1", "B"])
+        cfg = projects[0].cfg
+        self.assertEqual(cfg.bbox, [10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(cfg.project_dir, os.path.join("out", "A_1"))
+        # Each project has its own copy of the configuration
+        cfg.DEM.keep_open = True
+        self.assertNotIn("keep_open", projects[1].cfg.DEM)
+
+        with self.assertRaises(ValueError):
+            read_manifest(manifest)
+
+    def test_configs(self):
+        other = dict(BASE_CONFIG, name="other")
+        self.write("other.json", json.dumps(other))
+        manifest = self.write("configs.txt", "# projects\nbase.json\n\nother.json\n")
+        projects = read_manifest(manifest)
+        self.assertEqual([p.name for p in projects], ["base", "other"])
+
+        manifest = self.write("configs.json", json.dumps(["base.json", "base.json"]))
+        with self.assertRaises(ValueError):
+            read_manifest(manifest)
+
+    def test_summary(self):
+        rows = [
+            {
+                "name": "A",
+                "project_dir": "out/A",
+                "status": "failed",
+                "error": "ValueError: bbox",
+                "wall": 0.1,
+                "bbox": [0, 0, 1, 1],
+            }
+        ]
+        write_summary(self.tmp, rows, failed=["A"])
+        with open(os.path.join(self.tmp, "batch_summary.json")) as f:
+            self.assertEqual(json.load(f), {"failed": ["A"], "projects": rows})
+        with open(os.path.join(self.tmp, "batch_summary.csv")) as f:
+            line = f.read().splitlines()[1]
+        self.assertEqual(line, "A,out/A,failed,ValueError: bbox,0.1,0 0 1 1")
+
+
+class TestBatchRun(unittest.TestCase):
+    # West and east halves of the synthetic bbox (300 m), and an extent
+    # outside of the DEM
+    extents = {
+        "west": [X0, Y0, X0 + 150, Y0 + 300],
+        "east": [X0 + 150, Y0, X0 + 300, Y0 + 300],
+        "outside": [X0 + 5000, Y0, X0 + 5150, Y0 + 300],
+    }
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cfg = synthetic.write_project(self.tmp)
+        self.config = os.path.join(self.tmp, "base.json")
+        with open(self.config, "w") as f:
+            json.dump(config_to_dict(self.cfg), f)
+        self.output_dir = os.path.join(self.tmp, "batch")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def projects(self, *names):
+        manifest = os.path.join(self.tmp, "sheets.csv")
+        with open(manifest, "w") as f:
+            f.write("name,minx,miny,maxx,maxy\n")
+            for name in names:
+                f.write(",".join([name] + [str(v) for v in self.extents[name]]))
+                f.write("\n")
+        return read_manifest(manifest, self.config, self.output_dir)
+
+    def test_shared_layers(self):
+        processors = [TIEDataProcessor(p.cfg) for p in self.projects("west", "east")]
+        with mock.patch.object(tie_batch, "read_layer", wraps=read_layer) as read:
+            layers = load_shared_layers(processors)
+        # Once per layer, for both projects
+        self.assertEqual(read.call_count, 2)
+        self.assertEqual([lyr["projects"] for lyr in layers], [2, 2])
+
+        # The features of a read with the bbox of the project
+        for processor in processors:
+            for group in ("Bedrock", "Lines"):
+                lyr_cfg = processor.layer_config(group)
+                expected = read_layer(
+                    lyr_cfg["source"],
+                    lyr_cfg["layer"],
+                    columns=[lyr_cfg["attribute"]],
+                    bbox=processor.cfg.bbox,
+                )
+                features = processor.layers[group]
+                self.assertEqual(list(features.columns), list(expected.columns))
+                self.assertEqual(
+                    list(features[lyr_cfg["attribute"]]),
+                    list(expected[lyr_cfg["attribute"]]),
+                )
+                self.assertTrue(features.geometry.geom_equals(expected.geometry).all())
+
+    def test_run_batch(self):
+        projects = self.projects("west", "outside", "east")
+        with mock.patch.object(
+            tie_analysis_dask, "read_layer", wraps=read_layer
+        ) as read:
+            rows = run_batch(projects, self.output_dir, jobs=2)
+        # The layers preloaded for all the projects
+        self.assertEqual(read.call_count, 0)
+        self.assertIsNone(os.environ.get("geodata_dir"))
+
+        # The failed project does not stop the others
+        self.assertEqual(
+            [(row["name"], row["status"]) for row in rows],
+            [("west", "ok"), ("outside", "failed"), ("east", "ok")],
+        )
+        with open(os.path.join(self.output_dir, "batch_summary.json")) as f:
+            self.assertEqual(json.load(f)["failed"], ["outside"])
+
+        # Same outputs as the projects run alone
+        for name in ("west", "east"):
+            cfg = synthetic.write_project(
+                os.path.join(self.tmp, name), bbox=self.extents[name]
+            )
+            TIEDataProcessor(cfg).process_geodata()
+            data_dir = os.path.join(self.output_dir, name, "cache")
+            expected_dir = os.path.join(cfg.project_dir, "cache")
+            np.testing.assert_array_equal(
+                CategoricalRaster.load(os.path.join(data_dir, "BEDrst")).to_float(),
+                CategoricalRaster.load(
+                    os.path.join(expected_dir, "BEDrst")
+                ).to_float(),
+            )
+            np.testing.assert_array_equal(
+                SparseRaster.load(os.path.join(data_dir, "TECrst.npz")).to_dense(),
+                SparseRaster.load(os.path.join(expected_dir, "TECrst.npz")).to_dense(),
+            )
+            for traces in ("traces", "faults"):
+                self.assertGreater(len(open_traces(data_dir, traces)), 0)
+                synthetic.assert_same(
+                    list(open_traces(data_dir, traces)),
+                    list(open_traces(expected_dir, traces)),
+                    f"{name} {traces}",
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from tietoolbox.scripts.categories import (  # noqa: E402
+    LEGEND_FILE,
+    NODATA,
+    CategoricalRaster,
+    category_dtype,
+)
+from tietoolbox.scripts.traces_export_utils import bed2cmap  # noqa: E402
+
+
+def bedrock_raster():
+    """Codes of a few formations, NaN on a corner."""
+    rst = np.full((30, 40), 15202600.0)
+    rst[:, 10:20] = 15203579.0
+    rst[5:25, 25:] = 15202601.0
+    rst[:5, :5] = np.nan
+    return rst
+
+
+class TestCategories(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_dtype(self):
+        self.assertEqual(category_dtype(0), np.uint8)
+        self.assertEqual(category_dtype(255), np.uint8)
+        self.assertEqual(category_dtype(256), np.uint16)
+        self.assertEqual(category_dtype(70000), np.uint32)
+
+    def test_float(self):
+        rst = bedrock_raster()
+        cat = CategoricalRaster.from_float(rst)
+        self.assertEqual(cat.data.dtype, np.uint8)
+        np.testing.assert_array_equal(cat.codes, [15202600, 15202601, 15203579])
+        self.assertEqual(np.count_nonzero(cat.data == NODATA), 25)
+        np.testing.assert_array_equal(cat.to_float(), rst)
+
+        # Lookup table of a bigger layer
+        codes = np.concatenate((cat.codes, [15202604.0]))
+        recoded = cat.recode(np.sort(codes))
+        self.assertEqual(recoded.codes.size, 4)
+        np.testing.assert_array_equal(recoded.to_float(), rst)
+
+    def test_save(self):
+        rst = bedrock_raster()
+        path = os.path.join(self.tmp, "BEDrst")
+        CategoricalRaster.from_float(rst).save(path)
+        loaded = CategoricalRaster.load(path, mmap_mode="r")
+        self.assertEqual(loaded.data.dtype, np.uint8)
+        np.testing.assert_array_equal(loaded.to_float(), rst)
+
+        # Float64 raster of a former analysis
+        os.remove(f"{path}.json")
+        np.save(f"{path}.npy", rst)
+        np.testing.assert_array_equal(CategoricalRaster.load(path).to_float(), rst)
+
+    def test_bed2cmap(self):
+        rst = bedrock_raster()
+        cm, cmap = bed2cmap(rst, LEGEND_FILE)
+        cat_cm, cat_cmap = bed2cmap(CategoricalRaster.from_float(rst), LEGEND_FILE)
+        np.testing.assert_array_equal(cat_cm, cm)
+        np.testing.assert_array_equal(cat_cmap, cmap)
+
+        # Categories of the lookup table absent from the raster
+        codes = np.array([15202599.0, 15202600.0, 15202601.0, 15203579.0])
+        cat = CategoricalRaster.from_float(rst).recode(codes)
+        cat_cm, cat_cmap = bed2cmap(cat, LEGEND_FILE)
+        np.testing.assert_array_equal(cat_cm, cm)
+        np.testing.assert_array_equal(cat_cmap, cmap)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import copy
+import os
+import sys
+import unittest
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from untie import TIE_core as TIEcr  # noqa: E402
+
+from tietoolbox.scripts.dem_grid import DEMGrid  # noqa: E402
+from tietoolbox.scripts.sparse_raster import extract_traces  # noqa: E402
+from tietoolbox.scripts.stage_cache import fingerprint  # noqa: E402
+from tietoolbox.scripts.tie_parallel import tie_grid  # noqa: E402
+
+
+def dem(height=40, width=50):
+    """DEM dict of a tilted plane with noise, north-up."""
+    rng = np.random.default_rng(0)
+    rows, cols = np.mgrid[0:height, 0:width]
+    z = (1000 + 3.0 * rows + 1.5 * cols + rng.normal(size=(height, width))).astype(
+        np.float32
+    )
+    x = 2600001.0 + 2.0 * np.arange(width)
+    y = 1200001.0 + 2.0 * np.arange(height)
+    return {"z": z, "x": x, "y": y}
+
+
+class TestDEMGrid(unittest.TestCase):
+    def test_views(self):
+        DEM = dem()
+        grid = DEMGrid.from_dem(DEM)
+        mx, my = np.meshgrid(DEM["x"], DEM["y"])
+        np.testing.assert_array_equal(grid.mesh("south-up")[0], mx)
+        np.testing.assert_array_equal(grid.mesh("south-up")[1], my)
+        np.testing.assert_array_equal(grid.view("south-up"), np.flipud(DEM["z"]))
+        self.assertTrue(np.shares_memory(grid.view("flipped"), DEM["z"]))
+        with self.assertRaises(ValueError):
+            grid.view("east-up")
+
+        # Flattened matrices of `TIE_core.tie` at some indices
+        index = np.array([0, 7, 49, 50, 1234, 1999])
+        matrices = (np.fliplr(mx), my, np.fliplr(np.flipud(DEM["z"])))
+        for flat, matrix in zip(grid.flat(), matrices):
+            np.testing.assert_array_equal(flat.flatten()[index], matrix.ravel()[index])
+            self.assertEqual(flat[int(index[4])], matrix.ravel()[index[4]])
+        for coord, matrix in zip(grid.coords(index), matrices):
+            np.testing.assert_array_equal(coord, matrix.ravel()[index])
+
+    def test_tie(self):
+        DEM = dem()
+        rst = np.full(DEM["z"].shape, np.nan)
+        rst[10, 2:45] = 1.0
+        rst[5:35, 30] = 2.0
+        traces = extract_traces(rst, "L")
+        self.assertEqual(len(traces), 3)
+        expected = TIEcr.tie(
+            copy.deepcopy(traces), DEM["x"], DEM["y"], np.flipud(DEM["z"]), seg=True
+        )
+        result = tie_grid(copy.deepcopy(traces), DEMGrid.from_dem(DEM), seg=True)
+        self.assertEqual(fingerprint(result), fingerprint(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
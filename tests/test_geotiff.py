@@ -0,0 +1,89 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+import rasterio  # noqa: E402
+from affine import Affine  # noqa: E402
+
+from tietoolbox.scripts.config import Config  # noqa: E402
+from tietoolbox.scripts.geotiff import output_config, write_tif  # noqa: E402
+from tietoolbox.scripts.sparse_raster import SparseRaster  # noqa: E402
+
+TRANSFORM = Affine(2.0, 0, 2600000.0, 0, -2.0, 1201200.0)
+
+
+class TestGeotiff(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_config(self):
+        cfg = Config(
+            {
+                "outputs": {
+                    "default": {"compress": "ZSTD", "blocksize": 256},
+                    "TECrst": {"tif": False},
+                }
+            }
+        )
+        self.assertEqual(output_config(cfg, "BEDrst")["compress"], "zstd")
+        self.assertFalse(output_config(cfg, "TECrst")["tif"])
+        self.assertEqual(output_config(cfg, "cropped")["resampling"], "average")
+        self.assertEqual(output_config(Config({}), "BEDrst")["format"], "cog")
+
+        cfg.outputs.default.format = "jpeg"
+        with self.assertRaises(ValueError):
+            output_config(cfg, "BEDrst")
+
+    def test_write(self):
+        rng = np.random.default_rng(0)
+        dem = np.cumsum(rng.normal(size=(600, 700)), axis=1)
+        # View of the array, as the flipped rasters of the pipeline
+        arr = np.flip(dem, (0, 1))
+        # Options and overviews ('auto': halved until a tile holds 700 pixels)
+        for options, overviews in (
+            ({}, [2]),
+            ({"compress": "zstd", "level": 9, "blocksize": 256}, [2, 4]),
+            ({"format": "gtiff", "overviews": [2, 8]}, [2, 8]),
+            ({"compress": "none", "overviews": []}, []),
+        ):
+            fname = os.path.join(self.tmp, "cropped.tif")
+            write_tif(arr, fname, "EPSG:2056", TRANSFORM, options, nodata=-9999.0)
+            self.assertEqual(os.listdir(self.tmp), ["cropped.tif"])
+            with rasterio.open(fname) as src:
+                np.testing.assert_array_equal(src.read(1), arr)
+                self.assertEqual(src.nodata, -9999.0)
+                self.assertTrue(src.profile["tiled"])
+                structure = src.tags(ns="IMAGE_STRUCTURE")
+                if options.get("format", "cog") == "cog":
+                    self.assertEqual(structure["LAYOUT"], "COG")
+                self.assertEqual(src.overviews(1), overviews)
+            os.remove(fname)
+
+    def test_sparse(self):
+        rst = np.full((700, 600), np.nan)
+        rst[10, 5:500] = 14901001.0
+        rst[600:690, 550] = 14901002.0
+        sparse = SparseRaster.from_dense(rst)
+        fname = os.path.join(self.tmp, "TECrst.tif")
+        sparse.to_tif(fname, "EPSG:2056", TRANSFORM, {"blocksize": 256})
+        with rasterio.open(fname) as src:
+            data = src.read(1)
+            self.assertEqual(data.dtype, np.uint8)
+            self.assertIn("CATEGORY_CODES", src.tags(1))
+        np.testing.assert_array_equal(
+            data, np.flip(sparse.to_categorical().data, (0, 1))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from untie import TIE_classes as TIEclass  # noqa: E402
+
+from tietoolbox.scripts.dem_grid import DEMGrid  # noqa: E402
+from tietoolbox.scripts.lod import (  # noqa: E402
+    LevelOfDetail,
+    decimation_step,
+    roi_window,
+)
+
+
+def grid(height=90, width=120):
+    z = np.arange(height * width, dtype=np.float32).reshape(height, width)
+    x = 2600001.0 + 2.0 * np.arange(width)
+    y = 1200001.0 + 2.0 * np.arange(height)
+    return DEMGrid(z, x, y)
+
+
+def trace(index):
+    """Trace of the (flipped) `index`, two segments."""
+    index = np.asarray(index, dtype=float)
+    n = index.size
+    segments = [
+        TIEclass.segment_OBJ(k, [], ind, ind[::-1], [], [], 1, [])
+        for k, ind in enumerate((np.arange(0, n // 2 + 1), np.arange(n // 2, n)))
+    ]
+    bars = [np.array([i, 0.0, 1.0]) for i in range(n)]
+    return TIEclass.trace_OBJ(1, index, 1.0, segments, None, bars)
+
+
+class TestLevelOfDetail(unittest.TestCase):
+    def test_step(self):
+        self.assertEqual(decimation_step((90, 120), 0), 1)
+        self.assertEqual(decimation_step((90, 120), 90 * 120), 1)
+        for budget in (1, 100, 1000, 5000):
+            step = decimation_step((90, 120), budget)
+            self.assertLessEqual(-(-90 // step) * -(-120 // step), budget)
+            self.assertGreater(-(-90 // (step - 1)) * -(-120 // (step - 1)), budget)
+
+    def test_decimate(self):
+        full = grid()
+        lod = LevelOfDetail(full, max_vertices=1000)
+        self.assertEqual(lod.step, 4)
+        self.assertEqual(lod.grid.shape, (23, 30))
+        self.assertTrue(np.shares_memory(lod.grid.z, full.z))
+
+        # Flipped raster on the grid, as the z of the grid
+        rst = lod.raster(full.view("flipped"))
+        np.testing.assert_array_equal(rst, lod.grid.view("flipped"))
+
+        # A diagonal trace, snapped to the vertices within half a step
+        rows = np.arange(3, 80)
+        index = rows * full.shape[1] + rows + 10
+        tr = trace(index)
+        new = lod.trace(tr)
+        self.assertLess(new.index.size, index.size)
+        self.assertEqual(len(new.orientbar), new.index.size)
+        x, y, z = lod.grid.coords(new.index)
+        kept = [int(b[0]) for b in new.orientbar]
+        fx, fy, _ = full.coords(index[kept])
+        self.assertLessEqual(np.abs(x - fx).max(), 2.0 * 2)
+        self.assertLessEqual(np.abs(y - fy).max(), 2.0 * 2)
+        np.testing.assert_array_equal(z, lod.grid.flat()[2][new.index.astype(int)])
+        for seg in new.Segment:
+            self.assertGreaterEqual(seg.ind_normal.size, 5)
+            np.testing.assert_array_equal(seg.ind_reverse, seg.ind_normal[::-1])
+        self.assertEqual(new.Segment[-1].ind_normal[-1], new.index.size - 1)
+        # The trace of the store is left as is
+        self.assertEqual(tr.index.size, index.size)
+
+        self.assertIs(LevelOfDetail(full, 0).traces([tr])[0], tr)
+
+    def test_roi(self):
+        full = grid()
+        window = roi_window(full, (2600021.0, 1200041.0, 2600061.0, 1200101.0))
+        self.assertEqual(window, (39, 10, 31, 21))
+        lod = LevelOfDetail(full, max_vertices=0, window=window)
+        self.assertEqual(lod.grid.shape, (31, 21))
+        mx, my = lod.grid.mesh()
+        self.assertEqual((mx.min(), mx.max()), (2600021.0, 2600061.0))
+        self.assertEqual((my.min(), my.max()), (1200041.0, 1200101.0))
+
+        # A row of the DEM across the window: full resolution inside
+        index = 50 * full.shape[1] + np.arange(full.shape[1])
+        new = lod.trace(trace(index))
+        self.assertEqual(new.index.size, 21)
+        inside = np.array([int(b[0]) for b in new.orientbar])
+        for got, expected in zip(lod.grid.coords(new.index), full.coords(index[inside])):
+            np.testing.assert_array_equal(got, expected)
+
+        # Outside of the window
+        self.assertIsNone(lod.trace(trace(5 * full.shape[1] + np.arange(50))))
+        with self.assertRaises(ValueError):
+            roi_window(full, (0, 0, 10, 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
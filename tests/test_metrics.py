@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import Counter
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from tietoolbox.scripts.categories import CategoricalRaster  # noqa: E402
+from tietoolbox.scripts.metrics import MetricsRecorder, count_items  # noqa: E402
+from tietoolbox.scripts.sparse_raster import SparseRaster  # noqa: E402
+from tietoolbox.scripts.tie_analysis_dask import TIEDataProcessor  # noqa: E402
+
+import synthetic  # noqa: E402
+
+
+class TestCountItems(unittest.TestCase):
+    def test_rasters(self):
+        rst = np.full((20, 30), np.nan)
+        rst[:5] = 15203580.0
+        rst[10, 3:20] = 15203579.0
+        expected = {"pixels": 600, "valid_pixels": 167}
+        self.assertEqual(count_items(rst), expected)
+        self.assertEqual(count_items(CategoricalRaster.from_float(rst)), expected)
+        self.assertEqual(count_items(SparseRaster.from_dense(rst)), expected)
+        # Integer arrays are not known to hold NaN: no valid pixels
+        self.assertEqual(count_items(np.zeros((4, 5), dtype=np.uint8)), {"pixels": 20})
+
+    def test_others(self):
+        self.assertEqual(count_items({"z": np.zeros((3, 4))}), {"pixels": 12})
+        self.assertEqual(count_items(None), {})
+
+
+class TestRunMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_project(self, name, scheduler):
+        cfg = synthetic.write_project(
+            os.path.join(self.tmp, name),
+            scheduler={"type": scheduler, "num_workers": 2},
+        )
+        processor = TIEDataProcessor(cfg)
+        # Records of an interrupted run: discarded
+        MetricsRecorder(processor.cache_dir).record({"stage": "stale", "start": 0})
+        processor.process_geodata()
+        self.assertFalse(os.path.exists(processor.metrics.records_path))
+        with open(processor.metrics.summary_path) as f:
+            return json.load(f)
+
+    def test_run_metrics(self):
+        summary = self.run_project("synchronous", "synchronous")
+        self.assertEqual(summary["scheduler"]["type"], "synchronous")
+        stages = summary["stages"]
+        # One record per call of a stage: the bedrock and the lines branches
+        # call the same ones
+        calls = {name: total["calls"] for name, total in summary["totals"].items()}
+        self.assertEqual(calls, dict(Counter(r["stage"] for r in stages)))
+        self.assertNotIn("stale", calls)
+        for name, count in (
+            ("load_big_shp", 2),
+            ("crop_dem", 1),
+            ("rasterize_shp", 2),
+            ("tie_analysis", 2),
+            ("finalizing_tie", 1),
+        ):
+            self.assertEqual(calls[name], count, name)
+        self.assertEqual(
+            Counter(r["label"] for r in stages)["load_big_shp[Bedrock]"], 1
+        )
+        self.assertEqual({r["pid"] for r in stages}, {os.getpid()})
+        starts = [r["start"] for r in stages]
+        self.assertEqual(starts, sorted(starts))
+
+        # The records of the worker processes, merged
+        processes = self.run_project("processes", "processes")["stages"]
+        self.assertEqual(
+            Counter(r["label"] for r in processes), Counter(r["label"] for r in stages)
+        )
+        self.assertNotIn(os.getpid(), {r["pid"] for r in processes})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+import os
+import shutil
+import sys
+import tempfile
+import textwrap
+import unittest
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from tietoolbox.progress import (  # noqa: E402
+    ProgressReader,
+    ProgressThrottle,
+    ProgressWriter,
+    encode_event,
+    format_event,
+    parse_event,
+)
+from tietoolbox.runner import Runner  # noqa: E402
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProtocol(unittest.TestCase):
+    def test_roundtrip(self):
+        line = encode_event("progress", stage="extract_traces", percent=12.5)
+        self.assertTrue(line.endswith("\n"))
+        event = parse_event(line)
+        self.assertEqual(event["v"], 1)
+        self.assertEqual(event["event"], "progress")
+        self.assertEqual(event["stage"], "extract_traces")
+        self.assertEqual(event["percent"], 12.5)
+
+    def test_invalid_lines(self):
+        self.assertIsNone(parse_event("2024-01-01 :: INFO :: not json"))
+        self.assertIsNone(parse_event('{"event": "unknown"}'))
+        self.assertIsNone(parse_event("[1, 2]"))
+        with self.assertRaises(ValueError):
+            encode_event("unknown")
+
+    def test_format(self):
+        event = parse_event(
+            encode_event(
+                "progress",
+                stage="tie_analysis",
+                stage_done=1,
+                stage_total=2,
+                percent=50.0,
+                eta=3.2,
+            )
+        )
+        self.assertEqual(format_event(event), "tie_analysis (1/2) 50%, 3s left")
+        event = parse_event(encode_event("end", status="error", message="boom"))
+        self.assertEqual(format_event(event), "Failed: boom")
+
+
+class TestReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "progress.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_missing_file(self):
+        self.assertEqual(ProgressReader(self.path).read(), [])
+
+    def test_incremental(self):
+        reader = ProgressReader(self.path)
+        with ProgressWriter(self.path) as writer:
+            writer.emit("start", total=2)
+            self.assertEqual([e["event"] for e in reader.read()], ["start"])
+            self.assertEqual(reader.read(), [])
+            writer.emit("progress", done=1, total=2)
+            writer.emit("progress", done=2, total=2)
+            self.assertEqual([e["done"] for e in reader.read()], [1, 2])
+
+    def test_partial_line(self):
+        reader = ProgressReader(self.path)
+        line = encode_event("progress", done=1)
+        with open(self.path, "w") as f:
+            f.write(line[:10])
+        self.assertEqual(reader.read(), [])
+        with open(self.path, "a") as f:
+            f.write(line[10:])
+        self.assertEqual([e["done"] for e in reader.read()], [1])
+
+    def test_truncated(self):
+        reader = ProgressReader(self.path)
+        with ProgressWriter(self.path) as writer:
+            writer.emit("start", total=10)
+            writer.emit("progress", done=1)
+        self.assertEqual(len(reader.read()), 2)
+        with ProgressWriter(self.path) as writer:
+            writer.emit("start", total=3)
+        self.assertEqual([e["total"] for e in reader.read()], [3])
+
+
+class TestThrottle(unittest.TestCase):
+    def test_throttle(self):
+        clock = FakeClock()
+        sent = []
+        throttle = ProgressThrottle(sent.append, interval=1.0, clock=clock)
+
+        throttle.update({"event": "start"})
+        throttle.update({"event": "progress", "done": 1})
+        clock.now = 0.5
+        throttle.update({"event": "progress", "done": 2})
+        throttle.update({"event": "progress", "done": 3})
+        self.assertEqual([e.get("done") for e in sent], [None])
+
+        clock.now = 1.0
+        throttle.update({"event": "progress", "done": 4})
+        self.assertEqual([e.get("done") for e in sent], [None, 4])
+
+        # The last skipped event is sent before the 'end' one
+        throttle.update({"event": "progress", "done": 5})
+        throttle.update({"event": "end", "status": "ok"})
+        self.assertEqual([e.get("done") for e in sent], [None, 4, 5, None])
+        self.assertEqual(sent[-1]["event"], "end")
+
+
+class TestRunner(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.progress_file = os.path.join(self.tmp_dir, "progress.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_child(self, code):
+        script = os.path.join(self.tmp_dir, "child.py")
+        with open(script, "w") as f:
+            f.write(textwrap.dedent(code))
+        cmd = '"{}" "{}" "{}"'.format(sys.executable, script, self.progress_file)
+
+        lines = []
+        events = []
+        runner = Runner()
+        ret = runner.running(
+            cmd,
+            working_dir=self.tmp_dir,
+            callback=lines.append,
+            progress_file=self.progress_file,
+            on_progress=events.append,
+            progress_interval=0,
+        )
+        return ret, runner, lines, events
+
+    def test_progress_events(self):
+        code = """
+        import sys
+        sys.path.insert(0, {!r})
+        from tietoolbox.progress import ProgressWriter
+
+        with ProgressWriter(sys.argv[1]) as writer:
+            writer.emit("start", total=3)
+            for i in range(1, 4):
+                print("task", i, flush=True)
+                writer.emit("progress", stage="stage", done=i, total=3)
+            writer.emit("end", status="ok", elapsed=0.1)
+        """.format(TOOLBOX_DIR)
+        ret, runner, lines, events = self.run_child(code)
+
+        self.assertEqual(ret, 0)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(
+            [e["event"] for e in events],
+            ["start", "progress", "progress", "progress", "end"],
+        )
+        self.assertEqual([e.get("done") for e in events[1:4]], [1, 2, 3])
+        self.assertEqual(runner.progress["status"], "ok")
+
+    def test_stale_events_ignored(self):
+        with ProgressWriter(self.progress_file) as writer:
+            writer.emit("end", status="error", message="former run")
+        ret, runner, lines, events = self.run_child("print('no progress')\n")
+
+        self.assertEqual(ret, 0)
+        self.assertEqual(events, [])
+        self.assertIsNone(runner.progress)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+import geopandas as gpd  # noqa: E402
+import shapely  # noqa: E402
+
+from tietoolbox.scripts.utils import rasterizeGPD  # noqa: E402
+
+
+def random_layer(kind, n, seed=0):
+    """Overlapping polygons or lines over 0..1000, with a numerical value."""
+    rng = np.random.default_rng(seed)
+    if kind == "polygons":
+        geoms = [
+            shapely.Point(xy).buffer(r)
+            for xy, r in zip(rng.uniform(0, 1000, (n, 2)), rng.uniform(5, 80, n))
+        ]
+    else:
+        geoms = [
+            shapely.LineString(rng.uniform(0, 1000, (rng.integers(2, 8), 2)))
+            for _ in range(n)
+        ]
+    return gpd.GeoDataFrame({"v": rng.integers(1, 50, n).astype(float)}, geometry=geoms)
+
+
+class TestRasterize(unittest.TestCase):
+    def test_strips(self):
+        bounds = (0.3, -2.1, 1000.7, 997.0)
+        for kind in ("polygons", "lines"):
+            gdf = random_layer(kind, 300)
+            for res in (1.7, 10.0):
+                expected = rasterizeGPD(gdf, "v", bounds, res, fill=np.nan)
+                for strip_rows, num_workers in ((1, 1), (7, 3), (64, 2)):
+                    strips = rasterizeGPD(
+                        gdf,
+                        "v",
+                        bounds,
+                        res,
+                        fill=np.nan,
+                        strip_rows=strip_rows,
+                        num_workers=num_workers,
+                    )
+                    np.testing.assert_array_equal(strips, expected)
+
+    def test_empty_strips(self):
+        gdf = random_layer("polygons", 1).set_geometry([shapely.box(0, 0, 10, 10)])
+        raster = rasterizeGPD(gdf, "v", (0, 0, 100, 100), 1.0, strip_rows=8)
+        self.assertEqual(np.count_nonzero(raster), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from tietoolbox.scripts.categories import CategoricalRaster  # noqa: E402
+from tietoolbox.scripts.dem_grid import DEMGrid  # noqa: E402
+from tietoolbox.scripts.sparse_raster import extract_traces  # noqa: E402
+from tietoolbox.scripts.tie_parallel import tie_grid  # noqa: E402
+from tietoolbox.scripts.tie_render import parse_ids, render_batch  # noqa: E402
+from tietoolbox.scripts.trace_store import save_dem, save_traces  # noqa: E402
+
+
+def write_project(data_dir):
+    """Output directory of the analysis of two beds on a bowl shaped DEM."""
+    rows, cols = np.mgrid[0:60, 0:80]
+    z = (1000 + 0.05 * (rows - 30) ** 2 + 0.03 * (cols - 40) ** 2).astype(np.float32)
+    DEM = {
+        "z": z,
+        "x": 2600001.0 + 2.0 * np.arange(80),
+        "y": 1200001.0 + 2.0 * np.arange(60),
+        "meta": {},
+    }
+    bedrock = np.where(rows < 20, 14901001.0, np.where(rows < 40, 14901002.0, 14901003.0))
+    bed = np.flip(bedrock, (0, 1))
+    contacts = np.full(bed.shape, np.nan)
+    contacts[19, 3:77] = 1.0
+    contacts[39, 3:77] = 2.0
+    traces = tie_grid(extract_traces(contacts, "B"), DEMGrid.from_dem(DEM), seg=True)
+
+    save_dem(DEM, os.path.join(data_dir, "DEM"))
+    CategoricalRaster.from_float(bed).save(os.path.join(data_dir, "BEDrst"))
+    save_traces(traces, os.path.join(data_dir, "traces"))
+    save_traces([], os.path.join(data_dir, "faults"))
+    return traces
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp, "cache")
+        self.traces = write_project(self.data_dir)
+        self.output_dir = os.path.join(self.tmp, "figures")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def statuses(self, **kwargs):
+        rows = render_batch([self.data_dir], self.output_dir, **kwargs)
+        return {os.path.basename(row["path"]): row["status"] for row in rows}
+
+    def test_parse_ids(self):
+        self.assertIsNone(parse_ids(None))
+        self.assertEqual(parse_ids("1-3, 7"), {1, 2, 3, 7})
+        with self.assertRaises(ValueError):
+            parse_ids("1-a")
+
+    def test_render(self):
+        ids = [tr.id for tr in self.traces]
+        statuses = self.statuses(ids={ids[0]})
+        self.assertEqual(
+            statuses,
+            {
+                "overview.png": "rendered",
+                "signal_height.png": "rendered",
+                f"traces_{ids[0]}_signal.png": "rendered",
+                f"traces_{ids[0]}_stereo.png": "rendered",
+            },
+        )
+        for name in statuses:
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, "cache", name)))
+
+        # Unchanged figures are skipped, unless forced
+        statuses = self.statuses()
+        self.assertEqual(statuses.pop(f"traces_{ids[0]}_signal.png"), "skipped")
+        self.assertEqual(set(statuses.values()), {"skipped", "rendered"})
+        statuses = self.statuses(plots=("IndividualSignals",))
+        self.assertEqual(set(statuses.values()), {"skipped"})
+        statuses = self.statuses(plots=("IndividualSignals",), force=True)
+        self.assertEqual(set(statuses.values()), {"rendered"})
+
+        # A trace changes: its figures and the project figures are drawn again
+        traces = copy.deepcopy(self.traces)
+        traces[1].Segment[0].classID = 3 - int(traces[1].Segment[0].classID)
+        save_traces(traces, os.path.join(self.data_dir, "traces"))
+        statuses = self.statuses(plots=("SignalHeightDiagram", "IndividualSignals"))
+        self.assertEqual(
+            statuses,
+            {
+                "signal_height.png": "rendered",
+                f"traces_{ids[0]}_signal.png": "skipped",
+                f"traces_{ids[1]}_signal.png": "rendered",
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
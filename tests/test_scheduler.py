@@ -0,0 +1,129 @@
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from tietoolbox.scripts.categories import CategoricalRaster  # noqa: E402
+from tietoolbox.scripts.scheduler import scheduler, scheduler_config  # noqa: E402
+from tietoolbox.scripts.sparse_raster import SparseRaster  # noqa: E402
+from tietoolbox.scripts.tie_analysis_dask import TIEDataProcessor  # noqa: E402
+from tietoolbox.scripts.trace_store import open_traces  # noqa: E402
+
+import synthetic  # noqa: E402
+
+HAS_DISTRIBUTED = importlib.util.find_spec("distributed") is not None
+
+
+class TestSchedulerConfig(unittest.TestCase):
+    def test_defaults(self):
+        self.assertEqual(
+            scheduler_config({}),
+            {
+                "type": "threads",
+                "num_workers": None,
+                "threads_per_worker": 1,
+                "memory_limit": None,
+            },
+        )
+
+    def test_num_workers(self):
+        settings = {"settings": {"num_processes": 3}}
+        self.assertEqual(scheduler_config(settings)["num_workers"], 3)
+        cfg = dict(settings, scheduler={"type": "processes", "num_workers": "2"})
+        self.assertEqual(scheduler_config(cfg)["num_workers"], 2)
+        # null: settings.num_processes, then the number of CPUs (dask)
+        cfg = dict(settings, scheduler={"num_workers": None})
+        self.assertEqual(scheduler_config(cfg)["num_workers"], 3)
+        cfg = {"scheduler": {"num_workers": 0}}
+        self.assertIsNone(scheduler_config(cfg)["num_workers"])
+
+    def test_unknown(self):
+        with self.assertRaisesRegex(ValueError, "Unknown scheduler 'dask'"):
+            scheduler_config({"scheduler": {"type": "dask"}})
+
+
+class TestScheduler(unittest.TestCase):
+    def kwargs(self, sched_cfg, pool=None):
+        with scheduler({"scheduler": sched_cfg}, pool) as kwargs:
+            return kwargs
+
+    def test_kwargs(self):
+        self.assertEqual(self.kwargs({}), {"scheduler": "threads"})
+        self.assertEqual(
+            self.kwargs({"type": "processes", "num_workers": 2}),
+            {"scheduler": "processes", "num_workers": 2},
+        )
+        self.assertEqual(
+            self.kwargs({"type": "synchronous", "num_workers": 2}),
+            {"scheduler": "synchronous"},
+        )
+        with self.assertLogs("tietoolbox.scripts.scheduler", "WARNING"):
+            self.kwargs({"type": "threads", "memory_limit": "1GB"})
+
+        # The pool of the caller replaces the one of the 'processes' scheduler
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            self.assertEqual(
+                self.kwargs({"type": "processes", "num_workers": 2}, pool),
+                {"scheduler": "processes", "pool": pool},
+            )
+            self.assertEqual(self.kwargs({}, pool), {"scheduler": "threads"})
+
+    @unittest.skipIf(HAS_DISTRIBUTED, "distributed is installed")
+    def test_no_distributed(self):
+        with self.assertRaisesRegex(ImportError, "distributed"):
+            self.kwargs({"type": "distributed"})
+
+
+class TestSchedulers(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_project(self, name, **sched_cfg):
+        cfg = synthetic.write_project(
+            os.path.join(self.tmp, name), scheduler=dict(sched_cfg, num_workers=2)
+        )
+        processor = TIEDataProcessor(cfg)
+        processor.process_geodata()
+        return processor.cache_dir
+
+    def assertSameOutputs(self, data_dir, expected_dir):
+        np.testing.assert_array_equal(
+            CategoricalRaster.load(os.path.join(data_dir, "BEDrst")).to_float(),
+            CategoricalRaster.load(os.path.join(expected_dir, "BEDrst")).to_float(),
+        )
+        np.testing.assert_array_equal(
+            SparseRaster.load(os.path.join(data_dir, "TECrst.npz")).to_dense(),
+            SparseRaster.load(os.path.join(expected_dir, "TECrst.npz")).to_dense(),
+        )
+        for name in ("traces", "faults"):
+            traces = list(open_traces(data_dir, name))
+            self.assertGreater(len(traces), 0)
+            synthetic.assert_same(traces, list(open_traces(expected_dir, name)), name)
+
+    def test_processes(self):
+        expected = self.run_project("synchronous", type="synchronous")
+        processes = self.run_project("processes", type="processes")
+        self.assertSameOutputs(processes, expected)
+
+    @unittest.skipUnless(HAS_DISTRIBUTED, "requires distributed")
+    def test_distributed(self):
+        expected = self.run_project("synchronous", type="synchronous")
+        self.assertSameOutputs(
+            self.run_project("distributed", type="distributed", memory_limit="1GB"),
+            expected,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
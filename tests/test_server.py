@@ -0,0 +1,138 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from tietoolbox.jobs import (  # noqa: E402
+    JobCancelled,
+    JobClient,
+    JobError,
+    read_token,
+    token_path,
+    write_token,
+)
+from tietoolbox.runner import Runner  # noqa: E402
+from tietoolbox.scripts.tie_server import AnalysisServer  # noqa: E402
+
+
+class FakeAnalysis:
+    """Stands for the analysis: 'fail' fails, 'block' runs until released."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, job):
+        if job.config == "fail":
+            raise RuntimeError("boom")
+        if job.config == "block":
+            self.started.set()
+            while not self.release.wait(0.01):
+                if job.cancel_event.is_set():
+                    raise JobCancelled()
+        job.progress.emit("progress", stage="tie", percent=100.0)
+        return {"cache_dir": job.config}
+
+
+class TestAnalysisServer(unittest.TestCase):
+    def setUp(self):
+        self.analysis = FakeAnalysis()
+        self.server = AnalysisServer(("127.0.0.1", 0), self.analysis)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.port = self.server.server_address[1]
+        self.client = JobClient(port=self.port, token=self.server.token)
+
+    def tearDown(self):
+        self.analysis.release.set()
+        self.server.stop()
+        self.server.server_close()
+        self.thread.join()
+
+    def wait(self, job):
+        runner = Runner()
+        ret = runner.run_job(self.client, job, callback=lambda msg: None, poll_sec=0.01)
+        return ret, runner
+
+    def test_ping(self):
+        self.assertTrue(self.client.is_running())
+        self.assertFalse(JobClient(port=1, timeout=0.5).is_running())
+
+    def test_done(self):
+        events = []
+        runner = Runner()
+        ret = runner.run_job(
+            self.client,
+            "project",
+            callback=lambda msg: None,
+            on_progress=events.append,
+            poll_sec=0.01,
+        )
+        self.assertEqual(ret, 0)
+        self.assertEqual(runner.job["state"], "done")
+        self.assertEqual(runner.job["result"], {"cache_dir": "project"})
+        self.assertEqual([e["percent"] for e in events], [100.0])
+
+    def test_failed(self):
+        ret, runner = self.wait("fail")
+        self.assertEqual(ret, 1)
+        self.assertEqual(runner.job["error"], "boom")
+
+    def test_cancel_running_and_queued(self):
+        running = self.client.submit("block")
+        queued = self.client.submit("project")
+        self.assertTrue(self.analysis.started.wait(5))
+        self.assertEqual(self.client.cancel(queued)["state"], "cancelled")
+        self.assertEqual(self.client.status(running)["state"], "running")
+
+        runner = Runner()
+        runner.cancel_op = True
+        ret = runner.run_job(
+            self.client, "block", callback=lambda msg: None, poll_sec=0.01
+        )
+        # Queued behind the first job: cancelled before it starts
+        self.assertEqual(ret, 2)
+        self.client.cancel(running)
+        while self.client.status(running)["state"] == "running":
+            time.sleep(0.01)
+        self.assertEqual(self.client.result(running)["state"], "cancelled")
+        self.assertIsNone(self.client.result(queued)["result"])
+
+    def test_token(self):
+        for token in ("", "0" * 64):
+            client = JobClient(port=self.port, token=token)
+            # No (or another) token: nothing is done, not even a ping
+            self.assertFalse(client.is_running())
+            with self.assertRaisesRegex(JobError, "token"):
+                client.submit("project")
+            with self.assertRaisesRegex(JobError, "token"):
+                client.shutdown()
+        self.assertEqual(self.server.jobs, {})
+        self.assertTrue(self.client.is_running())
+
+        token_dir = tempfile.mkdtemp()
+        try:
+            self.assertIsNone(read_token(self.port, token_dir))
+            path = write_token(self.server.token, self.port, token_dir)
+            self.assertEqual(path, token_path(self.port, token_dir))
+            if os.name == "posix":
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            self.assertEqual(read_token(self.port, token_dir), self.server.token)
+        finally:
+            shutil.rmtree(token_dir)
+
+    def test_errors(self):
+        with self.assertRaises(JobError):
+            self.client.status("unknown")
+        with self.assertRaises(ValueError):
+            self.client.request("unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
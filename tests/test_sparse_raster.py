@@ -0,0 +1,111 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from untie import TIE_general as TIEgen  # noqa: E402
+from untie import TIE_load as TIEld  # noqa: E402
+
+from tietoolbox.scripts.sparse_raster import (  # noqa: E402
+    SparseRaster,
+    count_neighbours,
+    extract_traces,
+    sort_pixels,
+)
+from tietoolbox.scripts.tie_analysis_dask import TIEDataProcessor  # noqa: E402
+from tietoolbox.scripts.utils import load_dem_window  # noqa: E402
+
+import synthetic  # noqa: E402
+
+
+def lines_raster():
+    """Two kinds of lines: a crossing, a closed line and a short one."""
+    rst = np.full((40, 50), np.nan)
+    rst[10, 2:45] = 1.0
+    rst[3:30, 20] = 1.0
+    rst[25, 0:12] = 2.0
+    rst[30:37, 30] = 2.0
+    rst[30:37, 40] = 2.0
+    rst[30, 30:41] = 2.0
+    rst[36, 30:41] = 2.0
+    rst[0, 47:50] = 2.0
+    return rst
+
+
+class TestSparseRaster(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_dense(self):
+        rst = lines_raster()
+        sparse = SparseRaster.from_dense(rst)
+        self.assertEqual(sparse.nnz, np.count_nonzero(~np.isnan(rst)))
+        np.testing.assert_array_equal(sparse.to_dense(), rst)
+
+        path = os.path.join(self.tmp, "TECrst.npz")
+        sparse.save(path)
+        np.testing.assert_array_equal(SparseRaster.load(path).to_dense(), rst)
+
+    def test_blocks(self):
+        rst = lines_raster()
+        sparse = SparseRaster.from_dense(rst)
+        top = sparse.block((slice(0, 20), slice(None))).place(rst.shape, (0, 0))
+        bottom = sparse.block((slice(20, 40), slice(None))).place(rst.shape, (20, 0))
+        np.testing.assert_array_equal(
+            SparseRaster.merge(rst.shape, [bottom, top]).to_dense(), rst
+        )
+
+    def test_neighbours(self):
+        rst = lines_raster() == 1.0
+        index = np.flatnonzero(rst)
+        np.testing.assert_array_equal(
+            count_neighbours(index, rst.shape),
+            TIEgen.nmbNeighbors(rst.astype(float)).ravel()[index],
+        )
+
+    def test_sort_pixels(self):
+        shape = (40, 50)
+        line = np.flatnonzero(lines_raster() == 2.0)[-20:]
+        np.testing.assert_array_equal(
+            sort_pixels(line, shape), TIEgen.sortLine(line, shape)
+        )
+
+    def test_extract_traces(self):
+        rst = lines_raster()
+        for shape in ("L", "PLG"):
+            expected = TIEld.extractTraces(rst, shape)
+            traces = extract_traces(SparseRaster.from_dense(rst), shape)
+            self.assertEqual(len(traces), len(expected))
+            for tr, exp in zip(traces, expected):
+                self.assertEqual((tr.id, tr.type), (exp.id, exp.type))
+                np.testing.assert_array_equal(tr.index, exp.index)
+
+    def test_rasterize_lines(self):
+        # TECrst of `rasterizeSHP` (0 outside of the extent of the lines)
+        cfg = synthetic.write_project(self.tmp)
+        DEM = load_dem_window(cfg.DEM.source, cfg.bbox)
+        lines = TIEld.adaptSHAPE2DEM(synthetic.lines(150), DEM)
+        raster = TIEld.rasterizeSHP(lines.copy(), "KIND", DEM)
+        self.assertTrue((raster == 0).any())
+
+        rst = (
+            TIEDataProcessor(cfg)
+            .rasterize_shp(lines, "KIND", DEM, "Lines", sparse=True)
+            .compute(scheduler="sync")
+        )
+        self.assertEqual(rst.nnz, np.count_nonzero(np.isin(raster, synthetic.LINE_KINDS)))
+        self.assertLess(rst.nnz, 2 * lines.length.sum() / synthetic.RES)
+        np.testing.assert_array_equal(rst.codes, synthetic.LINE_KINDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
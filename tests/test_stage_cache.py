@@ -0,0 +1,141 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+import geopandas as gpd  # noqa: E402
+import shapely  # noqa: E402
+
+from tietoolbox.scripts import stage_cache  # noqa: E402
+from tietoolbox.scripts.stage_cache import StageCache, cached_stage  # noqa: E402
+
+
+def layer():
+    return gpd.GeoDataFrame(
+        {"KIND": [14901001, 14901002]},
+        geometry=[shapely.LineString([(0, 0), (5, 5)]), shapely.Point(1, 2)],
+        crs="EPSG:2056",
+    )
+
+
+class Stages:
+    """Stands for `TIEDataProcessor`: a cached stage counting its calls."""
+
+    def __init__(self, cache, method="rasterizeSHP"):
+        self.stage_cache = cache
+        self.method = method
+        self.calls = 0
+
+    def stage_params(self, stage):
+        return {"method": self.method}
+
+    @cached_stage
+    def rasterize(self, gdf, DEM):
+        self.calls += 1
+        return {"features": len(gdf), "z": DEM["z"] * 2}
+
+
+class TestStageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = StageCache(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_key(self):
+        DEM = {"z": np.arange(12.0).reshape(3, 4), "x": np.arange(4.0)}
+        key = self.cache.key("rasterize_shp", (layer(), DEM), {}, {"method": "a"})
+        # Same content, other objects
+        DEM2 = {"x": np.arange(4.0), "z": np.arange(12.0).reshape(3, 4)}
+        self.assertEqual(
+            self.cache.key("rasterize_shp", (layer(), DEM2), {}, {"method": "a"}), key
+        )
+
+        changed = layer()
+        changed.loc[1, "KIND"] = 14901003
+        moved = layer().set_geometry([shapely.LineString([(0, 0), (5, 6)])] * 2)
+        z = dict(DEM, z=DEM["z"].astype(np.float32))
+        for args, kwargs, params in (
+            ((changed, DEM), {}, {"method": "a"}),
+            ((moved, DEM), {}, {"method": "a"}),
+            ((layer(), z), {}, {"method": "a"}),
+            ((layer(), DEM), {"sparse": True}, {"method": "a"}),
+            ((layer(), DEM), {}, {"method": "b"}),
+        ):
+            self.assertNotEqual(
+                self.cache.key("rasterize_shp", args, kwargs, params), key
+            )
+        self.assertNotEqual(
+            self.cache.key("tie_analysis", (layer(), DEM), {}, {"method": "a"}), key
+        )
+        version = stage_cache.CACHE_VERSION + 1
+        with mock.patch.object(stage_cache, "CACHE_VERSION", version):
+            self.assertNotEqual(
+                self.cache.key("rasterize_shp", (layer(), DEM), {}, {"method": "a"}),
+                key,
+            )
+
+    def test_cached_stage(self):
+        stages = Stages(self.cache)
+        DEM = {"z": np.ones((2, 2))}
+        first = stages.rasterize(layer(), DEM)
+        second = stages.rasterize(layer(), {"z": np.ones((2, 2))})
+        self.assertEqual(stages.calls, 1)
+        np.testing.assert_array_equal(second["z"], first["z"])
+
+        # Other configuration, other inputs
+        Stages(self.cache, method="rasterizeGPD").rasterize(layer(), DEM)
+        stages.rasterize(layer(), {"z": np.zeros((2, 2))})
+        self.assertEqual(stages.calls, 2)
+        self.assertEqual(len(os.listdir(self.tmp)), 3)
+
+        # No cache: always computed
+        stages.stage_cache = None
+        stages.rasterize(layer(), DEM)
+        self.assertEqual(stages.calls, 3)
+
+    def test_unreadable(self):
+        self.assertEqual(self.cache.load("missing"), (False, None))
+        self.cache.store("entry", {"z": np.arange(1000.0)})
+        with open(self.cache.path("entry"), "rb") as f:
+            content = f.read()
+        for broken in (content[: len(content) // 2], b"", b"not a pickle"):
+            with open(self.cache.path("entry"), "wb") as f:
+                f.write(broken)
+            self.assertEqual(self.cache.load("entry"), (False, None))
+
+        # A miss is computed again and replaces the entry
+        stages = Stages(self.cache)
+        args = (layer(), {"z": np.ones(2)})
+        key = self.cache.key("rasterize", args, {}, stages.stage_params("rasterize"))
+        with open(self.cache.path(key), "wb") as f:
+            f.write(b"\x80\x05truncated")
+        stages.rasterize(layer(), {"z": np.ones(2)})
+        stages.rasterize(layer(), {"z": np.ones(2)})
+        self.assertEqual(stages.calls, 1)
+
+    def test_evict(self):
+        cache = StageCache(self.tmp, max_size_mb=1.0)
+        entry = np.zeros(300 * 1024 // 8)  # ~300 KB
+        for i, key in enumerate("abc"):
+            cache.store(key, entry)
+            os.utime(cache.path(key), (1000 + i, 1000 + i))
+        # 'a' used again: 'b' is now the least recently used
+        self.assertTrue(cache.load("a")[0])
+        cache.store("d", entry)
+        cache.store("e", entry)
+        self.assertEqual(sorted(os.listdir(self.tmp)), ["a.pkl", "d.pkl", "e.pkl"])
+        sizes = [os.path.getsize(cache.path(k)) for k in "ade"]
+        self.assertLessEqual(sum(sizes), 1024**2)
+
+
+if __name__ == "__main__":
+    unittest.main()
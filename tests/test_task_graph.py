@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+import dask  # noqa: E402
+from dask.delayed import delayed  # noqa: E402
+
+from tietoolbox.scripts.task_graph import (  # noqa: E402
+    GraphProfile,
+    critical_path,
+    graph_config,
+    render_graph,
+    topological_order,
+)
+
+
+@delayed
+def slow(x, seconds=0.0):
+    time.sleep(seconds)
+    return x
+
+
+@delayed
+def add(a, b):
+    return a + b
+
+
+def diamond():
+    return add(slow(1, 0.05, dask_key_name="left"), slow(2, dask_key_name="right"))
+
+
+class TestTaskGraph(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_config(self):
+        self.assertEqual(graph_config({}), {"render": "none", "profile": False})
+        with self.assertRaises(ValueError):
+            graph_config({"graph": {"render": "png"}})
+
+    def test_topological_order(self):
+        deps = {"c": {"a", "b"}, "b": {"a"}, "a": set(), "d": set()}
+        self.assertEqual(topological_order(deps), ["a", "b", "c", "d"])
+
+    def test_render(self):
+        path = os.path.join(self.tmp, "graph")
+        self.assertIsNone(render_graph(diamond(), path, "none"))
+        text_path = render_graph(diamond(), path, "text")
+        with open(text_path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "# 3 tasks: key <- dependencies")
+        self.assertEqual(lines[1:3], ["left <- ", "right <- "])
+        self.assertTrue(lines[3].endswith("<- left, right"))
+        html_path = render_graph(diamond(), path, "html")
+        self.assertTrue(html_path.endswith(".html"))
+
+    def test_profile(self):
+        with GraphProfile() as profile:
+            self.assertEqual(dask.compute(diamond(), scheduler="threads"), (3,))
+        path = os.path.join(self.tmp, "profile.json")
+        profile.write(path, scheduler="threads")
+        with open(path) as f:
+            result = json.load(f)
+
+        self.assertEqual(result["scheduler"], "threads")
+        self.assertEqual([t["key"] for t in result["tasks"]][:2], ["left", "right"])
+        left = result["tasks"][0]
+        self.assertGreaterEqual(left["duration"], 0.05)
+        self.assertEqual(result["stages"]["left"]["tasks"], 1)
+        self.assertEqual(result["critical_path"]["keys"][0], "left")
+
+    def test_critical_path(self):
+        tasks = [
+            {"key": "a", "dependencies": [], "duration": 1.0},
+            {"key": "b", "dependencies": [], "duration": 3.0},
+            {"key": "c", "dependencies": ["a", "b"], "duration": 1.0},
+        ]
+        self.assertEqual(critical_path(tasks), {"duration": 4.0, "keys": ["b", "c"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
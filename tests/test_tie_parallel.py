@@ -0,0 +1,106 @@
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from untie import TIE_core as TIEcr  # noqa: E402
+
+from tietoolbox.scripts.sparse_raster import extract_traces  # noqa: E402
+from tietoolbox.scripts.stage_cache import fingerprint  # noqa: E402
+from tietoolbox.scripts.tie_analysis_dask import TIEDataProcessor  # noqa: E402
+from tietoolbox.scripts.tie_parallel import tie_chunked  # noqa: E402
+from tietoolbox.scripts.trace_store import open_traces  # noqa: E402
+
+import synthetic  # noqa: E402
+from test_dem_grid import dem  # noqa: E402
+
+
+class TestTieChunked(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_chunks(self):
+        DEM = dem()
+        rst = np.full(DEM["z"].shape, np.nan)
+        rst[10, 2:45] = 1.0
+        rst[5:35, 30] = 2.0
+        rst[25:27, 5:8] = 3.0
+        rst[33, 10:25] = 4.0
+        traces = extract_traces(rst, "L")
+        self.assertEqual(len(traces), 4)
+        expected = TIEcr.tie(
+            copy.deepcopy(traces), DEM["x"], DEM["y"], np.flipud(DEM["z"]), seg=True
+        )
+
+        # 0 and N: a single call; 1 and 3: chunks in processes (the last one
+        # shorter), results in the order of the traces
+        for chunk_size in (0, len(traces), 1, 3):
+            result = tie_chunked(
+                copy.deepcopy(traces),
+                DEM,
+                seg=True,
+                chunk_size=chunk_size,
+                num_workers=2,
+                tmp_dir=self.tmp,
+            )
+            self.assertEqual([tr.id for tr in result], [tr.id for tr in expected])
+            self.assertEqual(fingerprint(result), fingerprint(expected), chunk_size)
+        # The memory-mapped DEM is removed
+        self.assertEqual(os.listdir(self.tmp), [])
+
+
+
+class TestTieAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def processor(self, name, scheduler, chunk_size):
+        cfg = synthetic.write_project(
+            os.path.join(self.tmp, name),
+            scheduler={"type": scheduler, "num_workers": 2},
+            tie={"chunk_size": chunk_size, "num_workers": 2},
+        )
+        return TIEDataProcessor(cfg)
+
+    def test_chunk_size(self):
+        # Chunks in a pool of the task, unless the tasks run in worker processes
+        for scheduler, chunk_size in (
+            ("threads", 1),
+            ("synchronous", 1),
+            ("processes", 0),
+            ("distributed", 0),
+        ):
+            processor = self.processor(scheduler, scheduler, 1)
+            self.assertEqual(processor.tie_chunk_size, chunk_size, scheduler)
+
+    def test_schedulers(self):
+        expected = self.processor("expected", "synchronous", 0)
+        expected.process_geodata()
+        for scheduler in ("threads", "processes"):
+            processor = self.processor(scheduler, scheduler, 1)
+            processor.process_geodata()
+            for name in ("traces", "faults"):
+                traces = list(open_traces(processor.cache_dir, name))
+                self.assertGreater(len(traces), 1)
+                synthetic.assert_same(
+                    traces,
+                    list(open_traces(expected.cache_dir, name)),
+                    f"{scheduler} {name}",
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
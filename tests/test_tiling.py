@@ -0,0 +1,278 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import rasterio
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from tietoolbox.scripts import tiling  # noqa: E402
+from tietoolbox.scripts.categories import CategoricalRaster  # noqa: E402
+from tietoolbox.scripts.sparse_raster import (  # noqa: E402
+    SparseRaster,
+    extract_traces,
+    sort_pixels,
+)
+from tietoolbox.scripts.tie_analysis_dask import TIEDataProcessor  # noqa: E402
+from tietoolbox.scripts.trace_store import open_dem, open_traces  # noqa: E402
+from tietoolbox.scripts.utils import bbox_window  # noqa: E402
+
+import synthetic  # noqa: E402
+
+
+def tile_raster(rst, tile, grid_window):
+    """Block of a grid raster (flipped frame) read by a tile."""
+    rows, cols = tiling.flipped_offset(tile.window, grid_window)
+    return rst[rows : rows + tile.window[2], cols : cols + tile.window[3]]
+
+
+class TestTiles(unittest.TestCase):
+    grid_window = (10, 7, 95, 130)
+
+    def test_make_tiles(self):
+        tiles = tiling.make_tiles(self.grid_window, 50, 5)
+        # Aligned on multiples of 50 pixels of the DEM; the rows 100-105 are
+        # a sliver merged with their neighbour
+        self.assertEqual(
+            [tile.core for tile in tiles],
+            [
+                (10, 7, 40, 43),
+                (10, 50, 40, 50),
+                (10, 100, 40, 37),
+                (50, 7, 55, 43),
+                (50, 50, 55, 50),
+                (50, 100, 55, 37),
+            ],
+        )
+        # Halo clipped to the grid
+        self.assertEqual(
+            [tile.window for tile in tiles],
+            [
+                (10, 7, 45, 48),
+                (10, 45, 45, 60),
+                (10, 95, 45, 42),
+                (45, 7, 60, 48),
+                (45, 45, 60, 60),
+                (45, 95, 60, 42),
+            ],
+        )
+        self.assertEqual([tile.id for tile in tiles], list(range(6)))
+
+        # A grid smaller than a tile: the halo is clipped away
+        self.assertEqual(
+            tiling.make_tiles((3, 4, 20, 30), 50, 5),
+            [tiling.Tile(0, (3, 4, 20, 30), (3, 4, 20, 30))],
+        )
+
+        # Without halo, the traces crossing the tile borders would be cut
+        for tile_size, halo in ((50, 0), (0, 5), (50, -1)):
+            with self.assertRaises(ValueError):
+                tiling.make_tiles(self.grid_window, tile_size, halo)
+
+    def test_core_block(self):
+        g_row, g_col, height, width = self.grid_window
+        rst = np.arange(height * width, dtype=float).reshape(height, width)
+        tiles = tiling.make_tiles(self.grid_window, 50, 5)
+
+        # The cores partition the grid
+        rebuilt = np.full(rst.shape, np.nan)
+        for tile in tiles:
+            grid_slices, tile_slices = tiling.core_block(tile, self.grid_window)
+            self.assertTrue(np.isnan(rebuilt[grid_slices]).all())
+            block = tile_raster(rst, tile, self.grid_window)
+            rebuilt[grid_slices] = block[tile_slices]
+        np.testing.assert_array_equal(rebuilt, rst)
+
+    def test_indices(self):
+        g_row, g_col, height, width = self.grid_window
+        rst = np.arange(height * width).reshape(height, width)
+        for tile in tiling.make_tiles(self.grid_window, 50, 5):
+            block = tile_raster(rst, tile, self.grid_window)
+            local = np.arange(block.size)
+            grid = tiling.window_to_grid(local, tile.window, self.grid_window)
+            np.testing.assert_array_equal(grid, block.ravel())
+            np.testing.assert_array_equal(
+                tiling.grid_to_window(grid, tile.window, self.grid_window), local
+            )
+            mask = tiling.in_window(rst.ravel(), tile.window, self.grid_window)
+            np.testing.assert_array_equal(np.flatnonzero(mask), np.sort(block.ravel()))
+
+    def test_trace_window(self):
+        g_row, g_col, height, width = self.grid_window
+        # First and last pixels of the flipped frame: south-east and north-west
+        # corners, the padding is clipped to the grid
+        self.assertEqual(
+            tiling.trace_window([0], self.grid_window),
+            (g_row + height - 2, g_col + width - 2, 2, 2),
+        )
+        self.assertEqual(
+            tiling.trace_window([height * width - 1], self.grid_window),
+            (g_row, g_col, 2, 2),
+        )
+        self.assertEqual(
+            tiling.trace_window([0, height * width - 1], self.grid_window, pad=3),
+            self.grid_window,
+        )
+        # Inside: the pixels of the trace plus the padding
+        index = [20 * width + 30, 24 * width + 35]
+        window = tiling.trace_window(index, self.grid_window)
+        self.assertEqual(window, (g_row + height - 26, g_col + width - 37, 7, 8))
+        local = tiling.grid_to_window(index, window, self.grid_window)
+        self.assertTrue(((local >= 0) & (local < 7 * 8)).all())
+
+
+class TestStitch(unittest.TestCase):
+    def test_stitch(self):
+        grid_window = (10, 7, 60, 90)
+        rst = np.full((60, 90), np.nan)
+        rst[30, 10:80] = 1.0  # across both tiles
+        rst[5:20, 60] = 2.0  # in the core of the second one
+        rst[40, 45:55] = 1.0  # in both halos
+        expected = extract_traces(rst, "L")
+
+        tiles = tiling.make_tiles(grid_window, 50, 5)
+        self.assertEqual(len(tiles), 2)
+        interior = []
+        border = []
+        for tile in tiles:
+            traces = extract_traces(tile_raster(rst, tile, grid_window), "L")
+            tile_interior, tile_border = tiling.split_traces(
+                traces, tile.core, tile.window
+            )
+            for tr in tile_interior + tile_border:
+                tr.index = tiling.window_to_grid(tr.index, tile.window, grid_window)
+            interior += tile_interior
+            border += tile_border
+        self.assertEqual(len(interior), 1)
+        self.assertEqual(len(border), 4)
+
+        stitched = tiling.stitch_traces(border, grid_window, sort_line=sort_pixels)
+        self.assertEqual(len(stitched), 2)
+        traces = tiling.renumber(interior + stitched)
+        key = lambda tr: tuple(np.sort(tr.index))  # noqa: E731
+        for tr, exp in zip(sorted(traces, key=key), sorted(expected, key=key)):
+            exp.id = tr.id
+            synthetic.assert_same(tr, exp)
+
+
+class TestTiledAnalysis(unittest.TestCase):
+    tiling = {"enabled": True, "tile_size": 50, "halo": 10}
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def tiles(self, grid_window):
+        return tiling.make_tiles(
+            grid_window,
+            int(self.tiling["tile_size"] / synthetic.RES),
+            int(self.tiling["halo"] / synthetic.RES),
+        )
+
+    def run_project(self, name, **sections):
+        # Tiles are rasterized on the DEM grid
+        cfg = synthetic.write_project(
+            os.path.join(self.tmp, name), rasterize_method="rasterizeGPD", **sections
+        )
+        TIEDataProcessor(cfg).process_geodata()
+        return os.path.join(cfg.project_dir, "cache")
+
+    def test_sizes(self):
+        # Meters, on a DEM of 2 m
+        for tile_size, halo in ((100, 0), (100, 0.8), (1, 10)):
+            cfg = synthetic.write_project(
+                self.tmp,
+                tiling={"enabled": True, "tile_size": tile_size, "halo": halo},
+            )
+            with self.assertRaisesRegex(ValueError, "less than a pixel"):
+                TIEDataProcessor(cfg)
+
+        processor = TIEDataProcessor(
+            synthetic.write_project(self.tmp, tiling=dict(self.tiling, halo=3))
+        )
+        self.assertEqual((processor.tile_pixels, processor.halo_pixels), (25, 2))
+        # Not tiled: not checked
+        TIEDataProcessor(
+            synthetic.write_project(self.tmp, tiling={"enabled": False, "halo": 0})
+        )
+
+    def assertSameOutputs(self, data_dir, expected_dir):
+        np.testing.assert_array_equal(
+            open_dem(data_dir)["z"], open_dem(expected_dir)["z"]
+        )
+        np.testing.assert_array_equal(
+            CategoricalRaster.load(os.path.join(data_dir, "BEDrst")).to_float(),
+            CategoricalRaster.load(os.path.join(expected_dir, "BEDrst")).to_float(),
+        )
+        np.testing.assert_array_equal(
+            SparseRaster.load(os.path.join(data_dir, "TECrst.npz")).to_dense(),
+            SparseRaster.load(os.path.join(expected_dir, "TECrst.npz")).to_dense(),
+        )
+
+        # Same traces, maybe in another order
+        for name in ("traces", "faults"):
+            expected = {tuple(tr.index): tr for tr in open_traces(expected_dir, name)}
+            traces = list(open_traces(data_dir, name))
+            self.assertEqual(len(traces), len(expected))
+            for tr in traces:
+                exp = expected[tuple(tr.index)]
+                tr.id = exp.id
+                synthetic.assert_same(tr, exp, f"{name}[{exp.id}]")
+
+    def test_tiled(self):
+        untiled = self.run_project("untiled")
+        tiled = self.run_project("tiled", tiling=self.tiling)
+        self.assertSameOutputs(tiled, untiled)
+
+        # The S-N fault crosses the tiles: it was stitched
+        margin = int(synthetic.MARGIN / synthetic.RES)
+        grid_window = (margin, margin, 150, 150)
+        fault = max(open_traces(tiled, "faults"), key=lambda tr: tr.index.size)
+        crossed = [
+            tile
+            for tile in self.tiles(grid_window)
+            if tiling.in_window(fault.index, tile.core, grid_window).any()
+        ]
+        self.assertGreater(len(crossed), 1)
+
+    def windows(self, dem_path, bbox):
+        with rasterio.open(dem_path) as src:
+            grid_window = bbox_window(src, bbox)
+        return {tile.window for tile in self.tiles(grid_window)}
+
+    def test_moved_bbox(self):
+        bbox = synthetic.write_project(self.tmp).bbox
+        dem_path = os.path.join(self.tmp, "dem.tif")
+        # Less than a tile: same tile ids; a tile or more (in both directions,
+        # across the ends of the S-N fault): the ids of the tiles change
+        for name, (dx, dy) in (("east", (20, 0)), ("south-west", (-50, -100))):
+            with self.subTest(name):
+                moved = [bbox[0] + dx, bbox[1] + dy, bbox[2] + dx, bbox[3] + dy]
+                self.run_project(name, tiling=self.tiling, cache={"enabled": True})
+                logger = "tietoolbox.scripts.stage_cache"
+                with self.assertLogs(logger, "INFO") as logs:
+                    reused = self.run_project(
+                        name, bbox=moved, tiling=self.tiling, cache={"enabled": True}
+                    )
+                fresh = self.run_project(
+                    f"{name}-fresh", bbox=moved, tiling=self.tiling
+                )
+
+                # The tiles keeping their windows read their rasters (bedrock
+                # and lines) from the stage cache
+                same = self.windows(dem_path, bbox) & self.windows(dem_path, moved)
+                self.assertGreater(len(same), 0)
+                hits = [
+                    msg for msg in logs.output if "rasterize_shp: using cached" in msg
+                ]
+                self.assertEqual(len(hits), 2 * len(same))
+                self.assertSameOutputs(reused, fresh)
+
+if __name__ == "__main__":
+    unittest.main()
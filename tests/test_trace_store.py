@@ -0,0 +1,126 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+from affine import Affine  # noqa: E402
+from rasterio.crs import CRS  # noqa: E402
+from untie import TIE_core as TIEcr  # noqa: E402
+
+from tietoolbox.scripts.sparse_raster import extract_traces  # noqa: E402
+from tietoolbox.scripts.trace_store import (  # noqa: E402
+    TraceStore,
+    load_dem,
+    open_dem,
+    open_traces,
+    save_dem,
+    save_traces,
+)
+
+import synthetic  # noqa: E402
+
+
+def dem(height=40, width=50):
+    rows, cols = np.mgrid[0:height, 0:width]
+    rng = np.random.default_rng(0)
+    z = 1000 + 3.0 * rows + 1.5 * cols + rng.normal(size=(height, width))
+    return {
+        "z": z.astype(np.float32),
+        "x": 2600001.0 + 2.0 * np.arange(width),
+        "y": 1200001.0 + 2.0 * np.arange(height),
+        "meta": {
+            "crs": CRS.from_epsg(2056),
+            "transform": Affine(2.0, 0.0, 2600000.0, 0.0, -2.0, 1200080.0),
+            "nodata": -9999,
+        },
+    }
+
+
+def traces(DEM):
+    """Traces of a bed and a fault crossing it, analysed on `DEM`."""
+    rst = np.full(DEM["z"].shape, np.nan)
+    rst[10, 2:45] = 1.0
+    rst[5:35, 30] = 2.0
+    rst[25:27, 5:8] = 3.0
+    result = TIEcr.tie(
+        extract_traces(rst, "L"), DEM["x"], DEM["y"], np.flipud(DEM["z"]), seg=True
+    )
+    # Kinds of both sides of a bed (see `find_neight_type`)
+    result[0].type = [15203580.0, 15203579.0]
+    return result
+
+
+class TestTraceStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_traces(self):
+        original = traces(dem())
+        self.assertGreater(sum(len(tr.Segment) for tr in original), 0)
+        self.assertTrue(any(seg.Chords for tr in original for seg in tr.Segment))
+
+        directory = os.path.join(self.tmp, "traces")
+        save_traces(original, directory)
+        store = TraceStore(directory)
+        self.assertEqual(len(store), len(original))
+        self.assertEqual(list(store.column("trace_id")), [tr.id for tr in original])
+        for i, tr in enumerate(original):
+            np.testing.assert_array_equal(store.index(i), tr.index)
+            synthetic.assert_same(store[i], tr, f"traces[{i}]")
+        # Negative indices and iteration
+        synthetic.assert_same(store[-1], original[-1])
+        synthetic.assert_same(list(store), original)
+
+        save_traces([], os.path.join(self.tmp, "empty"))
+        self.assertEqual(list(TraceStore(os.path.join(self.tmp, "empty"))), [])
+
+    def test_dem(self):
+        DEM = dem()
+        directory = os.path.join(self.tmp, "DEM")
+        save_dem(DEM, directory)
+        loaded = load_dem(directory)
+        self.assertIsInstance(loaded["z"], np.memmap)
+        self.assertEqual(loaded["z"].dtype, np.float32)
+        for name in ("z", "x", "y"):
+            np.testing.assert_array_equal(loaded[name], DEM[name])
+        self.assertEqual(loaded["meta"]["crs"], DEM["meta"]["crs"])
+        self.assertEqual(loaded["meta"]["transform"], DEM["meta"]["transform"])
+        self.assertEqual(loaded["meta"]["nodata"], -9999.0)
+        self.assertNotIsInstance(load_dem(directory, mmap_mode=None)["z"], np.memmap)
+
+    def test_legacy(self):
+        DEM = dem()
+        original = traces(DEM)
+        with open(os.path.join(self.tmp, "traces.pkl"), "wb") as f:
+            pickle.dump(original, f)
+        with open(os.path.join(self.tmp, "DEM.pkl"), "wb") as f:
+            pickle.dump(DEM, f)
+
+        legacy = open_traces(self.tmp, "traces")
+        self.assertIsInstance(legacy, list)
+        synthetic.assert_same(legacy, original)
+        np.testing.assert_array_equal(open_dem(self.tmp)["z"], DEM["z"])
+
+        # The stores take precedence over the pickles
+        save_traces(original[:1], os.path.join(self.tmp, "traces"))
+        save_dem(dict(DEM, z=DEM["z"] + 1), os.path.join(self.tmp, "DEM"))
+        self.assertIsInstance(open_traces(self.tmp, "traces"), TraceStore)
+        self.assertEqual(len(open_traces(self.tmp, "traces")), 1)
+        np.testing.assert_array_equal(open_dem(self.tmp)["z"], DEM["z"] + 1)
+
+        with self.assertRaises(FileNotFoundError):
+            open_traces(self.tmp, "faults")
+
+
+if __name__ == "__main__":
+    unittest.main()
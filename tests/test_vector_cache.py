@@ -0,0 +1,158 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+TOOLBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "toolbox")
+sys.path.insert(0, TOOLBOX_DIR)
+
+import geopandas as gpd  # noqa: E402
+from shapely.geometry import LineString  # noqa: E402
+
+from tietoolbox.scripts import vector_cache  # noqa: E402
+from tietoolbox.scripts.utils import read_layer  # noqa: E402
+from tietoolbox.scripts.vector_cache import VectorCache  # noqa: E402
+
+import synthetic  # noqa: E402
+
+X0, Y0 = synthetic.X0, synthetic.Y0
+
+
+def lines():
+    """Lines along x, 10 m apart, of alternating kinds."""
+    return gpd.GeoDataFrame(
+        {
+            "KIND": [14901001, 14901002] * 10,
+            "OTHER": list(range(20)),
+        },
+        geometry=[
+            LineString([(X0, Y0 + 10 * i), (X0 + 100, Y0 + 10 * i + 5)])
+            for i in range(20)
+        ],
+        crs="EPSG:2056",
+    )
+
+
+class TestVectorCache(unittest.TestCase):
+    bbox = [X0, Y0 + 20, X0 + 100, Y0 + 150]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, "geo.gpkg")
+        lines().to_file(self.source, layer="Lines", driver="GPKG")
+        self.lyr_cfg = {
+            "source": self.source,
+            "layer": "Lines",
+            "attribute": "KIND",
+            "where": None,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read(self, bbox, **lyr_cfg):
+        lyr_cfg = dict(self.lyr_cfg, **lyr_cfg)
+        return read_layer(
+            lyr_cfg["source"],
+            lyr_cfg["layer"],
+            columns=[lyr_cfg["attribute"]],
+            bbox=bbox,
+            where=lyr_cfg["where"],
+        )
+
+    def cache(self):
+        cache = VectorCache(os.path.join(self.tmp, "cache"), "flatgeobuf")
+        cache.store(self.read(self.bbox), self.lyr_cfg, self.bbox)
+        return cache
+
+    def assertFrameEqual(self, loaded, expected):
+        self.assertIsNotNone(loaded)
+        self.assertEqual(list(loaded.columns), list(expected.columns))
+        self.assertEqual(list(loaded["KIND"]), list(expected["KIND"]))
+        self.assertTrue(loaded.geometry.geom_equals(expected.geometry).all())
+
+    def test_load(self):
+        cache = self.cache()
+        self.assertFrameEqual(cache.load(self.lyr_cfg, self.bbox), self.read(self.bbox))
+        # A bbox inside the one of the copy: the features of a read with it
+        inner = [X0 + 10, Y0 + 42, X0 + 50, Y0 + 90]
+        self.assertFrameEqual(cache.load(self.lyr_cfg, inner), self.read(inner))
+        # Outside: to be read from the source
+        for bbox in ([X0, Y0, X0 + 100, Y0 + 150], [X0, Y0 + 20, X0 + 101, Y0 + 150]):
+            self.assertIsNone(cache.load(self.lyr_cfg, bbox))
+
+        self.assertIsNone(VectorCache(self.tmp).load(self.lyr_cfg, self.bbox))
+
+    def test_query(self):
+        cache = self.cache()
+        for changed in (
+            {"attribute": "OTHER"},
+            {"where": "KIND = 14901001"},
+            {"layer": "Other"},
+        ):
+            self.assertIsNone(cache.load(dict(self.lyr_cfg, **changed), self.bbox))
+
+        where = dict(self.lyr_cfg, where="KIND = 14901001")
+        cache.store(self.read(self.bbox, where=where["where"]), where, self.bbox)
+        self.assertFrameEqual(
+            cache.load(where, self.bbox), self.read(self.bbox, where=where["where"])
+        )
+        # Its own copy: the one without filter is kept
+        self.assertNotEqual(cache.path(where), cache.path(self.lyr_cfg))
+        self.assertFrameEqual(cache.load(self.lyr_cfg, self.bbox), self.read(self.bbox))
+
+    def test_same_layer(self):
+        # 'Lines' of another source: its own copy
+        other = dict(self.lyr_cfg, source=os.path.join(self.tmp, "other.gpkg"))
+        lines().iloc[::2].to_file(other["source"], layer="Lines", driver="GPKG")
+        cache = self.cache()
+        cache.store(self.read(self.bbox, **other), other, self.bbox)
+        self.assertNotEqual(cache.path(other), cache.path(self.lyr_cfg))
+        for lyr_cfg in (self.lyr_cfg, other):
+            self.assertFrameEqual(
+                cache.load(lyr_cfg, self.bbox), self.read(self.bbox, **lyr_cfg)
+            )
+
+    def test_source(self):
+        cache = self.cache()
+        # Touched: the copy may be stale
+        stat = os.stat(self.source)
+        os.utime(self.source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertIsNone(cache.load(self.lyr_cfg, self.bbox))
+
+        # Edited: other features
+        cache = self.cache()
+        edited = lines()
+        edited.loc[5, "KIND"] = 14901003
+        edited.to_file(self.source, layer="Lines", driver="GPKG")
+        self.assertIsNone(cache.load(self.lyr_cfg, self.bbox))
+        cache.store(self.read(self.bbox), self.lyr_cfg, self.bbox)
+        loaded = cache.load(self.lyr_cfg, self.bbox)
+        self.assertIn(14901003, list(loaded["KIND"]))
+
+    def test_unreadable(self):
+        cache = self.cache()
+        with open(cache.path(self.lyr_cfg), "wb") as f:
+            f.write(b"not a FlatGeobuf")
+        self.assertIsNone(cache.load(self.lyr_cfg, self.bbox))
+
+    def test_without_arrow(self):
+        directory = os.path.join(self.tmp, "cache")
+        with mock.patch.object(vector_cache, "has_arrow", return_value=False):
+            cache = VectorCache(directory, "parquet")
+        self.assertEqual(cache.format, "flatgeobuf")
+        self.assertTrue(cache.path(self.lyr_cfg).endswith(".fgb"))
+        cache.store(self.read(self.bbox), self.lyr_cfg, self.bbox)
+        self.assertFrameEqual(cache.load(self.lyr_cfg, self.bbox), self.read(self.bbox))
+
+        with mock.patch.object(vector_cache, "has_arrow", return_value=True):
+            self.assertEqual(VectorCache(directory, "parquet").format, "parquet")
+        self.assertFalse(VectorCache(directory).enabled)
+        with self.assertRaises(ValueError):
+            VectorCache(directory, "shapefile")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -39,6 +39,9 @@ setup(
         "untie>=0.0.8",
         "geocover_utils>=0.4.0",
     ],
+    extras_require={
+        "distributed": ["distributed"],
+    },
     package_data={
         "tietoolbox": [
             "esri/toolboxes/*",
@@ -73,6 +76,8 @@ setup(
         "console_scripts": [
             "tie_analysis = tietoolbox.scripts.tie_analysis_dask:main",
             "tie_viewver = tietoolbox.scripts.tie_viewer:main",
+            "tie_server = tietoolbox.scripts.tie_server:main",
+            "tie_batch = tietoolbox.scripts.tie_batch:main",
         ],
     },
 )
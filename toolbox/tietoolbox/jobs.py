@@ -0,0 +1,178 @@
+# ruff: noqa: UP032, UP004
+# UP032 Use f-string instead of `format` call (python2!)
+# UP004 [*] Class `...` inherits from `object` (python2!)
+"""
+Wire protocol of the analysis server (`scripts/tie_server.py`).
+
+The server listens on a local TCP port (127.0.0.1 only). A request is one
+JSON object on one line, answered by one JSON object on one line, then the
+connection is closed::
+
+    -> {"action": "submit", "token": "9a1e...",
+        "config": "D:/Projects/Toto/config.json"}
+    <- {"ok": true, "job": "5f0c..."}
+    -> {"action": "status", "job": "5f0c..."}
+    <- {"ok": true, "job": "5f0c...", "state": "running",
+        "progress": {"event": "progress", "percent": 31.3, ...}}
+
+Actions: 'ping', 'submit' (`config`: path of the config file,
+`log_level`), 'status', 'cancel' and 'result' (`job`), 'shutdown'.
+Job states: 'queued', 'running', 'done', 'failed' and 'cancelled'.
+`progress` is the last progress event of the job (see `tietoolbox.progress`).
+A failed request is answered with ``{"ok": false, "error": "..."}``.
+
+Every request holds the `token` of the server: a secret generated when the
+server starts, written to the profile directory of its user
+(``~/.tietoolbox/server_<port>.token``, readable by this user only). Only
+this user can submit jobs or stop the server.
+
+Python 2 compatible, without arcpy.
+"""
+
+import binascii
+import io
+import json
+import os
+import socket
+
+PROTOCOL_VERSION = 1
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+ACTIONS = ("ping", "submit", "status", "cancel", "result", "shutdown")
+STATES = ("queued", "running", "done", "failed", "cancelled")
+FINAL_STATES = ("done", "failed", "cancelled")
+
+TOKEN_DIR = os.path.join(os.path.expanduser("~"), ".tietoolbox")
+
+
+class JobError(Exception):
+    """Error answered by the server, or server not reachable."""
+
+
+class JobCancelled(Exception):
+    """Raised in the server when a running job is cancelled."""
+
+
+def encode_message(message):
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+
+def decode_message(line):
+    message = json.loads(line.decode("utf-8"))
+    if not isinstance(message, dict):
+        raise ValueError("Not a JSON object: {!r}".format(line))
+    return message
+
+
+def token_path(port, token_dir=None):
+    """File of the token of the server on `port`."""
+    return os.path.join(token_dir or TOKEN_DIR, "server_{}.token".format(port))
+
+
+def new_token():
+    return binascii.hexlify(os.urandom(32)).decode("ascii")
+
+
+def write_token(token, port, token_dir=None):
+    """Write the token of the server on `port`, readable by its user only."""
+    path = token_path(port, token_dir)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with io.open(fd, "w", encoding="ascii") as f:
+        f.write(token)
+    return path
+
+
+def read_token(port, token_dir=None):
+    """Token of the server on `port` started by this user, None if there is none."""
+    try:
+        with io.open(token_path(port, token_dir), encoding="ascii") as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+class JobClient(object):
+    """Client of the analysis server on `host`:`port`.
+
+    `token`: token of the server, default the one written by the server of
+    this user on `port` (see `read_token`).
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=10.0, token=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.token = token
+
+    def request(self, action, **fields):
+        """Send a request, return the answer of the server."""
+        if action not in ACTIONS:
+            raise ValueError("Unknown action '{}'".format(action))
+        token = self.token or read_token(self.port)
+        if token is None:
+            raise JobError(
+                "No token of an analysis server of this user on port {}".format(
+                    self.port
+                )
+            )
+        fields["action"] = action
+        fields["v"] = PROTOCOL_VERSION
+        fields["token"] = token
+        try:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+        except (socket.error, OSError) as e:
+            raise JobError(
+                "Analysis server {}:{} not reachable: {}".format(
+                    self.host, self.port, e
+                )
+            )
+        try:
+            sock.sendall(encode_message(fields))
+            reader = sock.makefile("rb")
+            try:
+                line = reader.readline()
+            finally:
+                reader.close()
+        except (socket.error, OSError) as e:
+            raise JobError("Request '{}' failed: {}".format(action, e))
+        finally:
+            sock.close()
+
+        if not line:
+            raise JobError("No answer to request '{}'".format(action))
+        try:
+            answer = decode_message(line)
+        except ValueError as e:
+            raise JobError("Invalid answer to request '{}': {}".format(action, e))
+        if not answer.get("ok"):
+            raise JobError(answer.get("error", "Request '{}' failed".format(action)))
+        return answer
+
+    def is_running(self):
+        """True if the server answers."""
+        try:
+            self.request("ping")
+            return True
+        except JobError:
+            return False
+
+    def submit(self, config, log_level="INFO"):
+        """Queue an analysis of `config` (path), return the job id."""
+        return self.request("submit", config=config, log_level=log_level)["job"]
+
+    def status(self, job):
+        return self.request("status", job=job)
+
+    def cancel(self, job):
+        return self.request("cancel", job=job)
+
+    def result(self, job):
+        return self.request("result", job=job)
+
+    def shutdown(self):
+        return self.request("shutdown")
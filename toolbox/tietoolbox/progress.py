@@ -0,0 +1,171 @@
+# ruff: noqa: UP032, UP004
+# UP032 Use f-string instead of `format` call (python2!)
+# UP004 [*] Class `...` inherits from `object` (python2!)
+"""
+Progress events of the analysis, sent from the analysis script to the toolbox.
+
+The analysis script (`tie_analysis_dask.py --progress-file PATH`) writes one
+JSON object per line to PATH, besides its log on stdout::
+
+    {"v": 1, "event": "start", "time": 1700000000.0, "total": 383}
+    {"v": 1, "event": "progress", "time": ..., "stage": "extract_traces",
+     "stage_done": 3, "stage_total": 32, "done": 120, "total": 383,
+     "percent": 31.3, "elapsed": 12.1, "eta": 26.6}
+    {"v": 1, "event": "end", "time": ..., "status": "ok", "elapsed": 40.2}
+
+`done` and `total` count the tasks of the dask graph, `stage_*` the tasks of
+the current stage, `elapsed` and `eta` are in seconds. `status` is 'ok' or
+'error' (with a `message`).
+
+The toolbox side (`Runner`) reads the file while the script runs with
+`ProgressReader` and forwards the events through a `ProgressThrottle`.
+Python 2 compatible, without arcpy.
+"""
+
+import io
+import json
+import time
+
+PROTOCOL_VERSION = 1
+
+EVENTS = ("start", "progress", "end")
+
+
+def make_event(event, **fields):
+    """Event record, timestamped."""
+    if event not in EVENTS:
+        raise ValueError("Unknown progress event '{}'".format(event))
+    record = {"v": PROTOCOL_VERSION, "event": event, "time": time.time()}
+    record.update(fields)
+    return record
+
+
+def encode_event(event, **fields):
+    """JSON line (with its newline) of an event."""
+    return json.dumps(make_event(event, **fields)) + "\n"
+
+
+def parse_event(line):
+    """Event of a JSON line, None if the line is not a valid event."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or record.get("event") not in EVENTS:
+        return None
+    return record
+
+
+class ProgressWriter(object):
+    """Write the progress events to `path` (truncated)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = io.open(path, "w", encoding="utf-8")
+
+    def emit(self, event, **fields):
+        # One complete line per write: the reader never parses half an event
+        self._file.write(u"" + encode_event(event, **fields))
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ProgressReader(object):
+    """Read the events appended to `path` since the last call.
+
+    The file may not exist yet, and its last line may still be being written:
+    it is kept until completed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._offset = 0
+        self._pending = b""
+
+    def read(self):
+        """New events, in order."""
+        try:
+            with io.open(self.path, "rb") as f:
+                f.seek(0, io.SEEK_END)
+                if f.tell() < self._offset:
+                    # Truncated: written by a new run
+                    self._offset = 0
+                    self._pending = b""
+                f.seek(self._offset)
+                data = f.read()
+        except (IOError, OSError):
+            return []
+        self._offset += len(data)
+
+        lines = (self._pending + data).split(b"\n")
+        self._pending = lines.pop()
+        events = []
+        for line in lines:
+            event = parse_event(line.decode("utf-8", "replace"))
+            if event is not None:
+                events.append(event)
+        return events
+
+
+class ProgressThrottle(object):
+    """Forward the events to `callback`, 'progress' ones at most every `interval` s.
+
+    'start' and 'end' events are always forwarded, after the last skipped
+    'progress' event, if any.
+    """
+
+    def __init__(self, callback, interval=0.5, clock=time.time):
+        self.callback = callback
+        self.interval = interval
+        self.clock = clock
+        self._sent = None
+        self._skipped = None
+
+    def update(self, event):
+        if event.get("event") != "progress":
+            self.flush()
+            self._send(event)
+            return
+        now = self.clock()
+        if self._sent is None or now - self._sent >= self.interval:
+            self._send(event)
+        else:
+            self._skipped = event
+
+    def flush(self):
+        """Forward the last skipped event."""
+        if self._skipped is not None:
+            self._send(self._skipped)
+
+    def _send(self, event):
+        self._skipped = None
+        self._sent = self.clock()
+        self.callback(event)
+
+
+def format_event(event):
+    """Short description of an event, e.g. for a progress label."""
+    kind = event.get("event")
+    if kind == "start":
+        return "Starting ({} tasks)".format(event.get("total"))
+    if kind == "end":
+        if event.get("status") == "ok":
+            return "Done in {:.0f}s".format(event.get("elapsed") or 0)
+        return "Failed: {}".format(event.get("message", ""))
+    eta = event.get("eta")
+    return "{} ({}/{}) {:.0f}%{}".format(
+        event.get("stage"),
+        event.get("stage_done"),
+        event.get("stage_total"),
+        event.get("percent") or 0,
+        ", {:.0f}s left".format(eta) if eta is not None else "",
+    )
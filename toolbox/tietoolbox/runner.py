@@ -3,14 +3,25 @@ from __future__ import print_function
 import sys
 import platform
 import os
+import time
 
 import threading
 import queue
 
-import arcpy
+try:
+    import arcpy
+
+    ExecuteError = arcpy.ExecuteError
+except ImportError:
+    # Outside of ArcGIS (tests)
+    arcpy = None
+    ExecuteError = RuntimeError
 
 from subprocess import CalledProcessError, Popen, PIPE, STDOUT
 
+from tietoolbox.jobs import FINAL_STATES
+from tietoolbox.progress import ProgressReader, ProgressThrottle
+
 sys.dont_write_bytecode = True
 
 
@@ -42,10 +53,29 @@ class Runner(object):
 
         self.cancel_op = False
         self.default_callback = default_callback
+        # Last progress event of the running analysis
+        self.progress = None
+        # Final status of the last job run on the analysis server
+        self.job = None
 
     def running(
-        self, cmd, working_dir=None, timeout_sec=5, callback=None, minimized=False
+        self,
+        cmd,
+        working_dir=None,
+        timeout_sec=0.2,
+        callback=None,
+        minimized=False,
+        progress_file=None,
+        on_progress=None,
+        progress_interval=0.5,
     ):
+        """Run `cmd`, sending its output lines to `callback`.
+
+        If `progress_file` is given, the progress events the command writes to
+        it (see `tietoolbox.progress`) are sent to `on_progress`, at most
+        every `progress_interval` seconds. `timeout_sec` is the polling
+        interval of the output and of the progress file.
+        """
         def t_read_stdout(process, queue):
             """Read from stdout"""
 
@@ -58,6 +88,9 @@ class Runner(object):
             working_dir = os.path.dirname(os.path.realpath(__file__))
         if callback is None:
             callback = self.default_callback
+        if progress_file is not None and os.path.exists(progress_file):
+            # Events of a former run
+            os.remove(progress_file)
 
         try:
             if minimized:
@@ -91,7 +124,15 @@ class Runner(object):
             t_stdout.daemon = True
             t_stdout.start()
 
+            progress = None
+            if progress_file is not None:
+                progress = self._progress_reader(
+                    progress_file, on_progress, progress_interval
+                )
+
             while process.poll() is None or not q.empty():
+                if progress is not None:
+                    progress()
                 try:
                     output = q.get(timeout=timeout_sec)
 
@@ -104,6 +145,8 @@ class Runner(object):
                 (callback(">>> {}".format(output.rstrip())),)
 
             t_stdout.join()
+            if progress is not None:
+                progress(final=True)
             return 0
 
         except (OSError, ValueError, CalledProcessError) as err:
@@ -113,13 +156,93 @@ class Runner(object):
         if process.returncode != 0:
             callback("Command failed %d %s %s" % (process.returncode, output, error))
 
-            raise arcpy.ExecuteError(
+            raise ExecuteError(
                 "Command failed %d %s %s" % (process.returncode, output, error)
             )
         else:
             callback(output)
             return output
 
+    def _progress_reader(self, progress_file, on_progress, interval):
+        """Function forwarding the new events of `progress_file`."""
+        reader = ProgressReader(progress_file)
+
+        def forward(event):
+            self.progress = event
+            if on_progress is not None:
+                on_progress(event)
+
+        throttle = ProgressThrottle(forward, interval=interval)
+
+        def poll(final=False):
+            for event in reader.read():
+                throttle.update(event)
+            if final:
+                throttle.flush()
+
+        return poll
+
+    def run_job(
+        self,
+        client,
+        config_file,
+        log_level="INFO",
+        callback=None,
+        on_progress=None,
+        is_cancelled=None,
+        poll_sec=0.2,
+        progress_interval=0.5,
+    ):
+        """Run the analysis of `config_file` on the analysis server of `client`.
+
+        The progress events are sent to `on_progress` as with `running`. The
+        job is cancelled when `is_cancelled()` returns True or `cancel_op` is
+        set. The final state of the job is kept in `self.job`.
+        Returns 0 if completes without error, 1 if the job failed, 2 if it was
+        cancelled.
+        """
+        if callback is None:
+            callback = self.default_callback
+
+        def forward(event):
+            self.progress = event
+            if on_progress is not None:
+                on_progress(event)
+
+        throttle = ProgressThrottle(forward, interval=progress_interval)
+
+        job = client.submit(config_file, log_level=log_level)
+        callback("Job {} submitted to the analysis server".format(job))
+        cancelling = False
+        last = None
+        while True:
+            status = client.status(job)
+            event = status.get("progress")
+            if event is not None and event != last:
+                throttle.update(event)
+                last = event
+            if status["state"] in FINAL_STATES:
+                break
+            if not cancelling and (
+                self.cancel_op or (is_cancelled is not None and is_cancelled())
+            ):
+                callback("Cancelling job {}".format(job))
+                client.cancel(job)
+                cancelling = True
+            time.sleep(poll_sec)
+        throttle.flush()
+
+        self.cancel_op = False
+        self.job = client.result(job)
+        state = self.job["state"]
+        if state == "failed":
+            callback("Job {} failed: {}".format(job, self.job.get("error")))
+            return 1
+        if state == "cancelled":
+            callback("Job {} cancelled".format(job))
+            return 2
+        return 0
+
     def run_tool(self, args, callback=None, working_dir=None):
         """
           Runs a tool and specifies tool arguments.
@@ -0,0 +1,152 @@
+"""
+Categorical rasters: the bedrock formations and the kinds of tectonic lines.
+
+`TIE_load` rasterizes their codes (e.g. 15202600, a formation) as float64, NaN
+where there is no geometry. Here a pixel holds the position (from 1) of its
+code in a lookup table, `codes` (sorted), in the smallest unsigned integer
+dtype holding all the positions, and `NODATA` (0) where there is no geometry:
+uint8 up to 255 codes, 8 times smaller than float64.
+
+The rasters are saved as such (``BEDrst.npy``, GeoTIFF with `NODATA` as
+nodata) with their lookup table (``BEDrst.json``): the position, the code and
+its label in the legend (see ``symbols.tsv``) of each category.
+`CategoricalRaster.to_float` gives the float64 raster to the functions of
+untie.
+"""
+
+import json
+import os
+
+import numpy as np
+
+NODATA = 0
+
+LEGEND_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "symbols.tsv")
+
+
+def category_dtype(n_codes):
+    """Smallest unsigned integer dtype holding `n_codes` positions and NODATA."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_codes <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def layer_codes(gdf, attribute):
+    """Sorted codes of the `attribute` of the features."""
+    values = np.asarray(gdf[attribute], dtype=float)
+    return np.unique(values[~np.isnan(values)])
+
+
+def encode(values, codes):
+    """Positions (from 1) of `values` in `codes`, NODATA for NaN."""
+    values = np.asarray(values, dtype=float)
+    data = np.full(values.shape, NODATA, dtype=category_dtype(len(codes)))
+    valid = ~np.isnan(values)
+    data[valid] = np.searchsorted(codes, values[valid]) + 1
+    return data
+
+
+def read_legend(legendfile=LEGEND_FILE):
+    """{code: label} of a legend (e.g. symbols.tsv): code, R, G, B, label."""
+    labels = {}
+    try:
+        with open(legendfile, encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) >= 5:
+                    # First label of a code, like the colours (see bed2cmap)
+                    labels.setdefault(float(fields[0]), fields[4])
+    except (OSError, ValueError):
+        pass
+    return labels
+
+
+def lookup_table(codes, legendfile=LEGEND_FILE):
+    """Position, code and label of the categories (see `save`)."""
+    labels = read_legend(legendfile)
+    return {
+        "nodata": NODATA,
+        "categories": [
+            {"value": i, "code": code, "label": labels.get(code)}
+            for i, code in enumerate(np.asarray(codes).tolist(), start=1)
+        ],
+    }
+
+
+def load_codes(path):
+    """Codes of a lookup table written by `save`."""
+    with open(path) as f:
+        table = json.load(f)
+    return np.array([c["code"] for c in table["categories"]], dtype=float)
+
+
+def tif_tags(codes):
+    """Tags of a GeoTIFF band: its lookup table (codes by position, from 1)."""
+    return {"CATEGORY_CODES": json.dumps(np.asarray(codes).tolist())}
+
+
+class CategoricalRaster:
+    """Raster of the positions `data` of the `codes` of its pixels."""
+
+    def __init__(self, data, codes):
+        self.data = data
+        self.codes = np.asarray(codes, dtype=float)
+
+    @classmethod
+    def from_float(cls, arr, codes=()):
+        """Raster of the codes `arr`, NaN where there is none.
+
+        The lookup table holds `codes` and the codes of `arr`.
+        """
+        arr = np.asarray(arr)
+        codes = np.union1d(np.asarray(codes, dtype=float), arr[~np.isnan(arr)])
+        return cls(encode(arr, codes), codes)
+
+    def to_float(self):
+        """The codes, NaN where there is none (like `TIE_load.rasterizeSHP`)."""
+        return np.concatenate(([np.nan], self.codes))[self.data]
+
+    def recode(self, codes):
+        """The raster with the lookup table `codes`, holding those of the raster."""
+        codes = np.asarray(codes, dtype=float)
+        positions = np.concatenate(([NODATA], np.searchsorted(codes, self.codes) + 1))
+        return CategoricalRaster(
+            positions.astype(category_dtype(len(codes)))[self.data], codes
+        )
+
+    @property
+    def shape(self):
+        return np.shape(self.data)
+
+    @property
+    def size(self):
+        return np.size(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.codes.nbytes
+
+    def __repr__(self):
+        return (
+            f"CategoricalRaster(shape={self.shape}, dtype={self.data.dtype}, "
+            f"codes={self.codes.size})"
+        )
+
+    def save_table(self, path, legendfile=LEGEND_FILE):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(lookup_table(self.codes, legendfile), f, indent=2)
+
+    def save(self, path):
+        """Write ``<path>.npy`` and its lookup table ``<path>.json``."""
+        np.save(f"{path}.npy", self.data)
+        self.save_table(f"{path}.json")
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Raster written by `save`, or a float64 raster (``<path>.npy``)."""
+        data = np.load(f"{path}.npy", mmap_mode=mmap_mode)
+        if not os.path.exists(f"{path}.json"):
+            # Written before the lookup tables
+            return cls.from_float(data)
+        return cls(data, load_codes(f"{path}.json"))
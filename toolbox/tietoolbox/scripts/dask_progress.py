@@ -0,0 +1,66 @@
+"""
+Progress events (see `tietoolbox.progress`) and cancellation of the dask graph.
+
+`DaskProgress` and `CancelCallback` are dask callbacks: they work with the
+local schedulers ('threads', 'processes', 'synchronous'), whose callbacks run
+in the process calling `dask.compute`. The 'distributed' scheduler does not
+call them: only the 'end' event, written by the script, is then sent, and the
+analysis cannot be cancelled.
+"""
+
+import time
+from collections import Counter
+
+from dask.callbacks import Callback
+from dask.utils import key_split
+
+from tietoolbox.jobs import JobCancelled
+
+
+class DaskProgress(Callback):
+    """Write the 'start' event and a 'progress' event per task to `writer`."""
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def _start_state(self, dsk, state):
+        self.start = time.perf_counter()
+        self.stage_total = Counter(key_split(key) for key in dsk)
+        self.stage_done = Counter()
+        self.total = len(dsk)
+        self.done = 0
+        self.writer.emit("start", total=self.total)
+
+    def _posttask(self, key, result, dsk, state, worker_id):
+        stage = key_split(key)
+        self.done += 1
+        self.stage_done[stage] += 1
+
+        elapsed = time.perf_counter() - self.start
+        self.writer.emit(
+            "progress",
+            stage=stage,
+            stage_done=self.stage_done[stage],
+            stage_total=self.stage_total[stage],
+            done=self.done,
+            total=self.total,
+            percent=round(100.0 * self.done / self.total, 1),
+            elapsed=round(elapsed, 2),
+            eta=round(elapsed / self.done * (self.total - self.done), 1),
+        )
+
+
+class CancelCallback(Callback):
+    """Abort the computation before the next task once `event` is set.
+
+    The running tasks are not interrupted.
+    """
+
+    def __init__(self, event):
+        super().__init__()
+        self.event = event
+
+    def _pretask(self, key, dsk, state):
+        if self.event.is_set():
+            raise JobCancelled(f"Cancelled before {key_split(key)}")
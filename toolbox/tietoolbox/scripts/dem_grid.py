@@ -0,0 +1,110 @@
+"""
+Orientation of the DEM and of the rasters of the pipeline.
+
+A DEM dict ('z', 'x', 'y' and 'meta', see `utils.read_dem_window`) holds `z`
+north-up, as read from the GeoTIFF: rows from north to south, columns from
+west to east. `x` and `y` are ascending. Its consumers see it in three frames:
+
+- 'north-up': `z` itself (GeoTIFF outputs);
+- 'south-up': rows from south to north, the orientation of ``np.meshgrid(x,
+  y)`` (`TIE_core.tie` input, 3D views);
+- 'flipped': ``np.flip(z, (0, 1))``, the frame of the rasters of `TIE_load`
+  and of the linear indices of the traces (see `tiling`).
+
+`DEMGrid` hands out views of the arrays in these frames and computes the
+coordinates of trace indices from `x` and `y`, instead of DEM sized
+meshgrids and flipped copies.
+"""
+
+import numpy as np
+
+FRAMES = ("north-up", "south-up", "flipped")
+
+
+def orient(arr, frame):
+    """View of the north-up `arr` in `frame`, or of `arr` in `frame` north-up.
+
+    The flips being their own inverse, the same views go both ways.
+    """
+    if frame == "north-up":
+        return arr
+    if frame == "south-up":
+        return arr[::-1]
+    if frame == "flipped":
+        return arr[::-1, ::-1]
+    raise ValueError(f"Unknown frame '{frame}', expected one of {FRAMES}")
+
+
+class _FlatLookup:
+    """Stands for the flattened matrix of a coordinate, in the flipped frame.
+
+    `TIE_core` only indexes ``m.flatten()`` with the trace indices: the values
+    are looked up on indexing, without the matrix.
+    """
+
+    def __init__(self, lookup):
+        self._lookup = lookup
+
+    def flatten(self):
+        return self
+
+    def __getitem__(self, index):
+        return self._lookup(index)
+
+
+class DEMGrid:
+    """The DEM of a DEM dict, without copy of its arrays."""
+
+    def __init__(self, z, x, y, meta=None):
+        self.z = z
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.meta = meta
+
+    @classmethod
+    def from_dem(cls, DEM):
+        return cls(DEM["z"], DEM["x"], DEM["y"], DEM.get("meta"))
+
+    @property
+    def shape(self):
+        return np.shape(self.z)
+
+    def view(self, frame="flipped"):
+        """`z` in `frame`."""
+        return orient(self.z, frame)
+
+    def mesh(self, frame="south-up"):
+        """Read-only views of the x and y matrices in `frame`.
+
+        Same values as ``np.meshgrid(x, y)`` ('south-up'), broadcast rather
+        than allocated.
+        """
+        mx = np.broadcast_to(self.x, self.shape)
+        my = np.broadcast_to(self.y[:, np.newaxis], self.shape)
+        # south-up -> north-up, then to `frame`
+        return orient(mx[::-1], frame), orient(my[::-1], frame)
+
+    def rows_cols(self, index):
+        """North-up rows and columns of linear indices of the flipped frame."""
+        height, width = self.shape
+        rows, cols = np.divmod(index, width)
+        return height - 1 - rows, width - 1 - cols
+
+    def coords(self, index):
+        """x, y and z of linear indices (e.g. of a trace) of the flipped frame."""
+        rows, cols = self.rows_cols(np.asarray(index).astype(int))
+        return self.x[cols], self.y[self.shape[0] - 1 - rows], self.z[rows, cols]
+
+    def flat(self):
+        """Stand-ins of the flipped x, y and z matrices of `TIE_core.tie`.
+
+        Same values as the flattened matrices at the trace indices (scalars
+        or arrays of int).
+        """
+        height, width = self.shape
+        x, y, z = self.x, self.y, self.z
+        return (
+            _FlatLookup(lambda i: x[width - 1 - i % width]),
+            _FlatLookup(lambda i: y[i // width]),
+            _FlatLookup(lambda i: z[height - 1 - i // width, width - 1 - i % width]),
+        )
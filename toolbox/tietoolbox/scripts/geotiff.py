@@ -0,0 +1,245 @@
+"""
+GeoTIFF outputs of the TIE pipeline (rasters and cropped DEM), as set in the
+`outputs` section of the configuration::
+
+    "outputs": {
+        "default": {
+            "format": "cog",
+            "compress": "deflate",
+            "predictor": "auto",
+            "blocksize": 512,
+            "overviews": "auto"
+        },
+        "cropped": {"compress": "zstd", "resampling": "average"},
+        "TECrst": {"tif": false}
+    }
+
+The options of an output (``BEDrst``, ``TECrst`` or ``cropped``) are the ones
+of `default` updated by its own ones:
+
+- `tif`: write the GeoTIFF (the ``.npy`` of the rasters are always written);
+- `format`: 'cog' (Cloud Optimized GeoTIFF) or 'gtiff' (tiled GeoTIFF, the
+  overviews after the full resolution data);
+- `compress`: 'deflate', 'zstd', 'lzw' or 'none', `level` its level (null:
+  GDAL default);
+- `predictor`: 'auto' (floating point for floats, horizontal differencing
+  for integers), 1 (none), 2 (horizontal) or 3 (floating point);
+- `blocksize`: size of the (square) tiles, a multiple of 16;
+- `overviews`: 'auto' (halving until the raster fits in a tile), a list of
+  factors or [] (none), `resampling` the resampling of the overviews;
+- `bigtiff`: 'IF_SAFER', 'YES' or 'NO'.
+
+The array is written tile row by tile row, from the array itself: the flipped
+rasters of the pipeline are views, no second copy is made. A COG cannot be
+written block by block: the tiled GeoTIFF is written next to it, with its
+overviews, and copied as a COG.
+"""
+
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+from tietoolbox.scripts.lazy import lazy_import
+
+rasterio = lazy_import("rasterio")
+
+FORMATS = ("cog", "gtiff")
+COMPRESSIONS = ("deflate", "zstd", "lzw", "none")
+
+DEFAULT_OUTPUT = {
+    "tif": True,
+    "format": "cog",
+    "compress": "deflate",
+    "level": None,
+    "predictor": "auto",
+    "blocksize": 512,
+    "overviews": "auto",
+    "resampling": "nearest",
+    "bigtiff": "IF_SAFER",
+}
+
+# Defaults of the outputs besides DEFAULT_OUTPUT
+OUTPUT_DEFAULTS = {
+    # Elevations: averaged overviews
+    "cropped": {"resampling": "average"},
+}
+
+# Predictor of the COG driver
+COG_PREDICTORS = {1: "NO", 2: "STANDARD", 3: "FLOATING_POINT"}
+
+
+def output_config(cfg, name):
+    """Options of the output `name` (see the module documentation)."""
+    outputs = cfg.get("outputs", {})
+    options = dict(DEFAULT_OUTPUT, **OUTPUT_DEFAULTS.get(name, {}))
+    options.update(outputs.get("default", {}))
+    options.update(outputs.get(name, {}))
+
+    options["format"] = str(options["format"]).lower()
+    if options["format"] not in FORMATS:
+        raise ValueError(
+            f"Unknown format '{options['format']}' of output '{name}', "
+            f"expected one of {FORMATS}"
+        )
+    options["compress"] = str(options["compress"] or "none").lower()
+    if options["compress"] not in COMPRESSIONS:
+        raise ValueError(
+            f"Unknown compression '{options['compress']}' of output '{name}', "
+            f"expected one of {COMPRESSIONS}"
+        )
+    if int(options["blocksize"]) % 16:
+        raise ValueError(f"Block size of output '{name}' is not a multiple of 16")
+    return options
+
+
+def predictor(options, dtype):
+    """Predictor (1, 2 or 3) of `dtype`."""
+    if options["compress"] == "none":
+        return 1
+    if options["predictor"] == "auto":
+        return 3 if np.issubdtype(dtype, np.floating) else 2
+    return int(options["predictor"])
+
+
+def overview_factors(options, shape):
+    """Overview factors of a raster of `shape`."""
+    if options["overviews"] != "auto":
+        return [int(f) for f in options["overviews"] or []]
+    factors = []
+    size = max(shape)
+    while size > int(options["blocksize"]):
+        size = -(-size // 2)
+        factors.append(2 ** (len(factors) + 1))
+    return factors
+
+
+def creation_options(options, shape, dtype):
+    """Creation options of the tiled GeoTIFF (GTiff driver)."""
+    profile = {
+        "tiled": True,
+        "blockxsize": int(options["blocksize"]),
+        "blockysize": int(options["blocksize"]),
+        "bigtiff": options["bigtiff"],
+    }
+    if options["compress"] != "none":
+        profile["compress"] = options["compress"]
+        profile["predictor"] = predictor(options, dtype)
+        if options["level"] is not None:
+            level = "zstd_level" if options["compress"] == "zstd" else "zlevel"
+            profile[level] = int(options["level"])
+    return profile
+
+
+def _to_cog(src_path, fname, options, dtype, has_overviews, sparse_ok):
+    """Copy the tiled GeoTIFF `src_path` as a COG."""
+    from rasterio.shutil import copy
+
+    cog = {
+        "driver": "COG",
+        "blocksize": int(options["blocksize"]),
+        "bigtiff": options["bigtiff"],
+        "compress": options["compress"],
+        "overviews": "FORCE_USE_EXISTING" if has_overviews else "NONE",
+        "resampling": options["resampling"],
+        "sparse_ok": sparse_ok,
+    }
+    if options["compress"] != "none":
+        cog["predictor"] = COG_PREDICTORS[predictor(options, dtype)]
+        if options["level"] is not None:
+            cog["level"] = int(options["level"])
+    copy(src_path, fname, **cog)
+
+
+@contextmanager
+def open_tif(
+    fname,
+    shape,
+    dtype,
+    crs,
+    transform,
+    options=None,
+    nodata=None,
+    tags=None,
+    sparse_ok=False,
+):
+    """Single band tiled GeoTIFF being written, overviews and COG once closed.
+
+    Parameters
+    ----------
+    fname : str
+        Filepath of the GeoTIFF.
+    shape : tuple
+        (height, width) of the raster.
+    dtype : numpy.dtype
+        Data type of the raster.
+    crs : rasterio.crs.CRS
+        Coordinate Reference System of the data.
+    transform : affine.Affine
+        Transform of the raster.
+    options : dict, optional
+        Options of the output (see `output_config`), default DEFAULT_OUTPUT.
+    nodata : float, optional
+        Value of the pixels without data.
+    tags : dict, optional
+        Tags of the band.
+    sparse_ok : bool
+        Blocks never written are left empty in the file (read as nodata).
+
+    Yields
+    ------
+    rasterio.io.DatasetWriter
+        The GeoTIFF (GTiff driver): write its band 1 by windows.
+    """
+    from rasterio.enums import Resampling
+
+    options = dict(DEFAULT_OUTPUT, **(options or {}))
+    dtype = np.dtype(dtype)
+    fname = str(fname)
+    cog = options["format"] == "cog"
+    path = f"{os.path.splitext(fname)[0]}.tmp.tif" if cog else fname
+    factors = overview_factors(options, shape)
+
+    try:
+        with rasterio.open(
+            path,
+            "w",
+            driver="GTiff",
+            height=shape[0],
+            width=shape[1],
+            count=1,
+            dtype=dtype.name,
+            crs=crs,
+            transform=transform,
+            nodata=nodata,
+            sparse_ok=sparse_ok,
+            **creation_options(options, shape, dtype),
+        ) as dst:
+            if tags:
+                dst.update_tags(1, **tags)
+            yield dst
+            if factors:
+                dst.build_overviews(factors, Resampling[options["resampling"]])
+        if cog:
+            _to_cog(path, fname, options, dtype, bool(factors), sparse_ok)
+    finally:
+        if cog and os.path.exists(path):
+            os.remove(path)
+
+
+def write_tif(arr, fname, crs, transform, options=None, nodata=None, tags=None):
+    """Write a 2D array to a GeoTIFF, one row of tiles at a time.
+
+    See `open_tif` for the parameters.
+    """
+    from rasterio.windows import Window
+
+    height = np.shape(arr)[0]
+    with open_tif(
+        fname, np.shape(arr), arr.dtype, crs, transform, options, nodata, tags
+    ) as dst:
+        rows = dst.block_shapes[0][0]
+        for row0 in range(0, height, rows):
+            window = Window(0, row0, dst.width, min(rows, height - row0))
+            # Copy of the rows only, `arr` may be a view (e.g. flipped)
+            dst.write(np.ascontiguousarray(arr[row0 : row0 + rows]), 1, window=window)
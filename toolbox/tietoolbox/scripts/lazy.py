@@ -0,0 +1,50 @@
+"""
+Modules imported on their first use.
+
+geopandas, rasterio, matplotlib and `untie` take seconds to import: the
+scripts and the modules they load at startup get them with `lazy_import`,
+so that ``--help`` and the first log lines do not wait for them::
+
+    gpd = lazy_import("geopandas")
+
+    def f(path):
+        return gpd.read_file(path)  # geopandas is imported here
+
+`benchmarks/bench_startup.py` checks that they stay out of the startup.
+"""
+
+import importlib
+import sys
+
+
+class LazyModule:
+    """Stands for the module `name`, imported on the first attribute access.
+
+    The attributes are kept once read: later accesses cost the same as with
+    the module itself.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_lazy_name"] = name
+
+    def __getattr__(self, attr):
+        # importlib waits for an import running in another thread
+        module = importlib.import_module(self._lazy_name)
+        value = getattr(module, attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __reduce__(self):
+        # Pickled with the globals of the functions sent to the dask workers
+        return lazy_import, (self._lazy_name,)
+
+    def __repr__(self):
+        state = "imported" if self._lazy_name in sys.modules else "not imported"
+        return f"<lazy module '{self._lazy_name}' ({state})>"
+
+
+def lazy_import(name):
+    """Module `name`, or a `LazyModule` standing for it if not imported yet."""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
@@ -0,0 +1,189 @@
+"""
+Level of detail of the maps of `tie_viewer`.
+
+The maps of `untie.TIE_visual` mesh every pixel of the DEM and of the colour
+raster and draw every pixel of the traces: beyond a few km² the 3D views do
+not fit in memory. `LevelOfDetail` keeps every `step`-th row and column of the
+DEM, or of a window of it (region of interest), the smallest step within a
+vertex budget. The DEM and the rasters are decimated as views, the traces are
+snapped to the vertices of the decimated grid: they have about as many points
+per km as the mesh.
+"""
+
+import copy
+
+import numpy as np
+from affine import Affine
+
+from tietoolbox.scripts.categories import CategoricalRaster
+from tietoolbox.scripts.dem_grid import DEMGrid, orient
+from tietoolbox.scripts.trace_store import TraceStore
+
+# Vertices of the meshes of the maps
+DEFAULT_MAX_VERTICES = 1000000
+
+# The labels of the traces and of the segments are drawn at their 5th point
+MIN_TRACE_POINTS = 5
+
+
+def decimation_step(shape, max_vertices):
+    """Smallest step keeping a raster of `shape` within `max_vertices` (0: no limit)."""
+    step = 1
+    if max_vertices:
+        step = max(1, int(np.sqrt(np.prod(shape) / max_vertices)))
+        while -(-shape[0] // step) * -(-shape[1] // step) > max_vertices:
+            step += 1
+    return step
+
+
+def roi_window(grid, bounds):
+    """North-up window of the pixels of `grid` within `bounds`.
+
+    Parameters
+    ----------
+    grid : DEMGrid
+        The DEM.
+    bounds : tuple
+        (minx, miny, maxx, maxy) of the region of interest.
+
+    Returns
+    -------
+    tuple
+        (row_off, col_off, height, width) of the window.
+    """
+    minx, miny, maxx, maxy = bounds
+    cols = np.flatnonzero((grid.x >= minx) & (grid.x <= maxx))
+    ys = np.flatnonzero((grid.y >= miny) & (grid.y <= maxy))
+    if cols.size == 0 or ys.size == 0:
+        raise ValueError(f"Region of interest {tuple(bounds)} is outside of the DEM")
+    return (grid.shape[0] - 1 - int(ys[-1]), int(cols[0]), ys.size, cols.size)
+
+
+class LevelOfDetail:
+    """Decimated (and cropped) view of a DEMGrid, and of the rasters and traces on it.
+
+    Parameters
+    ----------
+    grid : DEMGrid
+        The full resolution DEM.
+    max_vertices : int
+        Vertex budget of the meshes, 0 for full resolution.
+    window : tuple, optional
+        North-up (row_off, col_off, height, width) of the region of interest
+        (see `roi_window`), default the whole DEM.
+    """
+
+    def __init__(self, grid, max_vertices=DEFAULT_MAX_VERTICES, window=None):
+        self.full = grid
+        self.window = tuple(window or ((0, 0) + grid.shape))
+        row_off, col_off, height, width = self.window
+        self.step = decimation_step((height, width), max_vertices)
+        self._rows = slice(row_off, row_off + height, self.step)
+        self._cols = slice(col_off, col_off + width, self.step)
+
+        meta = grid.meta
+        if meta and meta.get("transform") is not None:
+            meta = dict(meta)
+            meta["transform"] = (
+                meta["transform"]
+                * Affine.translation(col_off, row_off)
+                * Affine.scale(self.step)
+            )
+        # `y` is ascending: y of the north-up rows, in reverse
+        self.grid = DEMGrid(
+            grid.z[self._rows, self._cols],
+            grid.x[self._cols],
+            grid.y[::-1][self._rows][::-1],
+            meta,
+        )
+
+    @property
+    def is_full(self):
+        """The grid is the full resolution DEM."""
+        return self.step == 1 and self.window == (0, 0) + self.full.shape
+
+    def raster(self, rst):
+        """View of the raster `rst` (flipped frame, or CategoricalRaster) on the grid."""
+        if isinstance(rst, CategoricalRaster):
+            return CategoricalRaster(self.raster(rst.data), rst.codes)
+        north_up = orient(rst, "flipped")[self._rows, self._cols]
+        return orient(north_up, "flipped")
+
+    def index(self, index):
+        """Linear indices of the grid of trace indices of the full DEM.
+
+        Returns
+        -------
+        numpy.ndarray
+            Index of the nearest vertex of the grid (flipped frame).
+        numpy.ndarray
+            Boolean, the point is in the window.
+        """
+        index = np.asarray(index)
+        rows, cols = self.full.rows_cols(index.astype(int))
+        row_off, col_off, height, width = self.window
+        rows = rows - row_off
+        cols = cols - col_off
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+
+        grid_height, grid_width = self.grid.shape
+        rows = np.clip(np.round(rows / self.step).astype(int), 0, grid_height - 1)
+        cols = np.clip(np.round(cols / self.step).astype(int), 0, grid_width - 1)
+        grid_index = (grid_height - 1 - rows) * grid_width + (grid_width - 1 - cols)
+        return grid_index.astype(index.dtype), inside
+
+    def trace(self, tr):
+        """Copy of the trace `tr` on the grid, None if it is (mostly) outside.
+
+        Consecutive points snapped to the same vertex are merged, unless a
+        segment would be left with less than MIN_TRACE_POINTS points. The
+        orientation bars and the segments follow the points kept; segments
+        with less than MIN_TRACE_POINTS points in the window are left out.
+        """
+        index, inside = self.index(tr.index)
+        positions = np.flatnonzero(inside)
+        snapped = index[positions]
+        merged = positions[np.diff(snapped, prepend=np.nan) != 0]
+
+        segments = [np.asarray(s.ind_normal, dtype=int) for s in tr.Segment or []]
+        if any(
+            np.count_nonzero(inside[ind]) >= MIN_TRACE_POINTS
+            and np.isin(ind, merged).sum() < MIN_TRACE_POINTS
+            for ind in segments
+        ):
+            merged = positions
+        if merged.size < MIN_TRACE_POINTS:
+            return None
+
+        # Positions in the new trace of the points of `tr`, -1 if dropped
+        new_positions = np.full(np.size(index), -1)
+        new_positions[merged] = np.arange(merged.size)
+
+        new = copy.copy(tr)
+        new.index = index[merged]
+        if len(tr.orientbar) == np.size(index):
+            new.orientbar = [tr.orientbar[i] for i in merged]
+        new.Segment = []
+        for seg, ind in zip(tr.Segment or [], segments):
+            ind = new_positions[ind]
+            ind = ind[ind >= 0]
+            if ind.size >= MIN_TRACE_POINTS:
+                seg = copy.copy(seg)
+                seg.ind_normal = ind
+                seg.ind_reverse = ind[::-1]
+                new.Segment.append(seg)
+        return new
+
+    def traces(self, traces):
+        """The traces on the grid (see `trace`), without the ones outside."""
+        if self.is_full:
+            return traces
+        if isinstance(traces, TraceStore):
+            # Only the traces with points in the window are built
+            store = traces
+            traces = (
+                store[i]
+                for i in range(len(store))
+                if np.count_nonzero(self.index(store.index(i))[1]) >= MIN_TRACE_POINTS
+            )
+        return [tr for tr in map(self.trace, traces) if tr is not None]
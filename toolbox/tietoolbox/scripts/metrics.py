@@ -0,0 +1,200 @@
+"""
+Timing, memory and throughput of the stages of the TIE pipeline.
+
+Every stage decorated with `stage_metrics` reports its wall time, CPU time,
+memory and the number of items it produced (features, pixels, traces) to the
+logger. The records are appended to ``run_metrics.jsonl`` in the cache
+directory, which works with every dask scheduler (threads or processes), and
+are gathered in ``run_metrics.json`` at the end of the run.
+
+CPU time is the one of the thread running the stage; the processes started
+by a stage (e.g. `tie_parallel`) are not included. Peak RSS is the high-water
+mark of the process running the stage, so it is not attributable to a single
+stage when several of them run in the same process.
+"""
+
+import functools
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from tietoolbox.scripts.categories import NODATA, CategoricalRaster
+from tietoolbox.scripts.lazy import lazy_import
+from tietoolbox.scripts.sparse_raster import SparseRaster
+
+gpd = lazy_import("geopandas")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+
+def rss_mb():
+    """Current resident memory of the process (MB), None if unknown."""
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss / 1024**2
+
+
+def peak_rss_mb():
+    """Peak resident memory of the process (MB), None if unknown."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024**2
+    return None
+
+
+def count_items(result):
+    """Number of items in the result of a stage."""
+    if isinstance(result, gpd.GeoDataFrame):
+        return {"features": len(result)}
+    if isinstance(result, np.ndarray):
+        counts = {"pixels": int(result.size)}
+        if np.issubdtype(result.dtype, np.floating):
+            counts["valid_pixels"] = int(np.count_nonzero(~np.isnan(result)))
+        return counts
+    if isinstance(result, CategoricalRaster):
+        return {
+            "pixels": int(result.size),
+            "valid_pixels": int(np.count_nonzero(result.data != NODATA)),
+        }
+    if isinstance(result, SparseRaster):
+        return {"pixels": result.size, "valid_pixels": result.nnz}
+    if isinstance(result, dict) and "z" in result:
+        return {"pixels": int(np.size(result["z"]))}
+    if isinstance(result, (list, tuple)) and all(
+        hasattr(item, "index") and hasattr(item, "Segment") for item in result
+    ):
+        return {"traces": len(result)}
+    return {}
+
+
+def stage_label(name, args, kwargs):
+    """Stage name and its string arguments, e.g. 'rasterize_shp[bedrock]'."""
+    labels = [a for a in args if isinstance(a, str)]
+    labels += [f"{k}={v}" for k, v in kwargs.items() if isinstance(v, (str, bool))]
+    return f"{name}[{', '.join(labels)}]" if labels else name
+
+
+class MetricsRecorder:
+    """Collects the metrics of the stages of a run in `directory`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.records_path = os.path.join(directory, "run_metrics.jsonl")
+        self.summary_path = os.path.join(directory, "run_metrics.json")
+
+    def start_run(self):
+        if os.path.exists(self.records_path):
+            os.remove(self.records_path)
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.start = time.perf_counter()
+
+    def record(self, metrics):
+        # One line per write: safe with several threads or processes
+        with open(self.records_path, "a") as f:
+            f.write(json.dumps(metrics) + "\n")
+
+    def records(self):
+        try:
+            with open(self.records_path) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def end_run(self, **info):
+        """Write ``run_metrics.json`` and log the stages by decreasing wall time."""
+        stages = sorted(self.records(), key=lambda r: r["start"])
+        wall = time.perf_counter() - self.start
+
+        totals = {}
+        for r in stages:
+            total = totals.setdefault(r["stage"], {"calls": 0, "wall": 0.0, "cpu": 0.0})
+            total["calls"] += 1
+            total["wall"] += r["wall"]
+            total["cpu"] += r["cpu"]
+
+        summary = {
+            "started": self.started,
+            "host": socket.gethostname(),
+            "wall": wall,
+            "peak_rss_mb": peak_rss_mb(),
+            **info,
+            "totals": totals,
+            "stages": stages,
+        }
+        with open(self.summary_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        if os.path.exists(self.records_path):
+            os.remove(self.records_path)
+
+        logger.info(f"Stage metrics ({wall:.2f}s), saved to {self.summary_path}")
+        for name, total in sorted(totals.items(), key=lambda t: -t[1]["wall"]):
+            logger.info(
+                f"  {name:<20} {total['wall']:8.2f}s wall {total['cpu']:8.2f}s cpu"
+                f" ({total['calls']} calls)"
+            )
+        return summary
+
+
+def stage_metrics(method):
+    """Record the metrics of a `TIEDataProcessor` stage in ``self.metrics``.
+
+    Apply below ``@delayed``.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        recorder = self.metrics
+        if recorder is None:
+            return method(self, *args, **kwargs)
+
+        start = time.time()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        rss_before = rss_mb()
+
+        result = method(self, *args, **kwargs)
+
+        counts = count_items(result)
+        metrics = {
+            "stage": name,
+            "label": stage_label(name, args, kwargs),
+            "start": start,
+            "wall": time.perf_counter() - wall,
+            "cpu": time.thread_time() - cpu,
+            "rss_before_mb": rss_before,
+            "rss_after_mb": rss_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+            "pid": os.getpid(),
+            **counts,
+        }
+        recorder.record(metrics)
+
+        logger.info(
+            f"{metrics['label']}: {metrics['wall']:.2f}s wall,"
+            f" {metrics['cpu']:.2f}s cpu"
+            + "".join(f", {k}: {v}" for k, v in counts.items())
+        )
+        return result
+
+    return wrapper
@@ -0,0 +1,89 @@
+"""
+Dask scheduler of the TIE pipeline, as set in the `scheduler` section of the
+configuration::
+
+    "scheduler": {
+        "type": "processes",
+        "num_workers": null,
+        "threads_per_worker": 1,
+        "memory_limit": "4GB"
+    }
+
+`type` is one of 'threads' (dask default), 'processes', 'synchronous' (no
+parallelism, for debugging) or 'distributed' (experimental: a local
+`dask.distributed` cluster, requires the `distributed` package and is only
+tested where it is installed). `num_workers` defaults to
+`settings.num_processes`, then to the number of CPUs. `threads_per_worker`
+and `memory_limit` (per worker) only apply to 'distributed'.
+
+The TIE analysis is CPU bound and holds the GIL: use 'processes' or
+'distributed' for the bedrock and the tectonic branches to run in parallel.
+"""
+
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEDULERS = ("threads", "processes", "synchronous", "distributed")
+
+
+def scheduler_config(cfg):
+    """Scheduler settings of `cfg`, with their default values."""
+    sched_cfg = cfg.get("scheduler", {})
+    kind = sched_cfg.get("type", "threads")
+    if kind not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler '{kind}', expected one of {SCHEDULERS}")
+
+    num_workers = sched_cfg.get("num_workers")
+    if num_workers is None:
+        num_workers = cfg.get("settings", {}).get("num_processes")
+
+    return {
+        "type": kind,
+        "num_workers": int(num_workers) if num_workers else None,
+        "threads_per_worker": sched_cfg.get("threads_per_worker", 1),
+        "memory_limit": sched_cfg.get("memory_limit"),
+    }
+
+
+@contextmanager
+def scheduler(cfg, pool=None):
+    """Start the configured scheduler and yield the kwargs of `dask.compute`.
+
+    `pool` is a process executor kept between the runs (e.g. by the analysis
+    server), used by the 'processes' scheduler.
+    """
+    sched_cfg = scheduler_config(cfg)
+    kind = sched_cfg["type"]
+    num_workers = sched_cfg["num_workers"]
+
+    if kind != "distributed":
+        if sched_cfg["memory_limit"]:
+            logger.warning(f"'memory_limit' is ignored by the '{kind}' scheduler")
+        kwargs = {"scheduler": kind}
+        if pool is not None and kind == "processes":
+            kwargs["pool"] = pool
+        elif num_workers and kind != "synchronous":
+            kwargs["num_workers"] = num_workers
+        workers = "pool" if "pool" in kwargs else kwargs.get("num_workers", "-")
+        logger.info(f"Dask scheduler: {kind}, workers: {workers}")
+        yield kwargs
+        return
+
+    try:
+        from dask.distributed import Client, LocalCluster
+    except ImportError as e:
+        raise ImportError(
+            "The 'distributed' scheduler requires the `distributed` package"
+        ) from e
+
+    cluster = LocalCluster(
+        n_workers=num_workers,
+        threads_per_worker=sched_cfg["threads_per_worker"],
+        memory_limit=sched_cfg["memory_limit"] or "auto",
+        processes=True,
+    )
+    with cluster, Client(cluster) as client:
+        logger.info(f"Dask scheduler: distributed, dashboard {client.dashboard_link}")
+        yield {"scheduler": client}
@@ -0,0 +1,320 @@
+"""
+Rasters holding only their valid (not NaN) pixels.
+
+The tectonic lines cover a small part of the DEM: their raster (``TECrst``) is
+kept as the linear indices and the categories (see `categories`) of its
+pixels, from the rasterization to the extraction of the faults, and written
+as such: ``TECrst.npz`` and a GeoTIFF without its empty blocks. Memory and
+disk scale with the length of the lines, not with the area.
+`SparseRaster.to_dense` gives the full matrix to the consumers which need it.
+
+Like the rasters of `TIE_load.rasterizeSHP`, the indices are in the flipped
+(``np.flip(z, (0, 1))``) frame of the grid, see `tiling`.
+"""
+
+import json
+
+import numpy as np
+from untie import TIE_classes as TIEclass
+from untie import TIE_general as TIEgen
+
+from tietoolbox.scripts.categories import (
+    LEGEND_FILE,
+    NODATA,
+    CategoricalRaster,
+    category_dtype,
+    lookup_table,
+    tif_tags,
+)
+
+# (rows, cols) of the 8 neighbours of a pixel
+NEIGHBOURS = ((0, 1), (0, -1), (-1, 0), (1, 0), (-1, 1), (-1, -1), (1, 1), (1, -1))
+
+
+class SparseRaster:
+    """Raster of `shape` whose pixels `index` (sorted) have the categories `data`.
+
+    `data` are positions (from 1) in the lookup table `codes`.
+    """
+
+    def __init__(self, shape, index=(), data=(), codes=()):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.codes = np.asarray(codes, dtype=float)
+        self.index = np.asarray(index, dtype=np.int64)
+        self.data = np.asarray(data, dtype=category_dtype(self.codes.size))
+
+    @classmethod
+    def from_categorical(cls, rst):
+        index = np.flatnonzero(rst.data != NODATA)
+        return cls(rst.shape, index, np.ravel(rst.data)[index], rst.codes)
+
+    @classmethod
+    def from_dense(cls, arr):
+        """Raster of the codes `arr`, NaN where there is none."""
+        return cls.from_categorical(CategoricalRaster.from_float(arr))
+
+    @property
+    def values(self):
+        """Codes of the pixels."""
+        return self.codes[self.data.astype(np.intp) - 1]
+
+    def to_categorical(self):
+        data = np.full(self.shape, NODATA, dtype=self.data.dtype)
+        data.ravel()[self.index] = self.data
+        return CategoricalRaster(data, self.codes)
+
+    def to_dense(self):
+        """The codes, NaN where there is none."""
+        return self.to_categorical().to_float()
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def nnz(self):
+        return int(self.index.size)
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + self.data.nbytes + self.codes.nbytes
+
+    def __repr__(self):
+        return f"SparseRaster(shape={self.shape}, nnz={self.nnz})"
+
+    def block(self, slices):
+        """Pixels of the block `slices` (rows, cols), in a raster of its size."""
+        (r0, r1, _), (c0, c1, _) = (
+            s.indices(n) for s, n in zip(slices, self.shape)
+        )
+        rows, cols = np.divmod(self.index, self.shape[1])
+        inside = (rows >= r0) & (rows < r1) & (cols >= c0) & (cols < c1)
+        index = (rows[inside] - r0) * (c1 - c0) + (cols[inside] - c0)
+        return SparseRaster((r1 - r0, c1 - c0), index, self.data[inside], self.codes)
+
+    def place(self, shape, offset):
+        """The raster at `offset` (rows, cols) in a raster of `shape`."""
+        rows, cols = np.divmod(self.index, self.shape[1])
+        index = (rows + offset[0]) * shape[1] + (cols + offset[1])
+        return SparseRaster(shape, index, self.data, self.codes)
+
+    @classmethod
+    def merge(cls, shape, rasters):
+        """Pixels of `rasters` (of `shape`, disjoint) in a single raster."""
+        rasters = [r for r in rasters if r is not None]
+        if not rasters:
+            return cls(shape)
+        # Lookup table of all the rasters
+        codes = np.unique(np.concatenate([r.codes for r in rasters]))
+        index = np.concatenate([r.index for r in rasters])
+        data = np.concatenate(
+            [
+                np.searchsorted(codes, r.codes)[r.data.astype(np.intp) - 1] + 1
+                for r in rasters
+            ]
+        )
+        order = np.argsort(index, kind="stable")
+        return cls(shape, index[order], data[order], codes)
+
+    def save_table(self, path, legendfile=LEGEND_FILE):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(lookup_table(self.codes, legendfile), f, indent=2)
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            shape=np.asarray(self.shape),
+            index=self.index,
+            data=self.data,
+            codes=self.codes,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            return cls(npz["shape"], npz["index"], npz["data"], npz["codes"])
+
+    def to_tif(self, fname, crs, transform, options=None):
+        """Write the raster (north-up) to a tiled GeoTIFF, NODATA being nodata.
+
+        Only the blocks holding pixels are written, the others are left
+        sparse in the file (GDAL reads them as nodata). `options`: format,
+        compression, tiles and overviews (see `geotiff.output_config`).
+        """
+        from rasterio.windows import Window
+
+        from tietoolbox.scripts.geotiff import open_tif
+
+        height, width = self.shape
+        # flipped frame -> north-up
+        rows, cols = np.divmod(self.size - 1 - self.index, width)
+
+        with open_tif(
+            fname,
+            self.shape,
+            self.data.dtype,
+            crs,
+            transform,
+            options,
+            nodata=NODATA,
+            tags=tif_tags(self.codes),
+            sparse_ok=True,
+        ) as dst:
+            block_size = dst.block_shapes[0][0]
+            block_id = (rows // block_size) * width + cols // block_size
+            order = np.argsort(block_id, kind="stable")
+            blocks, starts = np.unique(block_id[order], return_index=True)
+            for block, pixels in zip(blocks, np.split(order, starts[1:])):
+                row0 = int(block // width) * block_size
+                col0 = int(block % width) * block_size
+                window = Window(
+                    col0,
+                    row0,
+                    min(block_size, width - col0),
+                    min(block_size, height - row0),
+                )
+                data = np.full(
+                    (window.height, window.width), NODATA, dtype=self.data.dtype
+                )
+                data[rows[pixels] - row0, cols[pixels] - col0] = self.data[pixels]
+                dst.write(data, 1, window=window)
+
+
+def _neighbour_pairs(index, shape, offsets):
+    """Pairs (i, j) of positions in `index` of pixels neighbours by `offsets`."""
+    height, width = shape
+    rows, cols = np.divmod(index, width)
+    for d_row, d_col in offsets:
+        n_rows, n_cols = rows + d_row, cols + d_col
+        inside = (n_rows >= 0) & (n_rows < height) & (n_cols >= 0) & (n_cols < width)
+        target = n_rows * width + n_cols
+        pos = np.minimum(np.searchsorted(index, target), max(index.size - 1, 0))
+        found = inside & (index[pos] == target)
+        yield np.flatnonzero(found), pos[found]
+
+
+def count_neighbours(index, shape):
+    """Number of pixels of `index` among the 8 neighbours of each of them.
+
+    Same as `TIE_general.nmbNeighbors` on the binary image of `index`.
+    """
+    counts = np.zeros(index.size, dtype=int)
+    for i, _ in _neighbour_pairs(index, shape, NEIGHBOURS):
+        counts[i] += 1
+    return counts
+
+
+def connected_pixels(index, shape):
+    """Groups of 8-connected pixels of `index` (sorted).
+
+    Ordered by their first pixel, as numbered by `skimage.measure.label`.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    if index.size == 0:
+        return []
+    pairs = list(_neighbour_pairs(index, shape, NEIGHBOURS[::2]))
+    i = np.concatenate([p[0] for p in pairs])
+    j = np.concatenate([p[1] for p in pairs])
+    graph = coo_matrix((np.ones(i.size), (i, j)), shape=(index.size, index.size))
+    _, labels = connected_components(graph, directed=False)
+    # `index` being sorted, the first position of a label is its first pixel
+    _, first = np.unique(labels, return_index=True)
+    order = np.argsort(labels, kind="stable")
+    groups = np.split(index[order], np.cumsum(np.bincount(labels))[:-1])
+    return [groups[label] for label in np.argsort(first)]
+
+
+def sort_pixels(index, shape):
+    """Order the pixels of a line, same result as `TIE_general.sortLine`.
+
+    From an end of the line (or from the first pixel when there is none),
+    each next pixel is the nearest remaining one. The nearest pixels are
+    searched with arrays: `sortLine` takes minutes on lines of a few thousand
+    pixels.
+    """
+    height, width = shape
+    ind = np.asarray(index).astype(int)
+    newi = np.zeros(np.shape(ind))
+
+    # First pixel with a single neighbour
+    order = np.argsort(ind, kind="stable")
+    counts = np.empty(ind.size, dtype=int)
+    counts[order] = count_neighbours(ind[order], shape)
+    ends = np.flatnonzero(counts == 1)
+    if ends.size:
+        start = ind[ends[0]]
+    else:
+        # Closed line: its first pixel, its first neighbour being the last one
+        start = ind[0]
+        neigh = np.intersect1d(TIEgen.neighborPoints(start, height, width, 8), ind)
+        newi[-1] = neigh[0]
+        ind = ind[ind != neigh[0]]
+
+    newi[0] = start
+    ind = ind[ind != start]
+    rows, cols = np.divmod(ind, width)
+    count = 1
+    while ind.size:
+        # Squared distances: same ties as the distances
+        d = (cols - start % width) ** 2 + (rows - start // width) ** 2
+        dimin = np.flatnonzero(d == d.min())
+        if dimin.size > 1:
+            # Pixel without any other nearest pixel 8 pixels away
+            for di in dimin:
+                neigh = TIEgen.neighborPointsD(ind[di], height, width, 8)
+                if np.intersect1d(neigh, ind[dimin[dimin != di]]).size == 0:
+                    dimin = np.array([di])
+                    break
+            else:
+                raise ValueError(
+                    f"Cannot order the pixels of the line: {dimin.size} pixels "
+                    f"at the same distance of pixel {start}"
+                )
+        start = ind[dimin[0]]
+        newi[count] = start
+        count = count + 1
+        ind, rows, cols = (np.delete(a, dimin[0]) for a in (ind, rows, cols))
+    return newi
+
+
+def extract_traces(rst, shape):
+    """Traces of a raster, same as `TIE_load.extractTraces`.
+
+    Works on the pixels of each kind rather than on full size matrices, `rst`
+    being a `SparseRaster` or a matrix.
+
+    Parameters
+    ----------
+    rst : SparseRaster or numpy.ndarray
+        Raster of the traces, NaN where there is none.
+    shape : str
+        'L' for polylines (e.g., faults), 'PLG' for traces extracted from
+        polygons (e.g., bedrock interface traces).
+
+    Returns
+    -------
+    list
+        List of trace objects (trace_OBJ) defined in TIE_classes.
+    """
+    if not isinstance(rst, SparseRaster):
+        rst = SparseRaster.from_dense(rst)
+
+    traces = []
+    n = 1
+    # Compared as categories (small integers) rather than as float codes
+    for category in np.unique(rst.data):
+        kind = rst.codes[category - 1]
+        index = rst.index[rst.data == category]
+        if shape == "L":
+            # Branch points split the lines
+            index = index[count_neighbours(index, rst.shape) <= 2]
+        for pixels in connected_pixels(index, rst.shape):
+            if pixels.size > 5:
+                pixels = sort_pixels(pixels, rst.shape)
+                i_ind = np.arange(0, np.size(pixels)).astype(int)
+                seg = TIEclass.segment_OBJ(1, [], i_ind, i_ind[::-1], [], [], [], [])
+                traces.append(TIEclass.trace_OBJ(n, pixels, kind, [seg], None, []))
+                n = n + 1
+    return traces
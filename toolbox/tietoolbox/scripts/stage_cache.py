@@ -0,0 +1,246 @@
+"""
+Content-addressed cache for the stages of the TIE pipeline.
+
+A stage is keyed by a hash of its name, of its inputs and of the configuration
+it depends on. When a key is already in the cache, the stored result is loaded
+instead of computing the stage again, so a re-run only recomputes the stages
+downstream of what actually changed (e.g. the `Lines` layer).
+
+Results are pickled in ``<cache_dir>/stages/<key>.pkl``. The least recently
+used entries are evicted when the directory grows beyond `max_size_mb`.
+"""
+
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from importlib import metadata
+
+import numpy as np
+from affine import Affine
+
+from tietoolbox.scripts.lazy import lazy_import
+
+gpd = lazy_import("geopandas")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+# Bump when the format of the stored results changes
+CACHE_VERSION = 2
+
+
+def _untie_version():
+    try:
+        return metadata.version("untie")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _update(h, obj):
+    """Feed the content of `obj` to the hash `h`."""
+    if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        h.update(f"{type(obj).__name__}:{obj!r};".encode())
+    elif isinstance(obj, np.ndarray):
+        h.update(f"ndarray:{obj.dtype.str}:{obj.shape};".encode())
+        h.update(np.ascontiguousarray(obj).data)
+    elif isinstance(obj, np.generic):
+        _update(h, obj.item())
+    elif isinstance(obj, gpd.GeoDataFrame):
+        h.update(b"GeoDataFrame;")
+        _update(h, obj.crs)
+        _update(h, [str(c) for c in obj.columns])
+        _update(h, obj.geometry.to_wkb().to_list())
+        attributes = obj.drop(columns=obj.geometry.name)
+        _update(h, pd.util.hash_pandas_object(attributes, index=True).to_numpy())
+    elif isinstance(obj, dict):
+        h.update(f"dict:{len(obj)};".encode())
+        for k in sorted(obj, key=str):
+            _update(h, str(k))
+            _update(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}:{len(obj)};".encode())
+        for item in obj:
+            _update(h, item)
+    elif isinstance(obj, Affine) or hasattr(obj, "to_wkt"):  # CRS
+        h.update(f"{type(obj).__name__}:".encode())
+        _update(h, obj.to_wkt() if hasattr(obj, "to_wkt") else tuple(obj))
+    elif hasattr(obj, "__dict__"):
+        # TIE objects (traces, segments, chords...)
+        h.update(f"{type(obj).__name__}:".encode())
+        _update(h, vars(obj))
+    else:
+        h.update(f"{type(obj).__name__}:{obj!r};".encode())
+
+
+def fingerprint(*objs):
+    """Hash of the content of `objs` (hex digest)."""
+    h = hashlib.sha256()
+    for obj in objs:
+        _update(h, obj)
+    return h.hexdigest()
+
+
+def source_signature(path):
+    """Path, size and modification time of a file or directory (e.g. a GDB).
+
+    Cheaper than hashing the content of big sources; any write to the source
+    changes the signature.
+    """
+    path = os.path.abspath(path)
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return (path, stat.st_size, stat.st_mtime_ns)
+
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            files.append(
+                (
+                    os.path.relpath(os.path.join(root, name), path),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                )
+            )
+    return (path, sorted(files))
+
+
+class StageCache:
+    """Pickled stage results, addressed by the hash of their inputs.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the results.
+    max_size_mb : float
+        Maximal size of `directory`. The least recently used results are
+        deleted beyond it. None: no limit.
+    """
+
+    def __init__(self, directory, max_size_mb=None):
+        self.directory = directory
+        self.max_size = None if max_size_mb is None else max_size_mb * 1024**2
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, stage, args, kwargs, params=None):
+        return fingerprint(
+            CACHE_VERSION, _untie_version(), stage, args, kwargs, params or {}
+        )
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def load(self, key):
+        """Return ``(True, result)`` if `key` is in the cache, else ``(False, None)``."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except (
+            pickle.UnpicklingError,
+            EOFError,
+            AttributeError,
+            ImportError,
+            ValueError,
+            OSError,
+        ) as e:
+            logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return False, None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True, result
+
+    def store(self, key, result):
+        # Written next to its final location, then renamed: a concurrent or
+        # interrupted run never sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(key))
+        except (OSError, pickle.PicklingError, TypeError) as e:
+            logger.warning(f"Cannot store stage result in cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used results beyond `max_size`."""
+        if self.max_size is None:
+            return
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                logger.debug(f"Evicted {path} from cache")
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def cached_stage(method):
+    """Cache the result of a `TIEDataProcessor` stage.
+
+    The stage is keyed by its inputs and by ``self.stage_params(name)``. It
+    must not depend on other state of ``self``, nor modify its inputs. Apply
+    below ``@delayed``.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self.stage_cache
+        if cache is None:
+            return method(self, *args, **kwargs)
+
+        key = cache.key(name, args, kwargs, self.stage_params(name))
+        hit, result = cache.load(key)
+        if hit:
+            logger.info(f"{name}: using cached result {key[:12]}")
+            return result
+
+        result = method(self, *args, **kwargs)
+        if result is not None:
+            cache.store(key, result)
+        return result
+
+    return wrapper
+
+
+def cached_call(cache, name, func, args, params=None):
+    """``func()``, keyed by `name`, `args` and `params`, read from `cache` if any.
+
+    For the pieces of work done inside a stage (e.g. one trace of many).
+    """
+    if cache is None:
+        return func()
+
+    key = cache.key(name, args, {}, params)
+    hit, result = cache.load(key)
+    if hit:
+        return result
+
+    result = func()
+    if result is not None:
+        cache.store(key, result)
+    return result
@@ -0,0 +1,223 @@
+"""
+Description and execution profile of the dask graph of the pipeline, as set
+in the `graph` section of the configuration::
+
+    "graph": {
+        "render": "none",
+        "profile": false
+    }
+
+`render` writes the graph to ``tie_pipeline.*`` in the project directory
+before the computation:
+
+- 'none' (default): nothing;
+- 'text': one line per task, with its dependencies (``.txt``);
+- 'html': the same, as a table (``.html``);
+- 'cytoscape' or 'graphviz': `dask.visualize` (requires `ipycytoscape` or
+  `graphviz`).
+
+`profile` writes ``graph_profile.json`` to the cache directory after the
+run: the tasks which were run, their dependencies and their start, end and
+duration (seconds from the start of the computation), the totals per stage
+and the critical path. The timings are the ones seen by the scheduler: with
+'processes', they include the transfer of the inputs and of the result. Like
+the progress events (see `dask_progress`), it requires a local scheduler.
+"""
+
+import heapq
+import html
+import json
+import logging
+import time
+from collections import defaultdict
+
+import dask
+from dask.callbacks import Callback
+from dask.utils import key_split
+
+logger = logging.getLogger(__name__)
+
+RENDERERS = ("none", "text", "html", "cytoscape", "graphviz")
+
+PROFILE_VERSION = 1
+
+
+def graph_config(cfg):
+    """Graph settings of `cfg`, with their default values."""
+    graph_cfg = cfg.get("graph", {})
+    render = graph_cfg.get("render", "none")
+    if render not in RENDERERS:
+        raise ValueError(
+            f"Unknown graph renderer '{render}', expected one of {RENDERERS}"
+        )
+    return {"render": render, "profile": bool(graph_cfg.get("profile", False))}
+
+
+def key_name(key):
+    return key if isinstance(key, str) else repr(key)
+
+
+def topological_order(dependencies):
+    """Keys of the graph, each one after its dependencies (ties by name)."""
+    dependents = defaultdict(list)
+    missing = {}
+    for key, deps in dependencies.items():
+        missing[key] = len(deps)
+        for dep in deps:
+            dependents[dep].append(key)
+    names = {key: key_name(key) for key in missing}
+    ready = [(names[k], k) for k, n in missing.items() if n == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        _, key = heapq.heappop(ready)
+        order.append(key)
+        for dependent in dependents[key]:
+            missing[dependent] -= 1
+            if missing[dependent] == 0:
+                heapq.heappush(ready, (names[dependent], dependent))
+    return order
+
+
+def describe_graph(dependencies):
+    """Tasks of a graph ({key: dependencies}), in topological order."""
+    return [
+        {
+            "key": key_name(key),
+            "stage": key_split(key),
+            "dependencies": sorted(key_name(dep) for dep in dependencies[key]),
+        }
+        for key in topological_order(dependencies)
+    ]
+
+
+def graph_to_text(tasks):
+    lines = [f"# {len(tasks)} tasks: key <- dependencies"]
+    lines += [f"{t['key']} <- {', '.join(t['dependencies'])}" for t in tasks]
+    return "\n".join(lines) + "\n"
+
+
+def graph_to_html(tasks, title="TIE pipeline"):
+    rows = "\n".join(
+        "<tr><td>{}</td><td>{}</td><td>{}</td></tr>".format(
+            html.escape(t["stage"]),
+            html.escape(t["key"]),
+            "<br>".join(html.escape(d) for d in t["dependencies"]),
+        )
+        for t in tasks
+    )
+    return (
+        "<!DOCTYPE html>\n<html><head><meta charset='utf-8'>"
+        f"<title>{html.escape(title)}</title></head><body>\n"
+        f"<h1>{html.escape(title)}</h1><p>{len(tasks)} tasks</p>\n"
+        "<table border='1'><tr><th>Stage</th><th>Task</th>"
+        f"<th>Dependencies</th></tr>\n{rows}\n</table></body></html>\n"
+    )
+
+
+def render_graph(task, path, render):
+    """Write the graph of `task` to `path` (without extension), see `RENDERERS`.
+
+    Returns the path of the written file, None if nothing was written.
+    """
+    if render == "none":
+        return None
+    try:
+        if render in ("text", "html"):
+            graph = task.__dask_graph__()
+            tasks = describe_graph(graph.get_all_dependencies())
+            path = f"{path}.{'txt' if render == 'text' else 'html'}"
+            text = graph_to_text(tasks) if render == "text" else graph_to_html(tasks)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            # Written to a file, not shown
+            dask.visualize(task, engine=render, filename=path, optimize_graph=True)
+    except Exception as e:
+        # No write access or missing 'ipycytoscape' or 'graphviz'
+        logger.error(f"Error while saving Dask Task Graph to file:  {e}")
+        return None
+    logger.info(f"Dask Task Graph saved to {path}")
+    return path
+
+
+def critical_path(tasks):
+    """Duration and keys of the longest chain of dependent tasks."""
+    durations = {t["key"]: t["duration"] for t in tasks}
+    finish, previous = {}, {}
+    for t in tasks:
+        # `tasks` in topological order
+        deps = [d for d in t["dependencies"] if d in finish]
+        before = max(deps, key=finish.get) if deps else None
+        previous[t["key"]] = before
+        finish[t["key"]] = durations[t["key"]] + (finish[before] if before else 0.0)
+    if not finish:
+        return {"duration": 0.0, "keys": []}
+    key = max(finish, key=finish.get)
+    duration = finish[key]
+    keys = []
+    while key is not None:
+        keys.append(key)
+        key = previous[key]
+    return {"duration": round(duration, 4), "keys": keys[::-1]}
+
+
+class GraphProfile(Callback):
+    """Record the tasks of the computation and their timings."""
+
+    def _start_state(self, dsk, state):
+        self.start = time.perf_counter()
+        self.dependencies = {k: set(v) for k, v in state["dependencies"].items()}
+        self.started = {}
+        self.timings = {}
+
+    def _pretask(self, key, dsk, state):
+        self.started[key] = time.perf_counter() - self.start
+
+    def _posttask(self, key, result, dsk, state, worker_id):
+        end = time.perf_counter() - self.start
+        self.timings[key] = (self.started.pop(key, end), end, worker_id)
+
+    def _finish(self, dsk, state, errored):
+        self.wall = time.perf_counter() - self.start
+        self.errored = errored
+
+    def profile(self, **info):
+        """The run, as written to ``graph_profile.json``."""
+        timings = {key_name(k): timing for k, timing in self.timings.items()}
+        tasks = []
+        for task in describe_graph(self.dependencies):
+            timing = timings.get(task["key"])
+            if timing is None:
+                # Not run (failed or cancelled before)
+                continue
+            start, end, worker = timing
+            task.update(
+                start=round(start, 4),
+                end=round(end, 4),
+                duration=round(end - start, 4),
+                worker=worker,
+            )
+            tasks.append(task)
+
+        stages = {}
+        for t in tasks:
+            stage = stages.setdefault(t["stage"], {"tasks": 0, "duration": 0.0})
+            stage["tasks"] += 1
+            stage["duration"] = round(stage["duration"] + t["duration"], 4)
+
+        return {
+            "version": PROFILE_VERSION,
+            **info,
+            "wall": round(getattr(self, "wall", 0.0), 4),
+            "errored": getattr(self, "errored", False),
+            "tasks": tasks,
+            "stages": stages,
+            "critical_path": critical_path(tasks),
+        }
+
+    def write(self, path, **info):
+        with open(path, "w") as f:
+            json.dump(self.profile(**info), f, indent=2)
+        logger.info(f"Graph profile saved to {path}")
+        return path
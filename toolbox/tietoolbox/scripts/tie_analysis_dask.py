@@ -1,9 +1,13 @@
 # import dask_geopandas as dask_gpd
 import argparse
+import copy
+import json
 import logging
 import os
 import sys
 import pickle
+import uuid
+from contextlib import ExitStack
 from pathlib import PurePath
 
 # ArcGis Pro is adding the paths of the default `conda`environement.
@@ -18,24 +22,61 @@ if ".exe" in sys.executable and any("ESRI" in pth for pth in sys.path):
 
     sys.path = paths
 
-import geopandas as gpd
-import matplotlib.pyplot as plt
-import rasterio as rst
-import pyogrio
 import click
 import dask
 import numpy as np
 from dask.delayed import delayed
 
-from shapely.geometry import box as shapely_box
-
-from tietoolbox.scripts.utils import universalpath
-
-from untie import TIE_core as TIEcr
-from untie import TIE_load as TIEld
-
-from tietoolbox.scripts.utils import array_to_tif, dem_to_array, cropDEMextent
+from tietoolbox.scripts.lazy import lazy_import
+
+# Imported on first use: keeps the start of the script fast
+gpd = lazy_import("geopandas")
+rst = lazy_import("rasterio")
+pyogrio = lazy_import("pyogrio")
+shapely = lazy_import("shapely")
+TIEld = lazy_import("untie.TIE_load")
+
+from tietoolbox.scripts.utils import (
+    array_to_tif,
+    bbox_window,
+    dem_to_array,
+    load_dem_window,
+    open_raster,
+    rasterize_on_dem,
+    read_dem_window,
+    read_layer,
+)
 from tietoolbox.scripts.config import load_config_json
+from tietoolbox.scripts import sparse_raster, tiling
+from tietoolbox.scripts.dem_grid import DEMGrid, orient
+from tietoolbox.scripts.categories import (
+    NODATA,
+    CategoricalRaster,
+    category_dtype,
+    layer_codes,
+    tif_tags,
+)
+from tietoolbox.scripts.sparse_raster import SparseRaster
+from tietoolbox.scripts.stage_cache import (
+    StageCache,
+    cached_call,
+    cached_stage,
+    source_signature,
+)
+from tietoolbox.scripts.trace_store import save_dem, save_traces
+from tietoolbox.scripts.vector_cache import VectorCache
+from tietoolbox.scripts.scheduler import scheduler, scheduler_config
+from tietoolbox.scripts.tie_parallel import tie_chunked, tie_grid
+from tietoolbox.scripts.metrics import MetricsRecorder, stage_metrics
+from tietoolbox.scripts.dask_progress import CancelCallback, DaskProgress
+from tietoolbox.scripts.geotiff import output_config
+from tietoolbox.scripts.task_graph import (
+    RENDERERS,
+    GraphProfile,
+    graph_config,
+    render_graph,
+)
+from tietoolbox.progress import ProgressWriter
 
 
 class FlushHandler(logging.Handler):
@@ -59,51 +100,171 @@ class DataException(Exception):
     pass
 
 class TIEDataProcessor:
-    def __init__(self, config):
+    def __init__(self, config, progress=None, cancel=None, pool=None, layers=None):
         # TODO:
+        # The sources are formatted with it: not set in the environment,
+        # which the projects of a batch share (see tie_batch)
         config.geodata_dir = config.project_dir
-        if config.geodata_dir:
-            os.environ["geodata_dir"] = config.geodata_dir
         self.cfg = config
         self.project_dir = config.project_dir
         self.dem_source = (
             config.DEM.source
         )  # "../tie/data/Widdergalm/swissalti3d-2.0-mosaic.tif"
+        self.dem_halo = config.DEM.get("halo", 0)
+        # Keep the DEM open between the reads of a worker (batch runs)
+        self.dem_keep_open = config.DEM.get("keep_open", False)
         self.bounds = None
         self.minx, self.miny, self.maxx, self.maxy = self.cfg.bbox
         self.x, self.y = (self.minx, self.maxx), (self.miny, self.maxy)
-        self.bedrock_path = None
+        self.bedrock_path = config.Bedrock.source.format(geodata_dir=config.geodata_dir)
         self.tec_path = config.Lines.source.format(geodata_dir=config.geodata_dir)
         self.tec_name = config.Lines.layer
-        self.transform = None
-        self.crs = None
         self.cache_dir = os.path.join(
             self.project_dir, "cache"
         )  # should load from cfg?
         if not os.path.isdir(self.cache_dir):
             os.makedirs(self.cache_dir)
+        # Results of the stages, keyed by their inputs
+        cache_cfg = config.get("cache", {})
+        self.stage_cache = None
+        if cache_cfg.get("enabled", True):
+            self.stage_cache = StageCache(
+                os.path.join(self.cache_dir, "stages"),
+                max_size_mb=cache_cfg.get("max_size_mb", 2048),
+            )
+        # Copies of the loaded layers ('none', 'parquet' or 'flatgeobuf')
+        self.vector_cache = VectorCache(
+            self.cache_dir, cache_cfg.get("vector_format", "none")
+        )
+        self.metrics = MetricsRecorder(self.cache_dir)
+        # Progress events for the toolbox (a `ProgressWriter`), if any
+        self.progress = progress
+        # Set by the analysis server (see tie_server): a `threading.Event`
+        # cancelling the run and the executor of the dask workers
+        self.cancel = cancel
+        self.pool = pool
+        # Features of the 'Bedrock' and 'Lines' layers in the bbox, already
+        # loaded by the batch runs (see tie_batch)
+        self.layers = layers or {}
+        # Description and profile of the dask graph (see task_graph)
+        self.graph_cfg = graph_config(config)
+        # Tiled execution (sizes in meters)
+        tiling_cfg = config.get("tiling", {})
+        self.tiled = tiling_cfg.get("enabled", False)
+        self.tile_size = tiling_cfg.get("tile_size", 1000)
+        self.tile_halo = tiling_cfg.get("halo", 50)
+        if self.tiled:
+            # In pixels of the DEM (see tiling.make_tiles)
+            with rst.open(self.dem_source) as src:
+                res = src.res[0]
+            self.tile_pixels = int(round(self.tile_size / res))
+            self.halo_pixels = int(round(self.tile_halo / res))
+            for name, size, pixels in (
+                ("tile_size", self.tile_size, self.tile_pixels),
+                ("halo", self.tile_halo, self.halo_pixels),
+            ):
+                if pixels < 1:
+                    raise ValueError(
+                        f"tiling.{name} of {size} m is less than a pixel of the "
+                        f"DEM ({res} m)"
+                    )
+        self.rasterize_method = config.get("rasterize_method", "rasterizeSHP")
+        # Options of the GeoTIFF outputs (see geotiff)
+        self.outputs = {
+            name: output_config(config, name)
+            for name in ("BEDrst", "TECrst", "cropped")
+        }
+        # rasterizeGPD by strips of rows, in parallel (0: single call)
+        rasterize_cfg = config.get("rasterize", {})
+        self.rasterize_strip_rows = rasterize_cfg.get("strip_rows", 1024)
+        self.rasterize_workers = (
+            rasterize_cfg.get("num_workers") or scheduler_config(config)["num_workers"]
+        )
+        self.use_arrow = config.get("use_arrow", True)
+        # TIE analysis of the traces in parallel chunks (0: single call), with
+        # the 'threads' and 'synchronous' schedulers only
+        tie_cfg = config.get("tie", {})
+        self.tie_chunk_size = tie_cfg.get("chunk_size", 0)
+        self.tie_workers = (
+            tie_cfg.get("num_workers") or scheduler_config(config)["num_workers"]
+        )
+        scheduler_type = scheduler_config(config)["type"]
+        if self.tie_chunk_size and scheduler_type not in ("threads", "synchronous"):
+            # The tasks already run in worker processes (daemonic ones for
+            # 'distributed', which cannot have children): no nested pools
+            logger.info(
+                f"TIE analysis in the '{scheduler_type}' workers, not in chunks"
+            )
+            self.tie_chunk_size = 0
+        if self.tiled and self.rasterize_method != "rasterizeGPD":
+            # The grid of `rasterizeSHP` depends on the features of each tile
+            logger.info("Tiled analysis: rasterizing on the DEM grid (rasterizeGPD)")
+            self.rasterize_method = "rasterizeGPD"
+
+    def __getstate__(self):
+        # Pickled with the tasks by the 'processes' scheduler: the progress
+        # writer, cancel event and pool are only used by the scheduler itself,
+        # the preloaded layers are inputs of the graph
+        state = self.__dict__.copy()
+        state.update(progress=None, cancel=None, pool=None, layers={})
+        return state
+
+    def stage_params(self, stage):
+        """Configuration a cached stage depends on, besides its inputs."""
+        if stage == "load_big_shp":
+            return {
+                "layers": {grp: self.layer_config(grp) for grp in ("Bedrock", "Lines")},
+                "sources": [
+                    source_signature(self.bedrock_path),
+                    source_signature(self.tec_path),
+                ],
+                "bbox": self.cfg.bbox,
+            }
+        if stage == "crop_dem":
+            return {
+                "source": source_signature(self.dem_source),
+                "bbox": self.cfg.bbox,
+                "halo": self.dem_halo,
+            }
+        if stage == "rasterize_shp":
+            return {"method": self.rasterize_method}
+        return {}
+
+    def layer_config(self, group):
+        """Source, layer, attribute and filter of the 'Bedrock' or 'Lines' layer."""
+        grp_cfg = self.cfg[group]
+        return {
+            "source": self.bedrock_path if group == "Bedrock" else self.tec_path,
+            "layer": grp_cfg.layer,
+            "attribute": grp_cfg.attribute,
+            "where": grp_cfg.get("where"),
+        }
 
     @delayed
-    def load_dem(self):
-        # Load DEM
-        dem_data = rst.open(self.dem_source)
-
-        return dem_data  # Replace with actual loading logic
-
-    @delayed
-    def load_big_shp(self, tec_name, use_crs=False):
+    @stage_metrics
+    @cached_stage
+    def load_big_shp(self, group):
+        # Only the geometry and the attribute of the features in the bbox
+        # (and matching `where`) are read
         TECbig = None
-        logger.info(f"Loading from GDB: {tec_name}")
-        bbox = tuple(self.cfg.bbox)
+        lyr_cfg = self.layer_config(group)
+        tec_name = lyr_cfg["layer"]
+        where = lyr_cfg["where"]
+        logger.info(
+            f"Loading from GDB: {tec_name}" + (f" where {where}" if where else "")
+        )
 
         try:
-            TECbig = gpd.read_file(
-                self.tec_path,
-                driver="OpenFileGDB",
-                bbox=bbox,
-                engine="pyogrio",
-                layer=tec_name,
-            )
+            TECbig = self.vector_cache.load(lyr_cfg, self.cfg.bbox)
+            if TECbig is None:
+                TECbig = read_layer(
+                    lyr_cfg["source"],
+                    tec_name,
+                    columns=[lyr_cfg["attribute"]],
+                    bbox=self.cfg.bbox,
+                    where=where,
+                    use_arrow=self.use_arrow,
+                )
         except (pyogrio.errors.DataSourceError, pyogrio.errors.DataLayerError) as py_e:
             logging.error(f"Error while loading '{tec_name}': {py_e}")
         except Exception as e:
@@ -112,22 +273,32 @@ class TIEDataProcessor:
         if TECbig is None:
             raise DataException
 
-        if use_crs:
-            self.crs = TECbig.crs
-        if TECbig is not None or not TECbig.empty:
-            try:
-                json_path = os.path.join(self.cache_dir, f"{tec_name}.geojson")
-                TECbig.to_file(json_path, driver="GeoJSON")
-            except (FileNotFoundError, PermissionError, OSError, IOError) as e:
-                logging.error(f"Error while writing '{json_path}': {e}")
-
         return TECbig
 
+    def big_shp(self, group):
+        """Task of the features of `group`: the preloaded ones, else `load_big_shp`."""
+        if group in self.layers:
+            return delayed(
+                self.layers[group], name=f"load_big_shp-{uuid.uuid4().hex}"
+            )
+        return self.load_big_shp(group)
+
+    @delayed
+    @stage_metrics
+    def save_layer(self, TECbig, group):
+        # Copy of the loaded features, for the next runs (see vector_cache)
+        lyr_cfg = self.layer_config(group)
+        try:
+            return self.vector_cache.store(TECbig, lyr_cfg, self.cfg.bbox)
+        except Exception as e:
+            logging.error(f"Error while saving a copy of '{lyr_cfg['layer']}': {e}")
+
     @delayed
+    @stage_metrics
     def create_extent_alt(self, TECbig, save_to_file=True):
         bounds = self.cfg.bbox
         logger.info(f"Creating extent (NEW): {bounds}")
-        extent_df = gpd.GeoDataFrame({"id": 1, "geometry": [shapely_box(*bounds)]})
+        extent_df = gpd.GeoDataFrame({"id": 1, "geometry": [shapely.box(*bounds)]})
         extent_df.set_crs("epsg:2056")
 
         if save_to_file:
@@ -144,6 +315,7 @@ class TIEDataProcessor:
 
     # Origina,l not working
     @delayed
+    @stage_metrics
     def create_extent(self, TECbig, save_to_file=True):
         logger.info(f"Creating extent (ORI): {self.x}, {self.y}")
         extent = TIEld.createExtentPLG(self.x, self.y, TECbig.crs)
@@ -160,52 +332,114 @@ class TIEDataProcessor:
         return extent
 
     @delayed
-    def crop_dem(self, DEMbig, extent):
-        # Crop DEM
-        logger.info("Crop DEM")
-        # from test_extent import simple_crop
-        # cropped_dem = simple_crop(DEMbig, bbox=self.cfg.bbox)
-        # Ori
-        cropped_dem = TIEld.cropDEMextent(DEMbig, extent)
-        # custom
-        # cropped_dem =  cropDEMextent(DEMbig, extent)
-        self.transform = cropped_dem["meta"]["transform"]
-        return cropped_dem  # Replace with actual cropping logic
+    @stage_metrics
+    @cached_stage
+    def crop_dem(self):
+        # Only the window of the bbox (plus halo) is read from the mosaic
+        logger.info(f"Crop DEM (halo: {self.dem_halo}m)")
+        return load_dem_window(
+            self.dem_source, self.cfg.bbox, self.dem_halo, self.dem_keep_open
+        )
 
     @delayed
+    @stage_metrics
+    @cached_stage
     def adapt_shp_to_dem(self, big_shp, cropped_dem):
         logger.info("Adapt SHP to DEM")
         return TIEld.adaptSHAPE2DEM(big_shp, cropped_dem)
 
     @delayed
-    def rasterize_shp(self, TECshp, attr_TEC, DEM, layername):
+    @stage_metrics
+    def select_shp_in_dem(self, big_shp, DEM):
+        # Not clipped: GDAL burns a line from its vertices, clipping moves
+        # them and so the pixels of the whole clipped segment. Whole, a line
+        # crossing two tiles is burnt on the same pixels in both of them,
+        # and on the same ones whatever the bbox
+        trans = DEM["meta"]["transform"]
+        height, width = np.shape(DEM["z"])
+        extent = shapely.box(
+            trans[2],
+            trans[5] + trans[4] * height,
+            trans[2] + trans[0] * width,
+            trans[5],
+        )
+        index = np.sort(big_shp.sindex.query(extent, predicate="intersects"))
+        # Labels of the bbox read dropped: the same features give the same
+        # cache keys whatever the bbox
+        return big_shp.iloc[index].reset_index(drop=True)
+
+    @delayed
+    @stage_metrics
+    @cached_stage
+    def rasterize_shp(self, TECshp, attr_TEC, DEM, layername, sparse=False):
+        # Categories of the codes (see categories); `sparse`: only the burnt
+        # pixels are kept (see sparse_raster)
         logger.info(f"Rasterizing {layername} with {attr_TEC}")
         raster_shp = None
+        if TECshp.empty:
+            # Nothing to burn (e.g. a tile without lines)
+            logger.info(f"No feature to rasterize for '{layername}'")
+            if sparse:
+                return SparseRaster(np.shape(DEM["z"]))
+            return CategoricalRaster(
+                np.full(np.shape(DEM["z"]), NODATA, dtype=category_dtype(0)), ()
+            )
         if attr_TEC not in TECshp.columns:
             logging.error(
                 f"Dataframe '{attr_TEC}' is not in {TECshp.columns} ('{layername}')"
             )
         try:
-            raster_shp = TIEld.rasterizeSHP(TECshp, attr_TEC, DEM)
+            codes = layer_codes(TECshp, attr_TEC)
+            if self.rasterize_method == "rasterizeGPD":
+                raster = rasterize_on_dem(
+                    TECshp,
+                    attr_TEC,
+                    DEM,
+                    codes=codes,
+                    strip_rows=self.rasterize_strip_rows,
+                    num_workers=self.rasterize_workers,
+                )
+                raster_shp = CategoricalRaster(raster, codes)
+            else:
+                raster = TIEld.rasterizeSHP(TECshp, attr_TEC, DEM)
+                if sparse and 0 not in codes:
+                    # Pixels outside of the extent of the lines are 0, not a
+                    # kind: without them TECrst only holds the lines
+                    raster[raster == 0] = np.nan
+                raster_shp = CategoricalRaster.from_float(raster, codes)
         except IndexError as idx_err:
             logging.error(f"Rasterizing error ({layername}): {idx_err}")
         except Exception as e:
             logging.error(f"Unknown error while rasterizing '{layername}': {e}")
         if raster_shp is None or raster_shp.size == 0:
             logging.error(f"Rasterized geodataframe for '{layername}' is empty")
+        elif sparse:
+            raster_shp = SparseRaster.from_categorical(raster_shp)
         return raster_shp
 
     @delayed
+    @stage_metrics
+    @cached_stage
     def tie_analysis(self, traces, DEM, seg=True):
         logger.info(" === TIE Analysis ===")
-        traces = TIEcr.tie(traces, DEM["x"], DEM["y"], np.flipud(DEM["z"]), seg=seg)
+        # TIE completes the traces in place, they may be shared with other stages
+        traces = copy.deepcopy(traces)
+        traces = tie_chunked(
+            traces,
+            DEM,
+            seg=seg,
+            chunk_size=self.tie_chunk_size,
+            num_workers=self.tie_workers,
+            tmp_dir=self.cache_dir,
+        )
 
         return traces
 
     @delayed
+    @stage_metrics
     def shortcircuit_faults(self, TECrst, BEDrst, DEM):
         logger.info("Short-circuiting fault analysis (TECrst)")
-        faults = TIEld.extractTraces(TECrst, "L")
+        faults = sparse_raster.extract_traces(TECrst, "L")
 
         logger.info(f"TECrst, found  faults: {len(faults)}")
 
@@ -218,22 +452,29 @@ class TIEDataProcessor:
         return faults
 
     @delayed
+    @stage_metrics
+    @cached_stage
     def extract_traces(self, TECrst, geom_type="L"):
         logger.info(f"Extracting trace of type '{geom_type}'")
-        faults = TIEld.extractTraces(TECrst, geom_type)
+        # Same traces as `TIE_load.extractTraces`, without full size matrices
+        faults = sparse_raster.extract_traces(TECrst, geom_type)
         return faults
 
     @delayed
+    @stage_metrics
     def identify_traces_toto(self, BEDrst, faults):
         logger.info("Identifying traces")
-        BTRrst = TIEld.identifyTRACE(BEDrst, faults)
+        BTRrst = TIEld.identifyTRACE(BEDrst.to_float(), faults)
 
         return BEDrst
 
     @delayed
+    @stage_metrics
+    @cached_stage
     def find_neight_type(self, traces, BEDrst):
         logger.info("Identifying neightbours")
-        traces = TIEld.findNeighType(traces, BEDrst)
+        # untie works on the codes (float64, NaN)
+        traces = TIEld.findNeighType(copy.deepcopy(traces), BEDrst.to_float())
         return traces
 
     # @delayed
@@ -262,47 +503,73 @@ class TIEDataProcessor:
     #     return traces
 
     @delayed
+    @stage_metrics
+    @cached_stage
     def identify_traces(self, BEDrst, faults):
         logger.info("Short-circuiting traces analysis")
         # faults = TIEld.extractTraces(TECrst, "L")
         # logger.info(f"faults={len(faults)}")
 
-        BTRrst = TIEld.identifyTRACE(BEDrst, faults)
+        BTRrst = TIEld.identifyTRACE(BEDrst.to_float(), faults)
 
-        return BTRrst
+        # Bedrock interfaces along the faults: sparse
+        return SparseRaster.from_dense(BTRrst)
 
     @delayed
+    @stage_metrics
     def save_tie_analysis(self, traces, faults, dem):
         logger.info("Saving TIE Analysis")
         if faults is not None:
-            with open(PurePath(self.cache_dir, "faults.pkl"), "wb") as f:
-                pickle.dump(faults, f)
+            save_traces(faults, os.path.join(self.cache_dir, "faults"))
 
         if traces is not None:
             logger.info("Saving traces")
-            with open(PurePath(self.cache_dir, "traces.pkl"), "wb") as f:
-                pickle.dump(traces, f)
+            save_traces(traces, os.path.join(self.cache_dir, "traces"))
         if dem is not None:
-            with open(PurePath(self.cache_dir, "DEM.pkl"), "wb") as f:
-                pickle.dump(dem, f)
+            save_dem(dem, os.path.join(self.cache_dir, "DEM"))
 
     @delayed
-    def save_rst(self, rst, outname, save_as_tiff=True):
-        rst_both = np.flip(rst, (0, 1))
-
-        np.save(PurePath(self.cache_dir, f"{outname}.npy"), rst)
-        logger.info(f"Saved Rst {outname} to {self.cache_dir}")
+    @stage_metrics
+    def save_rst(self, rst, DEM, outname, save_as_tiff=True, save_as_npy=True):
+        tif_options = self.outputs[outname]
+        save_as_tiff = save_as_tiff and tif_options["tif"]
+        # Lookup table of the categories (codes and labels)
+        rst.save_table(PurePath(self.cache_dir, f"{outname}.json"))
+        if isinstance(rst, SparseRaster):
+            # .npz and GeoTIFF of the pixels only
+            if save_as_npy:
+                rst.save(PurePath(self.cache_dir, f"{outname}.npz"))
+                logger.info(f"Saved sparse Rst {outname} to {self.cache_dir}")
+            if save_as_tiff:
+                rst.to_tif(
+                    PurePath(self.cache_dir, f"{outname}.tif"),
+                    DEM["meta"]["crs"],
+                    DEM["meta"]["transform"],
+                    tif_options,
+                )
+                logger.info(f"Saved Rst {outname} to {self.cache_dir} as GeoTiff")
+            return
+
+        rst_both = orient(rst.data, "flipped")
+
+        if save_as_npy:
+            np.save(PurePath(self.cache_dir, f"{outname}.npy"), rst.data)
+            logger.info(f"Saved Rst {outname} to {self.cache_dir}")
 
         if save_as_tiff:
             array_to_tif(
                 rst_both,
                 PurePath(self.cache_dir, f"{outname}.tif"),
-                self.crs,
-                self.transform,
+                DEM["meta"]["crs"],
+                DEM["meta"]["transform"],
+                nodata=NODATA,
+                tags=tif_tags(rst.codes),
+                options=tif_options,
             )
             logger.info(f"Saved Rst {outname} to {self.cache_dir} as GeoTiff")
 
     @delayed
+    @stage_metrics
     def save_gdf_to_json(self, geo_frm, outname):
         json_path = os.path.join(self.cache_dir, outname)
         # TODO: keep failing because of schema
@@ -330,32 +597,185 @@ class TIEDataProcessor:
             logging.error(f"Error while writing GeoJSON to {json_path}: {e}")
 
     @delayed
+    @stage_metrics
     def save_data(self, DEM, output_path):
+        tif_options = self.outputs[PurePath(output_path).stem]
+        if not tif_options["tif"]:
+            return
         DEMarr = dem_to_array(DEM)
 
         array_to_tif(
-            DEMarr, PurePath(self.cache_dir, output_path), self.crs, self.transform
+            DEMarr,
+            PurePath(self.cache_dir, output_path),
+            DEM["meta"]["crs"],
+            DEM["meta"]["transform"],
+            nodata=DEM["meta"].get("nodata"),
+            options=tif_options,
         )
         logger.info(f"DEM saved as GeoTIFF to {output_path}")
 
     @delayed
+    @stage_metrics
+    def crop_dem_window(self, window):
+        logger.info(f"Reading DEM window {window}")
+        with open_raster(self.dem_source, self.dem_keep_open) as src:
+            return read_dem_window(src, window)
+
+    @delayed
+    @stage_metrics
+    def split_tile_traces(self, traces, tile):
+        interior, border = tiling.split_traces(traces, tile.core, tile.window)
+        logger.info(
+            f"Tile {tile.id}: {len(interior)} interior, {len(border)} border traces"
+        )
+        return interior, border
+
+    @delayed
+    @stage_metrics
+    def tile_to_grid(self, traces, tile, grid_window):
+        # Copies: the tile traces may still be used by other tasks
+        grid_traces = []
+        for tr in traces:
+            grid_tr = copy.copy(tr)
+            grid_tr.index = tiling.window_to_grid(tr.index, tile.window, grid_window)
+            grid_traces.append(grid_tr)
+        return grid_traces
+
+    @delayed
+    @stage_metrics
+    def write_tile_core(self, rst, tile, grid_window, outname, codes):
+        # The categories of the tile in the lookup table `codes` of the grid
+        if rst is None:
+            return
+        grid_slices, tile_slices = tiling.core_block(tile, grid_window)
+        grid_rst = np.load(PurePath(self.cache_dir, f"{outname}.npy"), mmap_mode="r+")
+        grid_rst[grid_slices] = rst.recode(codes).data[tile_slices]
+        grid_rst.flush()
+        del grid_rst
+
+    @delayed
+    @stage_metrics
+    def sparse_tile_core(self, rst, tile, grid_window):
+        if rst is None:
+            return None
+        grid_slices, tile_slices = tiling.core_block(tile, grid_window)
+        return rst.block(tile_slices).place(
+            (grid_window[2], grid_window[3]),
+            (grid_slices[0].start, grid_slices[1].start),
+        )
+
+    @delayed
+    @stage_metrics
+    def merge_sparse_cores(self, cores, grid_window):
+        return SparseRaster.merge((grid_window[2], grid_window[3]), cores)
+
+    @delayed
+    @stage_metrics
+    def create_grid_raster(self, outname, BEDbig, attr, grid_window):
+        """Full size categorical raster, filled by the tiles. Returns its codes.
+
+        The lookup table holds the codes of all the features: the tiles
+        write their categories in it (see `write_tile_core`).
+        """
+        codes = layer_codes(BEDbig, attr)
+        np.lib.format.open_memmap(
+            PurePath(self.cache_dir, f"{outname}.npy"),
+            mode="w+",
+            dtype=category_dtype(len(codes)),
+            shape=(grid_window[2], grid_window[3]),
+        )
+        return codes
+
+    @delayed
+    @stage_metrics
+    def load_grid_raster(self, outname, codes, *args):
+        return CategoricalRaster(
+            np.load(PurePath(self.cache_dir, f"{outname}.npy"), mmap_mode="r"), codes
+        )
+
+    @delayed
+    @stage_metrics
+    def stitch_tile_traces(self, pieces, grid_window, seg=True):
+        pieces = [tr for tile_pieces in pieces for tr in tile_pieces]
+        traces = tiling.stitch_traces(
+            pieces, grid_window, sort_line=sparse_raster.sort_pixels
+        )
+        logger.info(f"Stitched {len(pieces)} border pieces into {len(traces)} traces")
+
+        # TIE analysis on the smallest DEM window holding each trace
+        dem_signature = source_signature(self.dem_source)
+        with rst.open(self.dem_source) as src:
+            for i, tr in enumerate(traces):
+                window = tiling.trace_window(tr.index, grid_window)
+                tr.index = tiling.grid_to_window(tr.index, window, grid_window)
+                tr = self.tie_window_trace(src, tr, window, seg, dem_signature)
+                tr.index = tiling.window_to_grid(tr.index, window, grid_window)
+                traces[i] = tr
+        return traces
+
+    def tie_window_trace(self, src, trace, window, seg, dem_signature):
+        """TIE analysis of a trace on a DEM window, cached.
+
+        The trace (indices in `window`) and the window do not depend on the
+        bbox: the stitched traces away from its border are reused when it
+        moves.
+        """
+
+        def analyse():
+            DEM = read_dem_window(src, window)
+            tie_grid([trace], DEMGrid.from_dem(DEM), seg=seg)
+            return trace
+
+        # The id depends on the other traces
+        content = {k: v for k, v in vars(trace).items() if k != "id"}
+        result = cached_call(
+            self.stage_cache,
+            "tie_window_trace",
+            analyse,
+            (content, window, seg),
+            dem_signature,
+        )
+        result.id = trace.id
+        return result
+
+    @delayed
+    @stage_metrics
+    def collect_tile_traces(self, interior, border):
+        traces = [tr for tile_traces in interior for tr in tile_traces] + border
+        return tiling.renumber(traces)
+
+    def save_layers(self, BEDbig, TECbig):
+        """Tasks saving a copy of the loaded layers, if enabled."""
+        if not self.vector_cache.enabled:
+            return []
+        return [self.save_layer(BEDbig, "Bedrock"), self.save_layer(TECbig, "Lines")]
+
+    @delayed
+    @stage_metrics
     def finalizing_tie(self, *args):
         pass
 
     def process_geodata(self):
+        if self.tiled:
+            return self.process_geodata_tiled()
+
         # Create dask graph
 
         # Loading data
-        load_big_dem_task = self.load_dem()
-        load_big_bed_task = self.load_big_shp(self.cfg.Bedrock.layer, use_crs=True)
-        load_big_tec_task = self.load_big_shp(self.cfg.Lines.layer, use_crs=False)
+        load_big_bed_task = self.big_shp("Bedrock")
+        load_big_tec_task = self.big_shp("Lines")
 
         # preaparing data
         create_extent_taks = self.create_extent(load_big_bed_task)
-        crop_dem_task = self.crop_dem(load_big_dem_task, create_extent_taks)
+        crop_dem_task = self.crop_dem()
 
         bed_shp_task = self.adapt_shp_to_dem(load_big_bed_task, crop_dem_task)
-        tec_shp_task = self.adapt_shp_to_dem(load_big_tec_task, crop_dem_task)
+        if self.rasterize_method == "rasterizeGPD":
+            # Burnt on the DEM grid: the lines are not clipped, as in the
+            # tiled analysis (see `select_shp_in_dem`)
+            tec_shp_task = self.select_shp_in_dem(load_big_tec_task, crop_dem_task)
+        else:
+            tec_shp_task = self.adapt_shp_to_dem(load_big_tec_task, crop_dem_task)
 
         # TODO: cannot save to geojson (scham issue)
         save_bed_shp_task = self.save_gdf_to_json(
@@ -371,7 +791,11 @@ class TIEDataProcessor:
         )
 
         tec_rast_task = self.rasterize_shp(
-            tec_shp_task, self.cfg.Lines.attribute, crop_dem_task, "tecto lines"
+            tec_shp_task,
+            self.cfg.Lines.attribute,
+            crop_dem_task,
+            "tecto lines",
+            sparse=True,
         )
 
         # Extracting traces
@@ -407,8 +831,8 @@ class TIEDataProcessor:
         # if traces_task:
         save_tie_task = self.save_tie_analysis(traces_task, faults_task, crop_dem_task)
 
-        save_rst_task = self.save_rst(bed_rast_task, "BEDrst")
-        save_tec_task = self.save_rst(tec_rast_task, "TECrst")
+        save_rst_task = self.save_rst(bed_rast_task, crop_dem_task, "BEDrst")
+        save_tec_task = self.save_rst(tec_rast_task, crop_dem_task, "TECrst")
 
         save_data_task = self.save_data(crop_dem_task, "cropped.tif")
 
@@ -419,25 +843,188 @@ class TIEDataProcessor:
             save_tec_task,
             save_bed_shp_task,
             tec_shp_task_task,
+            create_extent_taks,
+            *self.save_layers(load_big_bed_task, load_big_tec_task),
         )
 
-        # Visualize the graph
+        self.compute(final_task)
 
-        pipeline_file = os.path.join(self.project_dir, "tie_pipeline")
+    def process_tile(self, tile, grid_window, BEDbig, TECbig, bed_codes):
+        """Tasks of one tile: rasterize, extract and analyse its traces.
+
+        Returns the delayed interior faults and traces (TIE done, grid
+        indices), the border pieces (grid indices), the write of the bedrock
+        raster and the tectonic lines of the core (grid indices).
+        """
+        DEM = self.crop_dem_window(tile.window)
+
+        bed_shp = self.select_shp_in_dem(BEDbig, DEM)
+        tec_shp = self.select_shp_in_dem(TECbig, DEM)
+
+        # Labelled by the window, not by the id of the tile: they are part of
+        # the cache keys, the ids change when the bbox moves
+        bed_rast = self.rasterize_shp(
+            bed_shp,
+            self.cfg.Bedrock.attribute,
+            DEM,
+            f"bedrock (window {tile.window})",
+        )
+        tec_rast = self.rasterize_shp(
+            tec_shp,
+            self.cfg.Lines.attribute,
+            DEM,
+            f"tecto lines (window {tile.window})",
+            sparse=True,
+        )
+
+        faults = self.extract_traces(tec_rast, geom_type="L")
+        btrst = self.identify_traces(bed_rast, faults)
+        traces = self.extract_traces(btrst, geom_type="PLG")
+        traces = self.find_neight_type(traces, bed_rast)
+
+        faults = self.split_tile_traces(faults, tile)
+        traces = self.split_tile_traces(traces, tile)
+
+        # Traces crossing the core border are analysed once stitched
+        faults_tie = self.tie_analysis(faults[0], DEM, seg=True)
+        traces_tie = self.tie_analysis(traces[0], DEM, seg=True)
+
+        return (
+            self.tile_to_grid(faults_tie, tile, grid_window),
+            self.tile_to_grid(faults[1], tile, grid_window),
+            self.tile_to_grid(traces_tie, tile, grid_window),
+            self.tile_to_grid(traces[1], tile, grid_window),
+            self.write_tile_core(bed_rast, tile, grid_window, "BEDrst", bed_codes),
+            self.sparse_tile_core(tec_rast, tile, grid_window),
+        )
+
+    def compare_tiles(self, tiles):
+        """Log the tiles shared with the former tiled analysis of the project.
+
+        Their results are in the stage cache: only the tiles along the border
+        of a moved bbox are analysed again.
+        """
+        path = os.path.join(self.cache_dir, "tiles.json")
+        current = {
+            "dem": os.path.abspath(self.dem_source),
+            "bbox": list(self.cfg.bbox),
+            "windows": [list(tile.window) for tile in tiles],
+        }
         try:
-            dask.visualize(
-                final_task,
-                engine="cytoscape",
-                filename=pipeline_file,
-                optimize_graph=True,
+            with open(path) as f:
+                former = json.load(f)
+        except (OSError, ValueError):
+            former = None
+
+        if former and former["dem"] == current["dem"]:
+            former_windows = {tuple(w) for w in former["windows"]}
+            same = sum(tuple(w) in former_windows for w in current["windows"])
+            logger.info(
+                f"bbox {former['bbox']} -> {current['bbox']}: {same} of "
+                f"{len(tiles)} tiles unchanged"
+                + ("" if self.stage_cache else " (enable 'cache' to reuse them)")
             )
-            plt.show()
-        except Exception as e:
-            # No write access or missing lib 'cytoscape'
-            logger.error(f"Error while saving Dask Task Graph to file:  {e}")
+        with open(path, "w") as f:
+            json.dump(current, f)
+
+    def process_geodata_tiled(self):
+        # Tiles are aligned on the DEM pixels
+        with rst.open(self.dem_source) as src:
+            grid_window = bbox_window(src, self.cfg.bbox)
+        tiles = tiling.make_tiles(grid_window, self.tile_pixels, self.halo_pixels)
+        logger.info(f"Tiled analysis: {len(tiles)} tiles over {grid_window}")
+        self.compare_tiles(tiles)
+
+        load_big_bed_task = self.big_shp("Bedrock")
+        load_big_tec_task = self.big_shp("Lines")
+        create_extent_taks = self.create_extent(load_big_bed_task)
+
+        # Tiles write their core directly into the full size bedrock raster,
+        # the tectonic lines are merged (sparse)
+        bed_codes_task = self.create_grid_raster(
+            "BEDrst", load_big_bed_task, self.cfg.Bedrock.attribute, grid_window
+        )
+
+        results = [
+            self.process_tile(
+                tile, grid_window, load_big_bed_task, load_big_tec_task, bed_codes_task
+            )
+            for tile in tiles
+        ]
+        (
+            faults_interior,
+            faults_border,
+            traces_interior,
+            traces_border,
+            writes,
+            tec_cores,
+        ) = zip(*results)
+
+        faults_task = self.collect_tile_traces(
+            list(faults_interior),
+            self.stitch_tile_traces(list(faults_border), grid_window, seg=True),
+        )
+        traces_task = self.collect_tile_traces(
+            list(traces_interior),
+            self.stitch_tile_traces(list(traces_border), grid_window, seg=True),
+        )
+
+        grid_dem_task = self.crop_dem_window(grid_window)
+        save_tie_task = self.save_tie_analysis(traces_task, faults_task, grid_dem_task)
+
+        save_rst_task = self.save_rst(
+            self.load_grid_raster("BEDrst", bed_codes_task, *writes),
+            grid_dem_task,
+            "BEDrst",
+            save_as_npy=False,
+        )
+        save_tec_task = self.save_rst(
+            self.merge_sparse_cores(list(tec_cores), grid_window),
+            grid_dem_task,
+            "TECrst",
+        )
+
+        save_data_task = self.save_data(grid_dem_task, "cropped.tif")
+
+        final_task = self.finalizing_tie(
+            save_tie_task,
+            save_data_task,
+            save_rst_task,
+            save_tec_task,
+            create_extent_taks,
+            *self.save_layers(load_big_bed_task, load_big_tec_task),
+        )
+
+        self.compute(final_task)
+
+    def compute(self, final_task):
+        # Description of the graph, written without blocking (see task_graph)
+        render_graph(
+            final_task,
+            os.path.join(self.project_dir, "tie_pipeline"),
+            self.graph_cfg["render"],
+        )
 
         # Compute the dask graph
-        dask.compute(final_task)
+        self.metrics.start_run()
+        profile = None
+        with scheduler(self.cfg, self.pool) as compute_kwargs, ExitStack() as stack:
+            if self.progress is not None:
+                stack.enter_context(DaskProgress(self.progress))
+            if self.cancel is not None:
+                stack.enter_context(CancelCallback(self.cancel))
+            if self.graph_cfg["profile"]:
+                profile = stack.enter_context(GraphProfile())
+            dask.compute(final_task, **compute_kwargs)
+        self.metrics.end_run(
+            scheduler=scheduler_config(self.cfg), tiled=self.tiled, bbox=self.cfg.bbox
+        )
+        if profile is not None:
+            profile.write(
+                os.path.join(self.cache_dir, "graph_profile.json"),
+                scheduler=scheduler_config(self.cfg)["type"],
+                tiled=self.tiled,
+            )
 
 
 @click.command()
@@ -459,17 +1046,52 @@ class TIEDataProcessor:
     default=PurePath(__file__).stem + ".json",
     show_default=True,
 )
-def main(config, log_level):
+@click.option(
+    "--progress-file",
+    help="Write the progress events (JSON lines) to this file",
+    metavar="FILE",
+    default=None,
+)
+@click.option(
+    "--graph",
+    type=click.Choice(RENDERERS),
+    default=None,
+    help="Write the task graph (default: 'graph.render' of the config, 'none')",
+)
+@click.option(
+    "--profile/--no-profile",
+    default=None,
+    help="Write graph_profile.json (default: 'graph.profile' of the config)",
+)
+def main(config, log_level, progress_file, graph, profile):
     import time
 
     cfg = load_config_json(config)
+    graph_cfg = dict(cfg.get("graph", {}))
+    if graph is not None:
+        graph_cfg["render"] = graph
+    if profile is not None:
+        graph_cfg["profile"] = profile
+    cfg["graph"] = graph_cfg
 
     logger.setLevel(log_level.upper())
 
     start = time.time()
     logger.info("== Starting pipeline ===")
-    processor = TIEDataProcessor(cfg)
-    processor.process_geodata()
+    with ExitStack() as stack:
+        progress = None
+        if progress_file:
+            progress = stack.enter_context(ProgressWriter(progress_file))
+        try:
+            processor = TIEDataProcessor(cfg, progress=progress)
+            processor.process_geodata()
+        except Exception as e:
+            if progress is not None:
+                elapsed = round(time.time() - start, 2)
+                progress.emit("end", status="error", message=str(e), elapsed=elapsed)
+            raise
+        if progress is not None:
+            progress.emit("end", status="ok", elapsed=round(time.time() - start, 2))
 
     logger.info(f"== Ending pipeline {time.time() - start}s===")
 
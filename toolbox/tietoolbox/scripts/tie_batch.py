@@ -0,0 +1,317 @@
+"""
+TIE analysis of many projects, listed in a manifest::
+
+    python tie_batch.py -m sheets.csv -c base_config.json -o D:/Campaign
+    python tie_batch.py -m sheets.gpkg -c base_config.json -o D:/Campaign -n SHEET
+    python tie_batch.py -m configs.txt -j 2
+
+The manifest is either:
+
+- a table of extents, the projects sharing the configuration `--config`: a
+  CSV with the columns 'name', 'minx', 'miny', 'maxx' and 'maxy', or a vector
+  dataset (GeoPackage, FileGDB...) whose features give the bbox (their
+  bounds) and the name (`--name-field`). Project `name` is written to
+  ``<output-dir>/<name>``;
+- a list of configuration files: one path per line (``.txt``) or a JSON list
+  of paths (``.json``), relative to the manifest.
+
+The projects share:
+
+- the features of the 'Bedrock' and 'Lines' layers: a layer (same source,
+  layer, attribute and `where`) is read once, for the extents of all the
+  projects, and then split per project;
+- the worker pool of the 'processes' scheduler; the workers keep the DEM open
+  (``DEM.keep_open``). `--jobs` projects are computed at the same time.
+
+``batch_summary.csv`` and ``batch_summary.json`` (in `--output-dir`) give the
+status of the projects ('ok' or 'failed', with the error) and their wall
+time.
+"""
+
+import copy
+import csv
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+import click
+
+from tietoolbox.scripts.config import Config, config_to_dict, load_config_json
+from tietoolbox.scripts.lazy import lazy_import
+from tietoolbox.scripts.scheduler import scheduler_config
+from tietoolbox.scripts.tie_analysis_dask import TIEDataProcessor
+from tietoolbox.scripts.utils import get_valid_filename, read_layer
+from tietoolbox.scripts.vector_cache import select_bbox
+
+pyogrio = lazy_import("pyogrio")
+shapely = lazy_import("shapely")
+
+logger = logging.getLogger(__name__)
+
+EXTENT_COLUMNS = ("minx", "miny", "maxx", "maxy")
+SUMMARY_FIELDS = ("name", "project_dir", "status", "error", "wall", "bbox")
+
+Project = namedtuple("Project", ["name", "cfg"])
+
+
+def _resolve(path, base_dir):
+    return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+def read_extents(manifest, name_field="name"):
+    """[(name, bbox)] of a CSV or of a vector dataset of extents."""
+    if manifest.lower().endswith(".csv"):
+        with open(manifest, newline="") as f:
+            rows = list(csv.DictReader(f))
+        columns = (name_field,) + EXTENT_COLUMNS
+        missing = [c for c in columns if rows and c not in rows[0]]
+        if missing:
+            raise ValueError(f"Missing columns in {manifest}: {missing}")
+        return [
+            (row[name_field], [float(row[c]) for c in EXTENT_COLUMNS]) for row in rows
+        ]
+
+    gdf = pyogrio.read_dataframe(manifest)
+    names = (
+        gdf[name_field].astype(str)
+        if name_field in gdf.columns
+        else [f"extent_{i}" for i in range(len(gdf))]
+    )
+    return [
+        (name, [float(v) for v in geom.bounds])
+        for name, geom in zip(names, gdf.geometry)
+    ]
+
+
+def read_manifest(manifest, config=None, output_dir=".", name_field="name"):
+    """Projects of a manifest (see the module documentation)."""
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    ext = os.path.splitext(manifest)[1].lower()
+    if ext in (".txt", ".json"):
+        with open(manifest) as f:
+            if ext == ".json":
+                paths = json.load(f)
+            else:
+                paths = [line.strip() for line in f]
+                paths = [p for p in paths if p and not p.startswith("#")]
+        projects = []
+        for path in paths:
+            cfg = load_config_json(_resolve(path, base_dir))
+            projects.append(Project(cfg.get("name", path), cfg))
+    else:
+        if config is None:
+            raise ValueError("A manifest of extents requires a configuration")
+        base = load_config_json(config)
+        projects = []
+        for name, bbox in read_extents(manifest, name_field):
+            cfg = Config(copy.deepcopy(config_to_dict(base)))
+            cfg.name = name
+            cfg.bbox = bbox
+            cfg.project_dir = os.path.join(output_dir, get_valid_filename(name))
+            projects.append(Project(name, cfg))
+
+    names = [p.name for p in projects]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate project names in {manifest}: {duplicates}")
+    return projects
+
+
+def load_shared_layers(processors):
+    """Read each layer once for all the processors, give them their features.
+
+    Returns the loading time of the layers. A layer which cannot be read is
+    left to the processors: they report the error.
+    """
+    groups = {}
+    for processor in processors:
+        for group in ("Bedrock", "Lines"):
+            lyr_cfg = processor.layer_config(group)
+            key = json.dumps(lyr_cfg, sort_keys=True)
+            groups.setdefault(key, (lyr_cfg, []))[1].append((processor, group))
+
+    loaded = []
+    for lyr_cfg, users in groups.values():
+        start = time.perf_counter()
+        extents = shapely.union_all(
+            [shapely.box(*processor.cfg.bbox) for processor, _ in users]
+        )
+        try:
+            gdf = read_layer(
+                lyr_cfg["source"],
+                lyr_cfg["layer"],
+                columns=[lyr_cfg["attribute"]],
+                where=lyr_cfg["where"],
+                use_arrow=users[0][0].use_arrow,
+                mask=extents,
+            )
+        except Exception as e:
+            logger.error(f"Error while loading '{lyr_cfg['layer']}': {e}")
+            continue
+        for processor, group in users:
+            processor.layers[group] = select_bbox(gdf, processor.cfg.bbox)
+        wall = time.perf_counter() - start
+        logger.info(
+            f"Loaded {len(gdf)} features of '{lyr_cfg['layer']}' for "
+            f"{len(users)} projects in {wall:.2f}s"
+        )
+        loaded.append(
+            {
+                "source": lyr_cfg["source"],
+                "layer": lyr_cfg["layer"],
+                "projects": len(users),
+                "features": len(gdf),
+                "wall": round(wall, 2),
+            }
+        )
+    return loaded
+
+
+def run_project(project, processor):
+    """Analyse a project, return its row of the summary."""
+    row = {
+        "name": project.name,
+        "project_dir": project.cfg.get("project_dir"),
+        "bbox": list(project.cfg.get("bbox", [])),
+        "status": "ok",
+        "error": None,
+    }
+    logger.info(f"== [{project.name}] Starting ===")
+    start = time.perf_counter()
+    try:
+        if processor is None:
+            # Failed when created: raises the error again
+            processor = TIEDataProcessor(project.cfg)
+        processor.process_geodata()
+    except Exception as e:
+        logger.exception(f"[{project.name}] failed")
+        # Traceback of the worker (processes) in the log only
+        message = (str(e).strip().splitlines() or [""])[0]
+        row.update(status="failed", error=f"{type(e).__name__}: {message}")
+    finally:
+        if processor is not None:
+            # Features of the project freed once done
+            processor.layers = {}
+    row["wall"] = round(time.perf_counter() - start, 2)
+    logger.info(f"== [{project.name}] {row['status']} in {row['wall']}s ===")
+    return row
+
+
+def write_summary(output_dir, rows, **info):
+    """Write ``batch_summary.csv`` and ``batch_summary.json``."""
+    with open(os.path.join(output_dir, "batch_summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, "bbox": " ".join(str(v) for v in row["bbox"])})
+    with open(os.path.join(output_dir, "batch_summary.json"), "w") as f:
+        json.dump({**info, "projects": rows}, f, indent=2)
+
+
+def run_batch(projects, output_dir=".", jobs=1):
+    """Analyse `projects`, write the summary to `output_dir`, return its rows."""
+    started = datetime.now().isoformat(timespec="seconds")
+    start = time.perf_counter()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    # One pool of worker processes for all the projects
+    pool = None
+    sched_cfg = scheduler_config(projects[0].cfg) if projects else {}
+    if sched_cfg.get("type") == "processes":
+        pool = ProcessPoolExecutor(
+            max_workers=sched_cfg["num_workers"] or os.cpu_count()
+        )
+
+    processors = {}
+    for project in projects:
+        project.cfg.DEM.setdefault("keep_open", True)
+        try:
+            processors[project.name] = TIEDataProcessor(project.cfg, pool=pool)
+        except Exception as e:
+            logger.error(f"[{project.name}] invalid configuration: {e}")
+    layers = load_shared_layers(list(processors.values()))
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            rows = list(
+                executor.map(
+                    lambda p: run_project(p, processors.get(p.name)), projects
+                )
+            )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    failed = [row["name"] for row in rows if row["status"] != "ok"]
+    write_summary(
+        output_dir,
+        rows,
+        started=started,
+        wall=round(time.perf_counter() - start, 2),
+        jobs=jobs,
+        scheduler=sched_cfg.get("type"),
+        layers=layers,
+        failed=failed,
+    )
+    logger.info(
+        f"{len(rows) - len(failed)} of {len(rows)} projects done"
+        + (f", failed: {', '.join(failed)}" if failed else "")
+    )
+    return rows
+
+
+@click.command()
+@click.option(
+    "-m", "--manifest", required=True, help="Extents (CSV, GeoPackage...) or configs"
+)
+@click.option(
+    "-c",
+    "--config",
+    help="Configuration shared by the extents of the manifest",
+    metavar="FILE",
+    default=None,
+)
+@click.option(
+    "-o",
+    "--output-dir",
+    default=".",
+    show_default=True,
+    help="Directory of the projects (manifest of extents) and of the summary",
+)
+@click.option(
+    "-n",
+    "--name-field",
+    default="name",
+    show_default=True,
+    help="Column of the extents holding the project names",
+)
+@click.option(
+    "-j", "--jobs", default=1, show_default=True, help="Projects computed at once"
+)
+@click.option(
+    "-l",
+    "--log-level",
+    default="INFO",
+    type=click.Choice(
+        ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], case_sensitive=True
+    ),
+    show_default=True,
+    help="Log level",
+)
+def main(manifest, config, output_dir, name_field, jobs, log_level):
+    # Handler of the analysis (see `tie_analysis_dask`)
+    logging.getLogger().setLevel(log_level)
+    projects = read_manifest(manifest, config, output_dir, name_field)
+    logger.info(f"{len(projects)} projects in {manifest}")
+    rows = run_batch(projects, output_dir, jobs)
+    if any(row["status"] != "ok" for row in rows):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
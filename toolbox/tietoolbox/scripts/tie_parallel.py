@@ -0,0 +1,110 @@
+"""
+TIE analysis of a trace list in parallel chunks.
+
+`tie_grid` runs the steps of `TIE_core.tie` on a `DEMGrid`: the coordinates
+of the traces are looked up at their indices, without the DEM sized meshgrids
+and flipped copies of `tie`. It analyses the traces one after the other, but
+they are independent once extracted. `tie_chunked` splits the list in chunks
+which are analysed by a pool of processes, started by the calling task: the
+pipeline only chunks with the 'threads' and 'synchronous' schedulers, whose
+tasks do not run in worker processes. The DEM is written once to a
+memory-mapped ``.npy`` file that the workers open read-only, instead of being
+pickled for every chunk (Windows has no fork: each worker would receive its
+own copy). The traces are returned in their original order.
+"""
+
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from untie import TIE_core as TIEcr
+
+from tietoolbox.scripts.dem_grid import DEMGrid
+
+logger = logging.getLogger(__name__)
+
+# Thresholds of `TIE_core.tie`
+PTH = [3, 9, 18]
+PEAKTHRESH = [100, 15]
+
+# DEM of the worker process, set by `_init_worker`
+_DEM = {}
+
+
+def tie_grid(traces, grid, seg=False, pth=PTH, peakthresh=PEAKTHRESH):
+    """`TIE_core.tie` of `traces` on the DEMGrid `grid`, same results.
+
+    See `TIE_core.tie` for the parameters.
+    """
+    mX, mY, mZ = grid.flat()
+    if seg:
+        traces = TIEcr.segmentTRACE(traces, mX, mY, mZ, peakthresh)
+    traces = TIEcr.extractChords(traces, mX, mY, mZ)
+    traces = TIEcr.extractAlpha(traces)
+    traces = TIEcr.extractChdPlanes(traces, mX, mY, mZ)
+    traces = TIEcr.extractBeta(traces)
+    traces = TIEcr.classifyTRACE(traces, pth)
+    traces = TIEcr.extractOrientBars(traces)
+    return traces
+
+
+def _init_worker(z_path, x, y):
+    _DEM["grid"] = DEMGrid(np.load(z_path, mmap_mode="r"), x, y)
+
+
+def _tie_chunk(traces, seg):
+    return tie_grid(traces, _DEM["grid"], seg=seg)
+
+
+def tie_chunked(traces, DEM, seg=True, chunk_size=0, num_workers=None, tmp_dir=None):
+    """`tie_grid` on chunks of `chunk_size` traces, in `num_workers` processes.
+
+    Parameters
+    ----------
+    traces : list
+        Traces (trace_OBJ) to analyse. They are completed in place when
+        analysed in a single chunk.
+    DEM : dict
+        Dictionary containing DEM and coordinate data (see cropDEMextent).
+    seg : bool
+        Segmentation of the traces before the analysis (see TIE_core.tie).
+    chunk_size : int
+        Number of traces per chunk. 0: a single call to `tie_grid`.
+    num_workers : int
+        Number of processes. None: number of CPUs.
+    tmp_dir : str
+        Directory of the memory-mapped DEM.
+
+    Returns
+    -------
+    list
+        Analysed traces, in the order of `traces`.
+    """
+    if not chunk_size or len(traces) <= chunk_size:
+        return tie_grid(traces, DEMGrid.from_dem(DEM), seg=seg)
+
+    chunks = [traces[i : i + chunk_size] for i in range(0, len(traces), chunk_size)]
+    num_workers = min(num_workers or os.cpu_count() or 1, len(chunks))
+    logger.info(
+        f"TIE analysis of {len(traces)} traces: {len(chunks)} chunks, "
+        f"{num_workers} processes"
+    )
+
+    fd, z_path = tempfile.mkstemp(suffix=".npy", prefix="tie_dem_", dir=tmp_dir)
+    os.close(fd)
+    try:
+        np.save(z_path, DEM["z"])
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_init_worker,
+            initargs=(z_path, DEM["x"], DEM["y"]),
+        ) as pool:
+            # map() keeps the order of the chunks
+            results = list(pool.map(_tie_chunk, chunks, [seg] * len(chunks)))
+    finally:
+        os.remove(z_path)
+
+    return [tr for chunk in results for tr in chunk]
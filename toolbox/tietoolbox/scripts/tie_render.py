@@ -0,0 +1,434 @@
+"""
+Headless rendering of the figures of `tie_viewer` to files::
+
+    python tie_render.py -d D:/Widdergalm/cache -o D:/Widdergalm/figures
+    python tie_render.py -d A/cache -d B/cache -o figures -t 1-20,42 -j 4
+
+For each analysis output directory (`--data-dir`, see `tie_viewer`), the
+figures are written to ``<output-dir>/<name>/``, `name` being the path of the
+directory relative to the common path of the directories:
+
+- per project: the overview map (``overview.png``, decimated as in
+  `tie_viewer`, see `lod`) and the signal height diagram
+  (``signal_height.png``);
+- per trace (of `--kind`, all of them or the ids of `--traces`): its signals
+  (``traces_<id>_signal.png``) and their stereographic projection
+  (``traces_<id>_stereo.png``).
+
+The figures are drawn with the Agg backend by a pool of `--jobs` processes.
+The traces and the DEM are memory-mapped (see `trace_store`): the workers
+share them through the page cache, a task only names its figure. The key of a
+figure (hash of the trace, or signature of the input files for the project
+figures, and of the options) is kept in ``render_manifest.json``: a figure
+whose file exists and whose key did not change is not drawn again.
+"""
+
+import json
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import PurePath
+
+import click
+
+from tietoolbox.scripts.categories import LEGEND_FILE, CategoricalRaster
+from tietoolbox.scripts.dem_grid import DEMGrid
+from tietoolbox.scripts.lazy import lazy_import
+from tietoolbox.scripts.lod import DEFAULT_MAX_VERTICES, LevelOfDetail
+from tietoolbox.scripts.stage_cache import fingerprint, source_signature
+from tietoolbox.scripts.trace_store import TraceStore, open_dem, open_traces
+from tietoolbox.scripts.traces_export_utils import bed2cmap
+from tietoolbox.scripts.utils import get_valid_filename
+
+# Imported by the processes drawing, once the backend is set
+plt = lazy_import("matplotlib.pyplot")
+TIEvis = lazy_import("untie.TIE_visual")
+
+logger = logging.getLogger(__name__)
+
+# Bump when the figures change for the same inputs
+RENDER_VERSION = 1
+
+MANIFEST = "render_manifest.json"
+
+KINDS = ("traces", "faults")
+PROJECT_PLOTS = ("2DOverview", "SignalHeightDiagram")
+TRACE_PLOTS = ("IndividualSignals", "SignalStereo")
+FILE_NAMES = {
+    "2DOverview": "overview",
+    "SignalHeightDiagram": "signal_height",
+    "IndividualSignals": "{kind}_{id}_signal",
+    "SignalStereo": "{kind}_{id}_stereo",
+}
+
+# Files of an output directory read by the project figures
+PROJECT_INPUTS = {
+    "2DOverview": (
+        "DEM",
+        "DEM.pkl",
+        "BEDrst.npy",
+        "BEDrst.json",
+        "traces",
+        "traces.pkl",
+        "faults",
+        "faults.pkl",
+    ),
+    "SignalHeightDiagram": ("traces", "traces.pkl"),
+}
+
+# Thresholds of the signal height diagram (as in `tie_viewer`)
+SIGNAL_HEIGHTS = [3, 9, 18, 90]
+
+Figure = namedtuple("Figure", ["name", "data_dir", "plot", "kind", "position", "path"])
+
+# Traces of the output directories opened by the process, see `_traces`
+_PROJECTS = {}
+
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def parse_ids(spec):
+    """Trace ids of `spec`, e.g. '1-20,42' (None: all the traces)."""
+    if not spec:
+        return None
+    ids = set()
+    for part in str(spec).split(","):
+        first, _, last = part.strip().partition("-")
+        try:
+            ids.update(range(int(first), int(last or first) + 1))
+        except ValueError:
+            raise ValueError(f"Invalid trace ids '{part}', expected e.g. '1-20,42'")
+    return ids
+
+
+def project_names(data_dirs):
+    """Names of the output directories: their paths relative to their common path."""
+    paths = [os.path.normpath(os.path.abspath(d)) for d in data_dirs]
+    if len(paths) == 1:
+        return [get_valid_filename(os.path.basename(paths[0]))]
+    common = os.path.commonpath(paths)
+    return [
+        get_valid_filename(os.path.relpath(p, common).replace(os.sep, "_"))
+        for p in paths
+    ]
+
+
+def _traces(data_dir, kind):
+    """Traces `kind` of `data_dir` ([] if there are none), opened once."""
+    if (data_dir, kind) not in _PROJECTS:
+        try:
+            _PROJECTS[data_dir, kind] = open_traces(data_dir, kind)
+        except FileNotFoundError:
+            _PROJECTS[data_dir, kind] = []
+    return _PROJECTS[data_dir, kind]
+
+
+def _trace_ids(traces):
+    if isinstance(traces, TraceStore):
+        return [int(i) for i in traces.column("trace_id")]
+    return [int(tr.id) for tr in traces]
+
+
+def list_figures(data_dirs, output_dir, plots, kinds=("traces",), ids=None, fmt="png"):
+    """Figures of `plots` of the output directories `data_dirs`."""
+    figures = []
+    for name, data_dir in zip(project_names(data_dirs), data_dirs):
+        directory = os.path.join(output_dir, name)
+        for plot in PROJECT_PLOTS:
+            if plot in plots and (plot == "2DOverview" or _traces(data_dir, "traces")):
+                path = os.path.join(directory, f"{FILE_NAMES[plot]}.{fmt}")
+                figures.append(Figure(name, data_dir, plot, None, None, path))
+        for kind in kinds:
+            for position, trace_id in enumerate(_trace_ids(_traces(data_dir, kind))):
+                if ids is not None and trace_id not in ids:
+                    continue
+                for plot in TRACE_PLOTS:
+                    if plot in plots:
+                        fname = FILE_NAMES[plot].format(kind=kind, id=trace_id)
+                        path = os.path.join(directory, f"{fname}.{fmt}")
+                        figures.append(Figure(name, data_dir, plot, kind, position, path))
+    return figures
+
+
+def overview_map(data_dir, title, max_vertices=DEFAULT_MAX_VERTICES):
+    """Overview map (2D) of an output directory, as in `tie_viewer`."""
+    DEM = open_dem(data_dir)
+    BEDrst = CategoricalRaster.load(PurePath(data_dir, "BEDrst"), mmap_mode="r")
+    lod = LevelOfDetail(DEMGrid.from_dem(DEM), max_vertices)
+    mc, cmap = bed2cmap(lod.raster(BEDrst), LEGEND_FILE)
+    mx, my = lod.grid.mesh("south-up")
+    fig, ax = TIEvis.showOverviewMap(
+        mx,
+        my,
+        mc,
+        mz=lod.grid.view("south-up"),
+        cmap=cmap,
+        BTraces=lod.traces(_traces(data_dir, "traces")),
+        FTraces=lod.traces(_traces(data_dir, "faults")),
+        leg_labels=[],
+        WithSeg=True,
+    )
+    ax.set_title(title)
+    return fig
+
+
+def figure_key(figure, options):
+    """Hash of the inputs of `figure` and of the rendering `options`."""
+    if figure.plot in TRACE_PLOTS:
+        inputs = _traces(figure.data_dir, figure.kind)[figure.position]
+    else:
+        paths = [os.path.join(figure.data_dir, p) for p in PROJECT_INPUTS[figure.plot]]
+        if figure.plot == "2DOverview":
+            paths.append(LEGEND_FILE)
+        inputs = [source_signature(p) for p in paths if os.path.exists(p)]
+    return fingerprint(RENDER_VERSION, figure.plot, figure.name, options, inputs)
+
+
+def draw(figure, options):
+    """matplotlib figure of `figure`."""
+    if figure.plot == "2DOverview":
+        return overview_map(figure.data_dir, figure.name, options["max_vertices"])
+    if figure.plot == "SignalHeightDiagram":
+        traces = list(_traces(figure.data_dir, "traces"))
+        return TIEvis.sigHdiagram(traces, SIGNAL_HEIGHTS, scale="log")
+    trace = _traces(figure.data_dir, figure.kind)[figure.position]
+    if figure.plot == "IndividualSignals":
+        return TIEvis.showSignal(trace)
+    return TIEvis.showSigStereo(trace)
+
+
+def render_figure(figure, previous, options):
+    """Write `figure`, unless its file exists and its key is `previous`.
+
+    Returns
+    -------
+    str
+        Key of the figure (see `figure_key`).
+    str
+        'rendered' or 'skipped'.
+    """
+    key = figure_key(figure, options)
+    if key == previous and os.path.exists(figure.path):
+        return key, "skipped"
+
+    fig = draw(figure, options)
+    os.makedirs(os.path.dirname(figure.path), exist_ok=True)
+    tmp_path = f"{figure.path}.tmp"
+    try:
+        fig.savefig(tmp_path, dpi=options["dpi"], format=options["format"])
+        os.replace(tmp_path, figure.path)
+    finally:
+        plt.close(fig)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return key, "rendered"
+
+
+def read_manifest(output_dir):
+    """Keys of the figures written to `output_dir`, by relative path."""
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != RENDER_VERSION:
+        return {}
+    return manifest["figures"]
+
+
+def write_manifest(output_dir, keys):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"version": RENDER_VERSION, "figures": keys}, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def render_batch(
+    data_dirs,
+    output_dir,
+    plots=PROJECT_PLOTS + TRACE_PLOTS,
+    kinds=("traces",),
+    ids=None,
+    jobs=1,
+    dpi=100,
+    fmt="png",
+    max_vertices=DEFAULT_MAX_VERTICES,
+    force=False,
+):
+    """Render the figures of the output directories `data_dirs` to `output_dir`.
+
+    See the module documentation. `force`: draw the figures whose inputs did
+    not change too.
+
+    Returns
+    -------
+    list
+        A dict per figure: 'path', 'status' ('rendered', 'skipped' or
+        'failed') and 'error'.
+    """
+    _init_worker()
+    # Traces as they are now (the workers inherit them, or open them again)
+    _PROJECTS.clear()
+    os.makedirs(output_dir, exist_ok=True)
+    figures = list_figures(data_dirs, output_dir, plots, kinds, ids, fmt)
+    options = {"dpi": dpi, "format": fmt, "max_vertices": max_vertices}
+    keys = read_manifest(output_dir)
+    logger.info(f"{len(figures)} figures of {len(data_dirs)} output directories")
+
+    def relpath(figure):
+        return PurePath(os.path.relpath(figure.path, output_dir)).as_posix()
+
+    rows = []
+
+    def done(figure, result=None, error=None):
+        if error is None:
+            keys[relpath(figure)], status = result
+        else:
+            keys.pop(relpath(figure), None)
+            status = "failed"
+            logger.error(f"{relpath(figure)}: {error}")
+        rows.append({"path": figure.path, "status": status, "error": error})
+        logger.debug(f"{relpath(figure)}: {status}")
+
+    try:
+        if jobs > 1 and len(figures) > 1:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as pool:
+                futures = {
+                    pool.submit(
+                        render_figure,
+                        figure,
+                        None if force else keys.get(relpath(figure)),
+                        options,
+                    ): figure
+                    for figure in figures
+                }
+                for future in as_completed(futures):
+                    try:
+                        done(futures[future], future.result())
+                    except Exception as e:
+                        done(futures[future], error=repr(e))
+        else:
+            for figure in figures:
+                previous = None if force else keys.get(relpath(figure))
+                try:
+                    done(figure, render_figure(figure, previous, options))
+                except Exception as e:
+                    done(figure, error=repr(e))
+    finally:
+        write_manifest(output_dir, keys)
+
+    counts = {
+        status: sum(row["status"] == status for row in rows)
+        for status in ("rendered", "skipped", "failed")
+    }
+    logger.info(", ".join(f"{n} {status}" for status, n in counts.items()))
+    return rows
+
+
+@click.command()
+@click.option(
+    "-d",
+    "--data-dir",
+    "data_dirs",
+    required=True,
+    multiple=True,
+    help="Directory where the results of the analysis (cache) are, repeatable",
+)
+@click.option(
+    "-o",
+    "--output-dir",
+    default="figures",
+    show_default=True,
+    help="Directory of the figures",
+)
+@click.option(
+    "-p",
+    "--plots",
+    type=click.Choice(PROJECT_PLOTS + TRACE_PLOTS),
+    default=PROJECT_PLOTS + TRACE_PLOTS,
+    multiple=True,
+    show_default=True,
+)
+@click.option(
+    "-k",
+    "--kind",
+    "kinds",
+    type=click.Choice(KINDS),
+    default=["traces"],
+    multiple=True,
+    show_default=True,
+    help="Traces whose signals are drawn",
+)
+@click.option(
+    "-t", "--traces", default=None, help="Ids of the traces drawn, e.g. '1-20,42'"
+)
+@click.option(
+    "-j", "--jobs", default=1, show_default=True, help="Processes drawing the figures"
+)
+@click.option("--dpi", default=100, show_default=True, help="Resolution of the figures")
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(["png", "pdf", "svg"]),
+    default="png",
+    show_default=True,
+)
+@click.option(
+    "--max-vertices",
+    type=int,
+    default=DEFAULT_MAX_VERTICES,
+    show_default=True,
+    help="Vertices of the overview maps (0: full resolution)",
+)
+@click.option(
+    "--force", is_flag=True, default=False, help="Draw the unchanged figures too"
+)
+@click.option(
+    "-l",
+    "--log-level",
+    default="INFO",
+    type=click.Choice(
+        ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], case_sensitive=True
+    ),
+    show_default=True,
+    help="Log level",
+)
+def main(
+    data_dirs,
+    output_dir,
+    plots,
+    kinds,
+    traces,
+    jobs,
+    dpi,
+    fmt,
+    max_vertices,
+    force,
+    log_level,
+):
+    logging.basicConfig(
+        level=log_level, format="%(asctime)s :: %(levelname)s ::  %(message)s"
+    )
+    rows = render_batch(
+        data_dirs,
+        output_dir,
+        plots,
+        kinds,
+        parse_ids(traces),
+        jobs,
+        dpi,
+        fmt,
+        max_vertices,
+        force,
+    )
+    if any(row["status"] == "failed" for row in rows):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Long-lived analysis server, keeping the imports and the dask worker processes
+warm between the runs of the toolbox::
+
+    python tie_server.py --port 8765
+
+The toolbox submits the analyses with `Runner.run_job` (protocol in
+`tietoolbox.jobs`). They run one at a time, in the order of submission. A
+queued job is cancelled at once, a running one before its next dask task.
+
+Listens on 127.0.0.1 only. The requests must hold the token written to the
+profile directory of the user at the start (see `tietoolbox.jobs`): the
+other users of the host can neither submit jobs nor stop the server.
+"""
+
+import hmac
+import importlib
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+
+from tietoolbox.jobs import (
+    DEFAULT_HOST,
+    DEFAULT_PORT,
+    FINAL_STATES,
+    PROTOCOL_VERSION,
+    JobCancelled,
+    decode_message,
+    encode_message,
+    new_token,
+    token_path,
+    write_token,
+)
+from tietoolbox.progress import make_event
+
+logger = logging.getLogger(__name__)
+
+# Jobs kept for 'status' and 'result' once finished
+MAX_FINISHED_JOBS = 100
+
+# Imported on first use by the analysis (see `lazy`): imported at the start
+# of the server instead of in its first job
+WARM_MODULES = (
+    "geopandas",
+    "rasterio",
+    "pyogrio",
+    "untie.TIE_core",
+    "untie.TIE_general",
+    "untie.TIE_load",
+    "tietoolbox.scripts.tie_analysis_dask",
+)
+
+
+class JobProgress:
+    """Last progress event of a job (same `emit` as `ProgressWriter`)."""
+
+    def __init__(self):
+        self.last = None
+
+    def emit(self, event, **fields):
+        self.last = make_event(event, **fields)
+
+
+class Job:
+    def __init__(self, config, log_level="INFO"):
+        self.id = uuid.uuid4().hex
+        self.config = config
+        self.log_level = log_level
+        self.state = "queued"
+        self.error = None
+        self.result = None
+        self.progress = JobProgress()
+        self.cancel_event = threading.Event()
+        self.submitted = time.time()
+        self.started = None
+        self.ended = None
+
+    def info(self):
+        return {
+            "job": self.id,
+            "config": self.config,
+            "state": self.state,
+            "error": self.error,
+            "progress": self.progress.last,
+            "submitted": self.submitted,
+            "started": self.started,
+            "ended": self.ended,
+        }
+
+
+class AnalysisRunner:
+    """Run the analyses in the server process.
+
+    The pool of the 'processes' scheduler is kept between the jobs: its
+    workers have already imported the analysis modules.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._pool_size = None
+
+    def warm_up(self):
+        start = time.perf_counter()
+        for name in WARM_MODULES:
+            importlib.import_module(name)
+        logger.info(f"Analysis modules imported in {time.perf_counter() - start:.1f}s")
+
+    def pool(self, cfg):
+        from tietoolbox.scripts.scheduler import scheduler_config
+
+        sched_cfg = scheduler_config(cfg)
+        if sched_cfg["type"] != "processes":
+            return None
+        size = sched_cfg["num_workers"] or os.cpu_count() or 1
+        broken = self._pool is not None and getattr(self._pool, "_broken", False)
+        if self._pool is None or self._pool_size != size or broken:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            logger.info(f"Starting a pool of {size} worker processes")
+            self._pool = ProcessPoolExecutor(max_workers=size)
+            self._pool_size = size
+        return self._pool
+
+    def __call__(self, job):
+        from tietoolbox.scripts.config import load_config_json
+        from tietoolbox.scripts.tie_analysis_dask import TIEDataProcessor
+
+        logging.getLogger().setLevel(job.log_level.upper())
+        cfg = load_config_json(job.config)
+        processor = TIEDataProcessor(
+            cfg, progress=job.progress, cancel=job.cancel_event, pool=self.pool(cfg)
+        )
+        processor.process_geodata()
+        return {"cache_dir": os.path.abspath(processor.cache_dir)}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            answer = self.server.dispatch(decode_message(line))
+        except Exception as e:
+            answer = {"ok": False, "error": str(e)}
+        self.wfile.write(encode_message(answer))
+
+
+class AnalysisServer(socketserver.ThreadingTCPServer):
+    """Job queue served on `address`.
+
+    Parameters
+    ----------
+    address : tuple
+        (host, port). Port 0: any free port (see `server_address`).
+    run_job : callable
+        Runs a `Job` and returns its result (a JSON serializable dict). Raises
+        `JobCancelled` once `job.cancel_event` is set. Default: an
+        `AnalysisRunner`.
+    token : str
+        Token of the requests. Default: a new one (see `write_token`).
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, run_job=None, token=None):
+        super().__init__(address, RequestHandler)
+        self.run_job = run_job if run_job is not None else AnalysisRunner()
+        self.token = token or new_token()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with self.lock:
+                if job.state != "queued":
+                    continue
+                job.state = "running"
+                job.started = time.time()
+            logger.info(f"Job {job.id}: {job.config}")
+            try:
+                result = self.run_job(job)
+                state, error = "done", None
+            except JobCancelled:
+                result, state, error = None, "cancelled", None
+            except Exception as e:
+                logger.exception(f"Job {job.id} failed")
+                result, state, error = None, "failed", str(e)
+            with self.lock:
+                job.result, job.state, job.error = result, state, error
+                job.ended = time.time()
+            logger.info(f"Job {job.id}: {state} in {job.ended - job.started:.1f}s")
+
+    def _job(self, message):
+        try:
+            return self.jobs[message["job"]]
+        except KeyError:
+            raise KeyError(f"Unknown job {message.get('job')}") from None
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if j.state in FINAL_STATES]
+        finished.sort(key=lambda j: j.ended)
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[job.id]
+
+    def dispatch(self, message):
+        token = message.get("token")
+        if not isinstance(token, str) or not hmac.compare_digest(token, self.token):
+            raise PermissionError("Invalid token")
+
+        action = message.get("action")
+        if action == "ping":
+            return {"ok": True, "version": PROTOCOL_VERSION, "pid": os.getpid()}
+
+        if action == "submit":
+            job = Job(message["config"], message.get("log_level", "INFO"))
+            with self.lock:
+                self._prune()
+                self.jobs[job.id] = job
+            self.queue.put(job)
+            return {"ok": True, "job": job.id}
+
+        if action == "status":
+            with self.lock:
+                return {"ok": True, **self._job(message).info()}
+
+        if action == "cancel":
+            with self.lock:
+                job = self._job(message)
+                if job.state == "queued":
+                    job.state = "cancelled"
+                    job.ended = time.time()
+                elif job.state == "running":
+                    job.cancel_event.set()
+                return {"ok": True, **job.info()}
+
+        if action == "result":
+            with self.lock:
+                job = self._job(message)
+                return {"ok": True, "result": job.result, **job.info()}
+
+        if action == "shutdown":
+            # Not from this (handler) thread: shutdown() waits for the loop
+            threading.Thread(target=self.stop, daemon=True).start()
+            return {"ok": True}
+
+        raise ValueError(f"Unknown action '{action}'")
+
+    def stop(self):
+        """Stop serving, after the running job."""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.state == "queued":
+                    job.state = "cancelled"
+        self.queue.put(None)
+        self.shutdown()
+        self.worker.join()
+        if hasattr(self.run_job, "close"):
+            self.run_job.close()
+
+
+@click.command()
+@click.option("--host", default=DEFAULT_HOST, show_default=True)
+@click.option("-p", "--port", default=DEFAULT_PORT, show_default=True)
+@click.option(
+    "-l",
+    "--log-level",
+    default="INFO",
+    type=click.Choice(
+        ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], case_sensitive=True
+    ),
+    show_default=True,
+    help="Log level",
+)
+def main(host, port, log_level):
+    logging.basicConfig(
+        level=log_level, format="%(asctime)s :: %(levelname)s ::  %(message)s"
+    )
+    runner = AnalysisRunner()
+    runner.warm_up()
+    server = AnalysisServer((host, port), runner)
+    port = server.server_address[1]
+    write_token(server.token, port)
+    logger.info(f"TIE analysis server listening on {host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        runner.close()
+        if os.path.exists(token_path(port)):
+            os.remove(token_path(port))
+
+
+if __name__ == "__main__":
+    main()
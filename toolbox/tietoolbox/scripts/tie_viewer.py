@@ -20,16 +20,21 @@ if ".exe" in sys.executable and any("ESRI" in pth for pth in sys.path):
 
     sys.path = paths
 
-import matplotlib.pyplot as plt
-
-import numpy as np
 
+from tietoolbox.scripts.lazy import lazy_import
 from tietoolbox.scripts.utils import universalpath
 
-from untie import TIE_visual as TIEvis
+# Imported on first use: seconds (mayavi), even for --help
+plt = lazy_import("matplotlib.pyplot")
+TIEvis = lazy_import("untie.TIE_visual")
+
+from tietoolbox.scripts.categories import CategoricalRaster
+from tietoolbox.scripts.dem_grid import DEMGrid
+from tietoolbox.scripts.lod import DEFAULT_MAX_VERTICES, LevelOfDetail, roi_window
 from tietoolbox.scripts.traces_export_utils import bed2cmap, export_traces
 from tietoolbox.scripts.utils import universalpath
 from tietoolbox.scripts.config import load_config_json
+from tietoolbox.scripts.trace_store import open_dem, open_traces
 
 import logging
 
@@ -64,7 +69,7 @@ legendfile = universalpath(os.path.join(cur_dir, "symbols.tsv"))
 @click.option(
     "-d",
     "--data-dir",
-    help="Directory where the .np and .pkl files are",
+    help="Directory where the results of the analysis (cache) are",
     default=DATA_DIR,
     show_default=True,
 )
@@ -87,7 +92,22 @@ legendfile = universalpath(os.path.join(cur_dir, "symbols.tsv"))
 @click.option(
     "--save-figure", is_flag=True, show_default=True, default=False, help="Save figures"
 )
-def main(config, log_level, data_dir, save_figure, plots):
+@click.option(
+    "--max-vertices",
+    type=int,
+    default=DEFAULT_MAX_VERTICES,
+    show_default=True,
+    help="Vertices of the maps, the DEM is decimated to fit (0: full resolution)",
+)
+@click.option(
+    "--roi",
+    type=float,
+    nargs=4,
+    metavar="MINX MINY MAXX MAXY",
+    default=None,
+    help="Region of interest: the maps show this extent only",
+)
+def main(config, log_level, data_dir, save_figure, plots, max_vertices, roi):
     # Loading data
 
     logger = logging.getLogger(__name__)
@@ -102,20 +122,21 @@ def main(config, log_level, data_dir, save_figure, plots):
     logger.handlers[0].flush()
     sys.stdout.flush()
 
-    with open(universalpath(os.path.join(data_dir, f"DEM.pkl")), "rb") as f:
-        DEM = pickle.load(f)
-
-    with open(universalpath(os.path.join(data_dir, f"faults.pkl")), "rb") as f:
-        FTraces = pickle.load(f)
+    # Traces are read lazily, only the ones which are drawn are loaded
+    FTraces = open_traces(data_dir, "faults")
 
     try:
-        with open(universalpath(os.path.join(data_dir, f"traces.pkl")), "rb") as f:
-            BTraces = pickle.load(f)
+        BTraces = open_traces(data_dir, "traces")
     except FileNotFoundError:
         BTraces = []
 
-    with open(PurePath(data_dir, f"BEDrst.npy"), "rb") as f:
-        BEDrst = np.load(f)
+    # The DEM and the bedrock raster are only needed by the maps
+    maps = {"Overview3D", "3DTIE", "2DOverview"}
+    if not maps.intersection(plots):
+        DEM = BEDrst = None
+    else:
+        DEM = open_dem(data_dir)
+        BEDrst = CategoricalRaster.load(PurePath(data_dir, "BEDrst"), mmap_mode="r")
 
     # TODO:
     cmap_fname = universalpath(os.path.join(data_dir, "cmap.pkl"))
@@ -131,13 +152,24 @@ def main(config, log_level, data_dir, save_figure, plots):
 
     ## Visualisation
 
-    mc, cmap = bed2cmap(BEDrst, legendfile)
+    if DEM is not None:
+        # Level of detail of the maps: decimated DEM, bedrock raster and traces
+        grid = DEMGrid.from_dem(DEM)
+        lod = LevelOfDetail(grid, max_vertices, roi_window(grid, roi) if roi else None)
+        logger.info(
+            "Maps: {} x {} vertices (1 every {} pixels)".format(
+                *lod.grid.shape, lod.step
+            )
+        )
+        BTraces_map = lod.traces(BTraces)
+        FTraces_map = lod.traces(FTraces)
+
+        mc, cmap = bed2cmap(lod.raster(BEDrst), legendfile)
 
-    # define display variables
-    mx, my = np.meshgrid(DEM["x"], DEM["y"])
-    mz = np.flipud(DEM["z"].copy())
-    mx = mx.astype(float)
-    my = my.astype(float)
+        # define display variables: views of the DEM (np.meshgrid(x, y) and
+        # np.flipud(z)), no DEM sized copy
+        mx, my = lod.grid.mesh("south-up")
+        mz = lod.grid.view("south-up")
 
     cmap_plt = "Greens"
 
@@ -153,8 +185,8 @@ def main(config, log_level, data_dir, save_figure, plots):
             mz,
             mc,
             cmap=cmap,
-            BTraces=BTraces,
-            FTraces=FTraces,
+            BTraces=BTraces_map,
+            FTraces=FTraces_map,
             WithlabelsF=False,
         )
 
@@ -180,8 +212,8 @@ def main(config, log_level, data_dir, save_figure, plots):
             mz,
             mc=mc,
             cmap=cmap,
-            MainTrace_Set=BTraces,
-            AuxTrace_Set=FTraces,
+            MainTrace_Set=BTraces_map,
+            AuxTrace_Set=FTraces_map,
             ShowBars=True,
         )
 
@@ -198,8 +230,8 @@ def main(config, log_level, data_dir, save_figure, plots):
             mc,
             mz=mz,
             cmap=cmap,
-            BTraces=BTraces,
-            FTraces=FTraces,
+            BTraces=BTraces_map,
+            FTraces=FTraces_map,
             leg_labels=formations,
             WithSeg=True,
         )
@@ -0,0 +1,229 @@
+"""
+Helpers to run the TIE pipeline tile by tile.
+
+The analysed bbox is split into a regular grid of tiles. Each tile is read with
+a halo around its core, so that a trace crossing the core border is seen by the
+tiles on both sides. Traces are kept by the tile whose core they touch and the
+pieces found by several tiles are stitched back together afterwards.
+
+All windows are expressed in pixels of the DEM as ``(row_off, col_off, height,
+width)``, north-up (rasterio order). Trace indices, like the rasters produced by
+`TIE_load.rasterizeSHP`, are linear indices in the flipped (``np.flip(z, (0,
+1))``) frame of the grid they belong to.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+from untie import TIE_classes as TIEclass
+from untie import TIE_general as TIEgen
+
+Tile = namedtuple("Tile", ["id", "window", "core"])
+
+
+def make_tiles(grid_window, tile_size, halo):
+    """Split `grid_window` in tiles of `tile_size` pixels with `halo` pixels.
+
+    The cores of the tiles partition `grid_window`, the windows (core + halo)
+    overlap and are clipped to `grid_window`. The tiles are aligned on the
+    whole DEM (multiples of `tile_size` from its origin), not on `grid_window`:
+    when the bbox moves, the tiles away from its border keep the same windows,
+    and so the same cached results. Border tiles thinner than half a tile are
+    merged with their neighbour.
+
+    Both sizes are at least one pixel: without halo, neighbouring tiles share
+    no pixel and `stitch_traces` cannot join the traces crossing their border.
+    """
+    g_row, g_col, g_height, g_width = grid_window
+    tile_size = int(tile_size)
+    halo = int(halo)
+    if tile_size < 1 or halo < 1:
+        raise ValueError(
+            f"Tiles of {tile_size} pixels with a halo of {halo} pixels: "
+            "both must be at least one pixel"
+        )
+
+    def blocks(start, length):
+        # (offset, size) of the cores, relative to `start`
+        first = start - start % tile_size
+        bounds = [start]
+        bounds += list(range(first + tile_size, start + length, tile_size))
+        bounds += [start + length]
+        # Slivers at the border are merged with their neighbour
+        if len(bounds) > 2 and bounds[1] - bounds[0] < tile_size // 2:
+            del bounds[1]
+        if len(bounds) > 2 and bounds[-1] - bounds[-2] < tile_size // 2:
+            del bounds[-2]
+        return [(b0 - start, b1 - b0) for b0, b1 in zip(bounds[:-1], bounds[1:])]
+
+    tiles = []
+    for r, core_h in blocks(g_row, g_height):
+        for c, core_w in blocks(g_col, g_width):
+            r0 = max(r - halo, 0)
+            c0 = max(c - halo, 0)
+            r1 = min(r + core_h + halo, g_height)
+            c1 = min(c + core_w + halo, g_width)
+            tiles.append(
+                Tile(
+                    len(tiles),
+                    (g_row + r0, g_col + c0, r1 - r0, c1 - c0),
+                    (g_row + r, g_col + c, core_h, core_w),
+                )
+            )
+    return tiles
+
+
+def flipped_offset(window, grid_window):
+    """Offset (rows, cols) of `window` inside `grid_window` in the flipped frame."""
+    row_off, col_off, height, width = window
+    g_row, g_col, g_height, g_width = grid_window
+    return (
+        g_row + g_height - (row_off + height),
+        g_col + g_width - (col_off + width),
+    )
+
+
+def window_to_grid(index, window, grid_window):
+    """Convert linear indices of `window` into linear indices of `grid_window`."""
+    index = np.asarray(index).astype(int)
+    d_row, d_col = flipped_offset(window, grid_window)
+    rows, cols = np.divmod(index, window[3])
+    return (rows + d_row) * grid_window[3] + (cols + d_col)
+
+
+def grid_to_window(index, window, grid_window):
+    """Convert linear indices of `grid_window` into linear indices of `window`."""
+    index = np.asarray(index).astype(int)
+    d_row, d_col = flipped_offset(window, grid_window)
+    rows, cols = np.divmod(index, grid_window[3])
+    return (rows - d_row) * window[3] + (cols - d_col)
+
+
+def in_window(index, window, grid_window):
+    """Mask of the linear indices of `grid_window` lying inside `window`."""
+    index = np.asarray(index).astype(int)
+    d_row, d_col = flipped_offset(window, grid_window)
+    rows, cols = np.divmod(index, grid_window[3])
+    return (
+        (rows >= d_row)
+        & (rows < d_row + window[2])
+        & (cols >= d_col)
+        & (cols < d_col + window[3])
+    )
+
+
+def trace_window(index, grid_window, pad=1):
+    """Smallest window of `grid_window` (plus `pad` pixels) holding `index`."""
+    g_row, g_col, g_height, g_width = grid_window
+    rows, cols = np.divmod(np.asarray(index).astype(int), g_width)
+
+    # flipped frame -> north-up frame
+    row0 = max(g_height - 1 - rows.max() - pad, 0)
+    row1 = min(g_height - rows.min() + pad, g_height)
+    col0 = max(g_width - 1 - cols.max() - pad, 0)
+    col1 = min(g_width - cols.min() + pad, g_width)
+
+    return (g_row + row0, g_col + col0, row1 - row0, col1 - col0)
+
+
+def core_block(tile, grid_window):
+    """Slices to copy the core of a tile raster into the grid raster.
+
+    Returns ``(grid_slices, tile_slices)``, both in the flipped frame.
+    """
+    g_rows, g_cols = flipped_offset(tile.core, grid_window)
+    t_rows, t_cols = flipped_offset(tile.core, tile.window)
+    height, width = tile.core[2], tile.core[3]
+    return (
+        (slice(g_rows, g_rows + height), slice(g_cols, g_cols + width)),
+        (slice(t_rows, t_rows + height), slice(t_cols, t_cols + width)),
+    )
+
+
+def trace_kind(trace):
+    """Rock or fault kind of a trace (first type for bedrock interfaces)."""
+    if isinstance(trace.type, (list, tuple)):
+        return trace.type[0]
+    return trace.type
+
+
+def split_traces(traces, core, window):
+    """Sort the traces of a tile by their position relative to its core.
+
+    Returns ``(interior, border)``: traces lying entirely in `core` and traces
+    crossing its border, indices being in `window`. Traces lying entirely in
+    the halo belong to a neighbour tile and are dropped.
+    """
+    interior = []
+    border = []
+    for tr in traces:
+        in_core = in_window(tr.index, core, window)
+        if in_core.all():
+            interior.append(tr)
+        elif in_core.any():
+            border.append(tr)
+    return interior, border
+
+
+def _sort_index(index, grid_window, sort_line=TIEgen.sortLine):
+    """`sort_line` on the smallest window holding `index`."""
+    window = trace_window(index, grid_window)
+    local = grid_to_window(index, window, grid_window)
+    local = sort_line(local, (window[2], window[3]))
+    return window_to_grid(local, window, grid_window)
+
+
+def stitch_traces(pieces, grid_window, sort_line=TIEgen.sortLine):
+    """Merge the trace pieces sharing pixels into single traces.
+
+    Pieces are merged when they have the same kind and at least one common
+    pixel. Merged traces get a fresh single segment, as built by
+    `TIE_load.extractTraces`, and keep the id and type of their longest piece.
+    Their pixels are ordered by `sort_line` (see `TIE_general.sortLine`).
+    """
+    parent = list(range(len(pieces)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner = {}
+    for i, tr in enumerate(pieces):
+        kind = trace_kind(tr)
+        for px in np.unique(tr.index.astype(int)):
+            key = (kind, px)
+            if key in owner:
+                a, b = find(owner[key]), find(i)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+            else:
+                owner[key] = i
+
+    groups = {}
+    for i in range(len(pieces)):
+        groups.setdefault(find(i), []).append(pieces[i])
+
+    traces = []
+    for group in groups.values():
+        if len(group) == 1:
+            traces.append(group[0])
+            continue
+        longest = max(group, key=lambda tr: np.size(tr.index))
+        index = np.unique(np.concatenate([tr.index.astype(int) for tr in group]))
+        index = _sort_index(index, grid_window, sort_line)
+        i_ind = np.arange(0, np.size(index)).astype(int)
+        seg = TIEclass.segment_OBJ(1, [], i_ind, i_ind[::-1], [], [], [], [])
+        traces.append(
+            TIEclass.trace_OBJ(longest.id, index, longest.type, [seg], None, [])
+        )
+
+    return traces
+
+
+def renumber(traces):
+    """Give the traces consecutive ids, starting at 1."""
+    for n, tr in enumerate(traces, start=1):
+        tr.id = n
+    return traces
@@ -0,0 +1,317 @@
+"""
+Columnar on-disk store for the results of the TIE analysis.
+
+A list of `untie` traces is written as a directory of flat NumPy arrays
+(``.npy``, one per attribute) and a ``meta.json``::
+
+    traces/
+        meta.json
+        trace_id.npy, trace_type.npy, index.npy, index_offsets.npy, ...
+        seg_*.npy      segments, `seg_offsets` gives the segments of a trace
+        chord_*.npy    chords, `chord_offsets` gives the chords of a segment
+        plane_*.npy    chord planes, `plane_offsets` gives those of a segment
+
+Ragged attributes (trace indices, orientation bars, ...) are concatenated and
+sliced with an ``*_offsets`` array (``n + 1`` values). Reading memory-maps the
+arrays: a `TraceStore` only builds the trace objects which are accessed.
+
+The DEM dict is stored the same way (``z.npy``, ``x.npy``, ``y.npy`` and the
+metadata in ``meta.json``).
+"""
+
+import json
+import os
+import pickle
+from functools import lru_cache
+
+import numpy as np
+from affine import Affine
+
+from untie import TIE_classes as TIEclass
+
+STORE_VERSION = 1
+
+
+def _concat(arrays, shape, dtype):
+    """Concatenate `arrays`, an empty array of `shape` rows if there is none."""
+    if arrays:
+        return np.concatenate(arrays).astype(dtype)
+    return np.empty((0,) + shape, dtype=dtype)
+
+
+def _offsets(lengths):
+    return np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+
+
+def _rows(values, shape):
+    """Float array of one row of `shape` per value."""
+    return np.array(values, dtype=float).reshape((-1,) + shape)
+
+
+def _fixed(values, size):
+    """Values of a fixed size attribute, NaN when not computed yet (``[]``)."""
+    if values is None or np.size(values) == 0:
+        return np.full(size, np.nan)
+    return np.asarray(values, dtype=float).reshape(size)
+
+
+def _write_columns(directory, columns, meta):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # meta.json last: a directory without it is not a complete store
+    meta_path = os.path.join(directory, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name, values in columns.items():
+        np.save(os.path.join(directory, f"{name}.npy"), values)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def save_traces(traces, directory):
+    """Write a list of `trace_OBJ` (analysed or not) to `directory`."""
+    traces = traces or []
+
+    trace_type = []
+    type_size = []
+    convexity = []
+    indices = []
+    orientbars = []
+    segments = []
+    for tr in traces:
+        kind = np.atleast_1d(np.asarray(tr.type, dtype=float))
+        type_size.append(0 if np.ndim(tr.type) == 0 else kind.size)
+        trace_type.append(np.resize(np.append(kind, np.nan), 2)[:2])
+        convexity.append(_fixed(tr.convexityTH, 2))
+        indices.append(np.asarray(tr.index))
+        orientbars.append(np.asarray(tr.orientbar, dtype=float).reshape(-1, 3))
+        segments.append(tr.Segment or [])
+
+    segs = [seg for tr_segs in segments for seg in tr_segs]
+    chords = [c for seg in segs for c in (seg.Chords or [])]
+    planes = [p for seg in segs for p in (seg.Chordplanes or [])]
+
+    columns = {
+        "trace_id": np.array([tr.id for tr in traces], dtype=np.int64),
+        "trace_type": _rows(trace_type, (2,)),
+        "trace_type_size": np.array(type_size, dtype=np.int8),
+        "convexity": _rows(convexity, (2,)),
+        "index": _concat(indices, (), float),
+        "index_offsets": _offsets([np.size(i) for i in indices]),
+        "orientbar": _concat(orientbars, (3,), float),
+        "orientbar_offsets": _offsets([len(o) for o in orientbars]),
+        "seg_offsets": _offsets([len(s) for s in segments]),
+        "seg_id": np.array([seg.id for seg in segs], dtype=np.int64),
+        "seg_delta": _rows([_fixed(seg.delta, 2) for seg in segs], (2,)),
+        "seg_class": np.array(
+            [seg.classID if np.size(seg.classID) else -1 for seg in segs],
+            dtype=np.int64,
+        ),
+        "seg_sigheight": _rows([_fixed(seg.sigheight, 2) for seg in segs], (2,)),
+        "seg_ind_normal": _concat([seg.ind_normal for seg in segs], (), np.int64),
+        "seg_ind_reverse": _concat([seg.ind_reverse for seg in segs], (), np.int64),
+        "seg_ind_offsets": _offsets([np.size(seg.ind_normal) for seg in segs]),
+        "chord_offsets": _offsets([len(seg.Chords or []) for seg in segs]),
+        "chord_id": np.array([c.id for c in chords], dtype=np.int64),
+        "chord_vector": _rows([c.vector for c in chords], (2, 3)),
+        "chord_trend": _rows([c.vec_trend for c in chords], (2,)),
+        "chord_plunge": _rows([c.vec_plunge for c in chords], (2,)),
+        "chord_alpha": _rows([c.alpha for c in chords], (2,)),
+        "plane_offsets": _offsets([len(seg.Chordplanes or []) for seg in segs]),
+        "plane_id": np.array([p.id for p in planes], dtype=np.int64),
+        "plane_normal": _rows([p.normal for p in planes], (2, 3)),
+        "plane_orient": _rows([p.plane_orient for p in planes], (4,)),
+        "pole_orient": _rows([p.pole_orient for p in planes], (4,)),
+        "plane_beta": _rows([p.beta for p in planes], (2,)),
+        "plane_dist_meters": _rows([p.dist_meters for p in planes], (2,)),
+        "plane_dist_ratio": _rows([p.dist_ratio for p in planes], (2,)),
+    }
+    _write_columns(
+        directory,
+        columns,
+        {"version": STORE_VERSION, "kind": "traces", "count": len(traces)},
+    )
+
+
+def is_store(directory):
+    return os.path.isfile(os.path.join(directory, "meta.json"))
+
+
+class TraceStore:
+    """Read-only, lazy sequence of the traces written by `save_traces`.
+
+    The columns are memory-mapped; ``store[i]`` builds the `trace_OBJ` of the
+    i-th trace only. Recently accessed traces are kept in memory.
+    """
+
+    def __init__(self, directory, cache_size=256):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(
+                f"Unsupported trace store version in {directory}: {self.meta}"
+            )
+        self._columns = {}
+        self._get = lru_cache(maxsize=cache_size)(self._build)
+
+    def column(self, name):
+        """Memory-mapped column `name` (e.g. 'trace_id', 'seg_class')."""
+        if name not in self._columns:
+            self._columns[name] = np.load(
+                os.path.join(self.directory, f"{name}.npy"), mmap_mode="r"
+            )
+        return self._columns[name]
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("trace index out of range")
+        return self._get(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _range(self, name, i):
+        offsets = self.column(f"{name}_offsets")
+        return int(offsets[i]), int(offsets[i + 1])
+
+    def _slice(self, name, i):
+        return slice(*self._range(name, i))
+
+    def index(self, i):
+        """Pixel indices of the i-th trace, without building it."""
+        return np.asarray(self.column("index")[self._slice("index", i)])
+
+    def _build(self, i):
+        c = self.column
+
+        size = int(c("trace_type_size")[i])
+        kind = c("trace_type")[i]
+        kind = kind[0] if size == 0 else list(np.array(kind[:size]))
+
+        convexity = c("convexity")[i]
+        if np.isnan(convexity).all():
+            convexity = None
+        else:
+            convexity = convexity.astype(int).tolist()
+
+        segments = [self._build_segment(s) for s in range(*self._range("seg", i))]
+
+        return TIEclass.trace_OBJ(
+            int(c("trace_id")[i]),
+            self.index(i),
+            kind,
+            segments,
+            convexity,
+            list(np.array(c("orientbar")[self._slice("orientbar", i)])),
+        )
+
+    def _build_segment(self, s):
+        c = self.column
+
+        delta = c("seg_delta")[s]
+        delta = [] if np.isnan(delta).all() else delta.astype(int).tolist()
+        sigheight = c("seg_sigheight")[s]
+        sigheight = [] if np.isnan(sigheight).all() else list(np.array(sigheight))
+        ind = self._slice("seg_ind", s)
+
+        chords = [
+            TIEclass.chord_OBJ(
+                int(c("chord_id")[k]),
+                list(np.array(c("chord_vector")[k])),
+                list(np.array(c("chord_trend")[k]).reshape(2, 1)),
+                list(np.array(c("chord_plunge")[k]).reshape(2, 1)),
+                c("chord_alpha")[k].tolist(),
+            )
+            for k in range(*self._range("chord", s))
+        ]
+        planes = [
+            TIEclass.chordPlane_OBJ(
+                int(c("plane_id")[k]),
+                list(np.array(c("plane_normal")[k])),
+                c("plane_orient")[k].tolist(),
+                c("pole_orient")[k].tolist(),
+                c("plane_beta")[k].tolist(),
+                c("plane_dist_meters")[k].tolist(),
+                c("plane_dist_ratio")[k].tolist(),
+            )
+            for k in range(*self._range("plane", s))
+        ]
+
+        return TIEclass.segment_OBJ(
+            int(c("seg_id")[s]),
+            delta,
+            np.array(c("seg_ind_normal")[ind]),
+            np.array(c("seg_ind_reverse")[ind]),
+            chords,
+            planes,
+            int(c("seg_class")[s]),
+            sigheight,
+        )
+
+
+def save_dem(DEM, directory):
+    """Write a DEM dict (see `utils.load_dem_window`) to `directory`."""
+    from rasterio.crs import CRS
+
+    meta = dict(DEM["meta"])
+    if meta.get("crs") is not None:
+        meta["crs"] = CRS.from_user_input(meta["crs"]).to_wkt()
+    if meta.get("transform") is not None:
+        meta["transform"] = list(meta["transform"])[:6]
+    if meta.get("nodata") is not None:
+        meta["nodata"] = float(meta["nodata"])
+    _write_columns(
+        directory,
+        {"z": np.asarray(DEM["z"]), "x": DEM["x"], "y": DEM["y"]},
+        {"version": STORE_VERSION, "kind": "dem", "meta": meta},
+    )
+
+
+def load_dem(directory, mmap_mode="r"):
+    """Read a DEM written by `save_dem`; 'z' is memory-mapped by default."""
+    from rasterio.crs import CRS
+
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)["meta"]
+    if meta.get("crs") is not None:
+        meta["crs"] = CRS.from_wkt(meta["crs"])
+    if meta.get("transform") is not None:
+        meta["transform"] = Affine(*meta["transform"])
+
+    return {
+        "z": np.load(os.path.join(directory, "z.npy"), mmap_mode=mmap_mode),
+        "x": np.load(os.path.join(directory, "x.npy")),
+        "y": np.load(os.path.join(directory, "y.npy")),
+        "meta": meta,
+    }
+
+
+def open_traces(data_dir, name):
+    """Traces `name` ('traces' or 'faults') of an analysis output directory.
+
+    Returns a lazy `TraceStore`, or the unpickled list for the outputs of older
+    versions (``<name>.pkl``).
+    """
+    directory = os.path.join(data_dir, name)
+    if is_store(directory):
+        return TraceStore(directory)
+    with open(os.path.join(data_dir, f"{name}.pkl"), "rb") as f:
+        return pickle.load(f)
+
+
+def open_dem(data_dir):
+    """DEM of an analysis output directory (``DEM/`` or older ``DEM.pkl``)."""
+    directory = os.path.join(data_dir, "DEM")
+    if is_store(directory):
+        return load_dem(directory)
+    with open(os.path.join(data_dir, "DEM.pkl"), "rb") as f:
+        return pickle.load(f)
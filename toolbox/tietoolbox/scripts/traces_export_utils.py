@@ -1,58 +1,90 @@
 # Simplified version to only get the `cm`
 
-import geopandas as gpd
 import numpy as np
 
-from shapely.geometry import LineString
+from tietoolbox.scripts.categories import NODATA, CategoricalRaster
+from tietoolbox.scripts.dem_grid import DEMGrid
+from tietoolbox.scripts.lazy import lazy_import
+from tietoolbox.scripts.trace_store import TraceStore
+
+gpd = lazy_import("geopandas")
+pd = lazy_import("pandas")
+shapely = lazy_import("shapely")
 
 
 def bed2cmap(BEDrst, legendfile, leg_labels=False):
-    kind = np.unique(BEDrst.flatten())
-    kind = np.extract(np.isnan(kind) == False, kind)
-    cm = np.zeros(np.size(BEDrst.flatten()))
-    leg = np.loadtxt(legendfile, usecols=(0, 1, 2, 3))
-    k_col = np.zeros(np.shape(kind))
-
-    for k in range(len(kind)):
-        i = (BEDrst.flatten() == kind[k]).nonzero()
-        cm[i] = k + 1
-        # TODO: Error ValueError: setting an array element with a sequence
-        # k_col[k] = (leg[:, 0] == kind[k]).nonzero()[0]
-        # Fix the line causing the error
-        matching_rows = np.where(leg[:, 0] == kind[k])[0]
-        if matching_rows.size > 0:
-            # print("matching row", matching_rows.size)
-            k_col[k] = matching_rows[0]
-
-    cm = cm.reshape(np.shape(BEDrst))
+    """Class matrix and colormap of a bedrock raster.
+
+    Parameters
+    ----------
+    BEDrst : CategoricalRaster or numpy.ndarray
+        Bedrock raster (see `categories`), or matrix of the codes (NaN where
+        there is no bedrock).
+    legendfile : str
+        Legend (e.g. symbols.tsv): kind, R, G, B.
+
+    Returns
+    -------
+    cm : numpy.ndarray
+        Class of each pixel (1 to number of kinds, by increasing kind, 0 for
+        NaN), flipped left-right.
+    cmap : numpy.ndarray
+        Colormap (255 x RGBA), the first band is grey when BEDrst has NaNs.
+    """
+    if isinstance(BEDrst, CategoricalRaster):
+        # The categories are already the sorted kinds: counted, not hashed.
+        # Classes of the kinds present in the raster.
+        counts = np.bincount(np.ravel(BEDrst.data), minlength=BEDrst.codes.size + 1)
+        present = counts[1:] > 0
+        classes = np.concatenate(([0], np.cumsum(present))).astype(float)
+        kind = BEDrst.codes[present]
+        has_nan = counts[NODATA] > 0
+        cm = classes[BEDrst.data]
+    else:
+        # One hash pass instead of one pass over the raster per kind. `codes`
+        # are the ranks of the sorted kinds, -1 for NaN.
+        codes, kind = pd.factorize(np.ravel(BEDrst), sort=True)
+        has_nan = (codes < 0).any()
+        cm = (codes + 1).astype(float)
+        cm = cm.reshape(np.shape(BEDrst))
     cm = np.fliplr(cm)
 
-    cmap = np.zeros((255, 4))
+    # Row of the legend of each kind (first match, 0 if missing)
+    leg = np.loadtxt(legendfile, usecols=(0, 1, 2, 3))
+    order = np.argsort(leg[:, 0], kind="stable")
+    pos = np.searchsorted(leg[order, 0], kind)
+    pos = np.minimum(pos, len(order) - 1)
+    k_col = np.where(leg[order[pos], 0] == kind, order[pos], 0)
 
-    if any(np.isnan(BEDrst.flatten())):
-        c_step = np.linspace(0, 255, np.size(k_col) + 2)
-        c_step = np.round(c_step, 0).astype(int)
-        cmap[0 : int(c_step[1]), 0:3] = np.ones((int(c_step[1]), 3)) * [230, 230, 230]
+    cmap = np.zeros((255, 4))
+    colors = leg[k_col, 1:4]
 
-        for ci in range(1, len(c_step) - 1):
-            ind1 = int(c_step[ci])
-            ind2 = int(c_step[ci + 1])
-            rgb_c = leg[int(k_col[ci - 1]), 1:4]
-            cmap[ind1:ind2, 0:3] = np.ones((ind2 - ind1, 3)) * rgb_c
+    if has_nan:
+        # First band for NaN (grey)
+        c_step = np.round(np.linspace(0, 255, np.size(k_col) + 2), 0).astype(int)
+        colors = np.vstack(([230, 230, 230], colors))
     else:
-        c_step = np.linspace(0, 255, np.size(k_col) + 1)
-        c_step = np.round(c_step, 0).astype(int)
+        c_step = np.round(np.linspace(0, 255, np.size(k_col) + 1), 0).astype(int)
 
-        for ci in range(len(c_step) - 1):
-            ind1 = int(c_step[ci])
-            ind2 = int(c_step[ci + 1])
-            rgb_c = leg[int(k_col[ci]), 1:4]
-            cmap[ind1:ind2, 0:3] = np.ones((ind2 - ind1, 3)) * rgb_c
-    cmap[:, 3] = (np.ones((255, 1)) * 255).flatten()
+    cmap[c_step[0] : c_step[-1], 0:3] = np.repeat(colors, np.diff(c_step), axis=0)
+    cmap[:, 3] = 255
 
     return cm, cmap
 
 
+def _trace_indices(BTraces):
+    """Concatenated pixel indices of the traces and the trace of each pixel."""
+    if isinstance(BTraces, TraceStore):
+        # Columns of the store, without building the trace objects
+        index = BTraces.column("index")
+        lengths = np.diff(BTraces.column("index_offsets"))
+    else:
+        index = np.concatenate([np.ravel(tr.index) for tr in BTraces])
+        lengths = [np.size(tr.index) for tr in BTraces]
+
+    return index.astype(int), np.repeat(np.arange(len(lengths)), lengths)
+
+
 def export_traces(DEM, BTraces=[]):
     """
     Exporting a trace object as geopandas
@@ -62,7 +94,8 @@ def export_traces(DEM, BTraces=[]):
     DEM : dict
         Dictionary containing DEM and coordinate data obtained with TIE_load.cropDEMextent.
     list
-        List of trace objects (trace_OBJ) defined in TIE_classes.
+        List of trace objects (trace_OBJ) defined in TIE_classes, or a
+        TraceStore.
 
     Returns
     -------
@@ -72,36 +105,25 @@ def export_traces(DEM, BTraces=[]):
 
 
     """
-    mx, my = np.meshgrid(DEM["x"], DEM["y"])
-    mz = np.flipud(DEM["z"].copy())
-    mx = mx.astype(float)
-    my = my.astype(float)
-
-    vx = np.fliplr(mx).flatten()
-    vy = my.flatten()
-    vz = np.fliplr(mz).flatten()  # TODO: check  if correct
-
     try:
         crs = DEM["meta"]["crs"]
     except Exception:
         print("No CRS")
+    authority_str = "epsg:{}".format(crs.to_epsg())
+
+    if len(BTraces) == 0:
+        return gpd.GeoDataFrame(geometry=[], crs=authority_str)
 
-    txx = []
-    tyy = []
-    tzz = []
-    if len(BTraces) > 0:
-        for tr in BTraces:
-            tx = vx[tr.index.astype(int)]
-            ty = vy[tr.index.astype(int)]
-            tz = vz[tr.index.astype(int)]
-            txx.append(tx)
-            tyy.append(ty)
-            tzz.append(tz)
-    line_strings = [LineString(list(zip(x, y, z))) for x, y, z in zip(txx, tyy, tzz)]
+    # Trace indices are in the flipped frame of the DEM: the coordinates are
+    # looked up directly, without DEM sized meshgrids
+    index, trace = _trace_indices(BTraces)
+    x, y, z = DEMGrid.from_dem(DEM).coords(index)
+    x, y = x.astype(float), y.astype(float)
+
+    line_strings = shapely.linestrings(x, y, z, indices=trace)
 
     # Now line_strings is an array of LineString objects
     # Create a GeoDataFrame with the LineString objects
-    authority_str = "epsg:{}".format(crs.to_epsg())
     gdf = gpd.GeoDataFrame(geometry=line_strings, crs=authority_str)
 
     return gdf
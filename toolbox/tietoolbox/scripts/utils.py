@@ -1,35 +1,159 @@
+# Annotations not evaluated: they would import rasterio and geopandas
+from __future__ import annotations
+
+import functools
 import json
-from math import ceil
+import threading
+from contextlib import contextmanager
+from math import ceil, floor
 from os.path import normpath
 from pathlib import Path, PurePath, PurePosixPath
 from pathlib import PureWindowsPath
 
 import numpy as np
-import rasterio as rst
 from affine import Affine
-from rasterio.features import rasterize
-import geopandas as gpd
-from rasterio.mask import mask
 
 import unicodedata
 import re
-import shapely
+
+from tietoolbox.scripts.lazy import lazy_import
+
+rst = lazy_import("rasterio")
+gpd = lazy_import("geopandas")
+pyogrio = lazy_import("pyogrio")
+
+
+_arrow_lock = threading.Lock()
+_open_rasters = threading.local()
+
+
+@functools.lru_cache(maxsize=None)
+def _import_arrow():
+    try:
+        import pyarrow  # noqa: F401
+
+        return True
+    except ImportError:
+        return False
+
+
+def has_arrow():
+    """True if `pyarrow` can be imported (checked on first use, it is slow)."""
+    # Locked: while a thread fails to import it, another one would get the
+    # partly imported module
+    with _arrow_lock:
+        return _import_arrow()
 
 
 def cropDEMextent(geotif: rst.io.DatasetReader, shapefile: gpd.GeoDataFrame) -> dict:
-    """Crop DEM with Shapefile."""
+    """Crop DEM with Shapefile.
+
+    Only the window covering the bounds of the shapefile is read.
+    """
+
+    return read_dem_window(geotif, bbox_window(geotif, shapefile.total_bounds))
+
+
+def bbox_window(geotif: rst.io.DatasetReader, bbox) -> tuple:
+    """Pixel window of a DEM covering a bbox.
+
+    Parameters
+    ----------
+    geotif : rasterio.io.DatasetReader
+        Handle to an opened geotif (rasterio).
+    bbox : list
+        (minx, miny, maxx, maxy) in the CRS of `geotif`.
+
+    Returns
+    -------
+    tuple
+        (row_off, col_off, height, width), snapped outwards to the pixels and
+        clipped to the dataset.
+    """
+    from rasterio.windows import from_bounds
+
+    window = from_bounds(*bbox, transform=geotif.transform)
 
-    crs = (geotif.crs,)
+    # round() first: avoids an extra pixel because of floating point noise
+    row0 = max(floor(round(window.row_off, 6)), 0)
+    col0 = max(floor(round(window.col_off, 6)), 0)
+    row1 = min(ceil(round(window.row_off + window.height, 6)), geotif.height)
+    col1 = min(ceil(round(window.col_off + window.width, 6)), geotif.width)
 
-    bbox = [2569800, 1221000, 2573200, 1223000]
-    box = shapely.geometry.box(*bbox)
+    return (row0, col0, row1 - row0, col1 - col0)
 
-    print(box)
 
-    output_meta = geotif.meta.copy()
+@contextmanager
+def open_raster(source, keep_open=False):
+    """`rasterio.open(source)`, kept open for the next calls of the thread if
+    `keep_open`.
+
+    Opening a mosaic (VRT) reads its whole description: the batch runs read
+    many windows of the same DEM. The kept datasets are never closed, for
+    sources which do not change while the process runs.
+    """
+    if not keep_open:
+        with rst.open(source) as dataset:
+            yield dataset
+        return
+    # Per thread: a dataset cannot be read by several threads at once
+    datasets = _open_rasters.__dict__.setdefault("datasets", {})
+    dataset = datasets.get(source)
+    if dataset is None or dataset.closed:
+        dataset = datasets[source] = rst.open(source)
+    yield dataset
+
+
+def load_dem_window(source, bbox, halo=0, keep_open=False) -> dict:
+    """Load the part of a DEM covering a bbox.
+
+    Only this window is read from `source`, not the whole mosaic.
+
+    Parameters
+    ----------
+    source : str
+        Path to the DEM (GeoTIFF).
+    bbox : list
+        (minx, miny, maxx, maxy) in the CRS of the DEM.
+    halo : float
+        Margin added around the bbox (in the DEM units, i.e. meters).
+    keep_open : bool
+        Keep `source` open for the next reads (see `open_raster`).
+
+    Returns
+    -------
+    dict
+        Same layout as `TIE_load.cropDEMextent`: 'z', 'x', 'y' and 'meta'.
+    """
+    minx, miny, maxx, maxy = bbox
+    bbox = (minx - halo, miny - halo, maxx + halo, maxy + halo)
+
+    with open_raster(source, keep_open) as geotif:
+        return read_dem_window(geotif, bbox_window(geotif, bbox))
+
+
+def read_dem_window(geotif: rst.io.DatasetReader, window: tuple) -> dict:
+    """Read a pixel window of a DEM.
+
+    Parameters
+    ----------
+    geotif : rasterio.io.DatasetReader
+        Handle to an opened geotif (rasterio).
+    window : tuple
+        (row_off, col_off, height, width) in pixels of `geotif`.
+
+    Returns
+    -------
+    dict
+        Same layout as `TIE_load.cropDEMextent`: 'z', 'x', 'y' and 'meta'.
+    """
+    from rasterio.windows import Window
+
+    row_off, col_off, height, width = window
+    rio_window = Window(col_off, row_off, width, height)
 
-    DEM, out_trans = mask(geotif, [box], crop=False, filled=True)
-    z = DEM[0]
+    z = geotif.read(1, window=rio_window)
+    out_trans = geotif.window_transform(rio_window)
 
     xend = out_trans[2] + out_trans[0] * z.shape[1] + 1
     x1 = out_trans[2] + 1
@@ -43,14 +167,53 @@ def cropDEMextent(geotif: rst.io.DatasetReader, shapefile: gpd.GeoDataFrame) ->
     out_meta.update(
         {
             "driver": "GTiff",
-            "height": DEM.shape[0],
-            "width": DEM.shape[1],
+            "height": z.shape[0],
+            "width": z.shape[1],
             "transform": out_trans,
         }
     )
 
-    DEM = {"z": z, "x": x, "y": y, "meta": out_meta}
-    return DEM
+    return {"z": z, "x": x, "y": y, "meta": out_meta}
+
+
+def read_layer(
+    source, layer, columns=None, bbox=None, where=None, use_arrow=True, mask=None
+) -> gpd.GeoDataFrame:
+    """Read a layer of a vector dataset (FileGDB, GeoPackage, ...).
+
+    The column selection, the bbox and the `where` filter are applied by GDAL
+    while reading: the other columns and features are never loaded.
+
+    Parameters
+    ----------
+    source : str
+        Path to the dataset.
+    layer : str
+        Name of the layer.
+    columns : list
+        Attributes to read, besides the geometry. None: all of them.
+    bbox : list
+        (minx, miny, maxx, maxy): only the features intersecting it.
+    where : str
+        SQL WHERE clause, e.g. "KIND IN (14901001, 14901002)".
+    use_arrow : bool
+        Transfer the features through Arrow, if `pyarrow` is available.
+    mask : shapely.Geometry
+        Only the features intersecting it (instead of `bbox`).
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+    """
+    return pyogrio.read_dataframe(
+        source,
+        layer=layer,
+        columns=columns,
+        bbox=tuple(bbox) if bbox is not None else None,
+        where=where or None,
+        mask=mask,
+        use_arrow=use_arrow and has_arrow(),
+    )
 
 
 def load_config(project_name):
@@ -135,7 +298,9 @@ def universalpath(path):
 
 
 # https://pygis.io/docs/e_raster_rasterize.html
-def rasterizeGPD(gdf, prop, bounds, res) -> np.ndarray:
+def rasterizeGPD(
+    gdf, prop, bounds, res, fill=0, dtype="float64", strip_rows=0, num_workers=1
+) -> np.ndarray:
     """Rasterizes Shapefile.
 
     Rasterizes a shapefile according to a specific attribute field value.
@@ -155,6 +320,19 @@ def rasterizeGPD(gdf, prop, bounds, res) -> np.ndarray:
     res tuple
        resolution (x, y)
 
+    fill : float
+       Value of the pixels not covered by any geometry.
+
+    dtype : str
+       Data type of the raster, e.g. 'uint8' for categories (see `categories`).
+
+    strip_rows : int
+       Rasterize strips of `strip_rows` rows in parallel (see
+       `rasterize_strips`), 0: a single call.
+
+    num_workers : int
+       Threads rasterizing the strips.
+
     Returns
     -------
     numpy.ndarray
@@ -179,15 +357,30 @@ def rasterizeGPD(gdf, prop, bounds, res) -> np.ndarray:
         "all_touched": False,
         "transform": Affine(res[0], 0, bounds[0], 0, -res[1], bounds[3]),
         "driver": "GTiff",
-        "dtype": "float64",
+        "dtype": dtype,
         "fill": -9999.0,
     }
 
+    if strip_rows and strip_rows < height:
+        return rasterize_strips(
+            gdf,
+            prop,
+            (height, width),
+            kwargs["transform"],
+            fill=fill,
+            dtype=dtype,
+            strip_rows=strip_rows,
+            num_workers=num_workers,
+        )
+
+    from rasterio.features import rasterize
+
     rasterized = rasterize(
         geometries,
         out_shape=(kwargs["height"], kwargs["width"]),
         transform=kwargs["transform"],
         dtype=kwargs.get("dtype", None),
+        fill=fill,
         default_value=1,
     )
     """
@@ -198,9 +391,141 @@ def rasterizeGPD(gdf, prop, bounds, res) -> np.ndarray:
     return rasterized
 
 
-def array_to_tif(arr, fname, crs, transform):
+def rasterize_strips(
+    gdf,
+    prop,
+    out_shape,
+    transform,
+    fill=0,
+    dtype="float64",
+    strip_rows=1024,
+    num_workers=1,
+) -> np.ndarray:
+    """Rasterizes a GeoDataFrame by horizontal strips of the grid, in parallel.
+
+    Each strip burns the features intersecting it (found with the spatial
+    index of `gdf`), in their order, into its rows of the output: the raster
+    is the same as the one of a single `rasterio.features.rasterize` call
+    (all_touched False), but a strip only goes through its features and the
+    strips are burnt by `num_workers` threads (GDAL releases the GIL).
+
+    Parameters
+    ----------
+    gdf : geopandas.geodataframe.GeoDataFrame
+        Geometries to burn.
+    prop : str
+        Attribute holding the value to burn.
+    out_shape : tuple
+        (height, width) of the raster.
+    transform : affine.Affine
+        Transform of the raster.
+    fill : float
+        Value of the pixels not covered by any geometry.
+    dtype : str
+        Data type of the raster.
+    strip_rows : int
+        Rows of a strip.
+    num_workers : int
+        Threads burning the strips.
+
+    Returns
+    -------
+    numpy.ndarray
+        Raster matrix.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import shapely
+    from rasterio.features import rasterize
+    from rasterio.windows import Window
+    from rasterio.windows import bounds as window_bounds
+    from rasterio.windows import transform as window_transform
+
+    height, width = out_shape
+    out = np.full(out_shape, fill, dtype=dtype)
+    if gdf.empty:
+        return out
+    geometries = gdf.geometry.values
+    values = np.asarray(gdf[prop])
+    sindex = gdf.sindex
+
+    def burn(row0):
+        rows = min(strip_rows, height - row0)
+        # Features of the strip and of a row around it: the pixels on the edge
+        # of the strip are burnt as in a single call
+        extent = Window(0, row0 - 1, width, rows + 2)
+        index = np.sort(sindex.query(shapely.box(*window_bounds(extent, transform))))
+        if index.size:
+            rasterize(
+                zip(geometries[index], values[index]),
+                out=out[row0 : row0 + rows],
+                transform=window_transform(Window(0, row0, width, rows), transform),
+                fill=fill,
+            )
+
+    with ThreadPoolExecutor(max_workers=max(num_workers or 1, 1)) as executor:
+        list(executor.map(burn, range(0, height, strip_rows)))
+
+    return out
+
+
+def rasterize_on_dem(gdf, prop, DEM, codes=None, **kwargs) -> np.ndarray:
+    """Rasterizes a GeoDataFrame on the pixel grid of a DEM.
+
+    Unlike `TIE_load.rasterizeSHP`, whose grid starts at the bounds of the
+    geometries, the raster is aligned on the DEM. Pixels without geometry are
+    NaN and the matrix has the same orientation as the one of `rasterizeSHP`.
+
+    Parameters
+    ----------
+    gdf : geopandas.geodataframe.GeoDataFrame
+        Geometries to burn.
+    prop : str
+        Attribute holding the (numerical) value to burn.
+    DEM : dict
+        Dictionary containing DEM and coordinate data (see cropDEMextent).
+    codes : numpy.ndarray, optional
+        Lookup table of the values (see `categories`): the positions of the
+        values are burnt, in the smallest dtype holding them, NODATA (0)
+        rather than NaN where there is no geometry.
+    **kwargs
+        Rasterization by strips (`strip_rows`, `num_workers`), see
+        `rasterizeGPD`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Raster matrix, same shape as DEM["z"].
+    """
+    trans = DEM["meta"]["transform"]
+    height, width = np.shape(DEM["z"])
+    bounds = (
+        trans[2],
+        trans[5] + trans[4] * height,
+        trans[2] + trans[0] * width,
+        trans[5],
+    )
+    res = (trans[0], -trans[4])
+    if codes is None:
+        rasterized = rasterizeGPD(gdf, prop, bounds, res, fill=np.nan, **kwargs)
+    else:
+        from tietoolbox.scripts.categories import NODATA, category_dtype, encode
+
+        gdf = gdf.assign(**{prop: encode(gdf[prop], codes)})
+        dtype = category_dtype(len(codes)).name
+        rasterized = rasterizeGPD(
+            gdf, prop, bounds, res, fill=NODATA, dtype=dtype, **kwargs
+        )
+
+    return np.flip(rasterized, (0, 1))
+
+
+def array_to_tif(arr, fname, crs, transform, nodata=None, tags=None, options=None):
     """Write a NumPy array to a GeoTIFF file.
 
+    Tiled, compressed, with overviews, by default a Cloud Optimized GeoTIFF
+    (see `geotiff`). The array is written by rows of tiles.
+
     Parameters
     ----------
     arr : numpy.ndarray
@@ -212,26 +537,20 @@ def array_to_tif(arr, fname, crs, transform):
     transform : rasterio.transform.Affine
         Affine transformation that maps pixel coordinates to coordinates in the
         given CRS.
+    nodata : float, optional
+        Value of the pixels without data.
+    tags : dict, optional
+        Tags of the band (e.g. the lookup table of a categorical raster).
+    options : dict, optional
+        Format, compression, tiles and overviews (see `geotiff.output_config`).
 
     Returns
     -------
     None
     """
-    # inversé
-    new_dataset = rst.open(
-        fname,
-        "w",
-        driver="GTiff",
-        height=arr.shape[0],
-        width=arr.shape[1],
-        count=1,
-        dtype=str(arr.dtype),
-        crs=crs,
-        transform=transform,
-    )
+    from tietoolbox.scripts.geotiff import write_tif
 
-    new_dataset.write(arr, 1)
-    new_dataset.close()
+    write_tif(arr, fname, crs, transform, options, nodata=nodata, tags=tags)
 
 
 # DEM dict to array
@@ -243,8 +562,8 @@ def dem_to_array(DEM):
     z_values = DEM["z"]
 
     # Create a 2D grid from x and y values using meshgrid
-    # Create a 2D array for elevation values (z)
-    elevation_array = np.array(z_values)
+    # Create a 2D array for elevation values (z), not copied
+    elevation_array = np.asarray(z_values)
 
     # Reshape the elevation values into a 2D array
     dem_array = elevation_array.reshape(len(y_values), len(x_values))
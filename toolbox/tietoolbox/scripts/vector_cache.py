@@ -0,0 +1,196 @@
+"""
+Local copies of the vector layers read from the geodatabase.
+
+`load_big_shp` may keep a copy of the features it read (the needed columns of
+the features in the bbox) in the cache directory, in the format set by
+``cache.vector_format``:
+
+- 'none' (default): no copy;
+- 'parquet': GeoParquet (requires `pyarrow`, else FlatGeobuf);
+- 'flatgeobuf': FlatGeobuf.
+
+The copy is written by its own task, off the critical path of the analysis.
+A later run reads it instead of the geodatabase when the source (size and
+modification time of its files), the layer (feature count, extent, fields)
+and the query (columns, `where`) are unchanged and its bbox contains the new
+bbox.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+from tietoolbox.scripts.lazy import lazy_import
+from tietoolbox.scripts.stage_cache import fingerprint, source_signature
+from tietoolbox.scripts.utils import get_valid_filename, has_arrow
+
+gpd = lazy_import("geopandas")
+pyogrio = lazy_import("pyogrio")
+shapely = lazy_import("shapely")
+
+logger = logging.getLogger(__name__)
+
+VECTOR_FORMATS = {"none": None, "parquet": ".parquet", "flatgeobuf": ".fgb"}
+
+
+def layer_checksum(source, layer):
+    """Hash of the feature count, extent, fields and CRS of a layer.
+
+    Read from the layer metadata, without reading the features.
+    """
+    info = pyogrio.read_info(source, layer=layer)
+    return fingerprint(
+        {
+            "features": info["features"],
+            "total_bounds": info.get("total_bounds"),
+            # Arrays of objects: hashed by value, not by their pointers
+            "fields": [str(f) for f in info["fields"]],
+            "dtypes": [str(d) for d in info["dtypes"]],
+            "crs": info["crs"],
+            "geometry_type": info["geometry_type"],
+        }
+    )
+
+
+def select_bbox(gdf, bbox):
+    """Features of `gdf` intersecting `bbox`, in their order, reindexed.
+
+    Same selection as the bbox filter of GDAL: gives the features of a read
+    with `bbox` from the ones of a read with a larger extent.
+    """
+    index = np.sort(gdf.sindex.query(shapely.box(*bbox), predicate="intersects"))
+    return gdf.iloc[index].reset_index(drop=True)
+
+
+def bbox_contains(outer, inner):
+    return (
+        outer[0] <= inner[0]
+        and outer[1] <= inner[1]
+        and outer[2] >= inner[2]
+        and outer[3] >= inner[3]
+    )
+
+
+class VectorCache:
+    """Copies of the layers in `directory`, in `vector_format`.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the copies.
+    vector_format : str
+        One of `VECTOR_FORMATS`. 'parquet' falls back to 'flatgeobuf' when
+        `pyarrow` is not available.
+    """
+
+    def __init__(self, directory, vector_format="none"):
+        if vector_format not in VECTOR_FORMATS:
+            raise ValueError(
+                f"Unknown vector format '{vector_format}', "
+                f"expected one of {tuple(VECTOR_FORMATS)}"
+            )
+        if vector_format == "parquet" and not has_arrow():
+            logger.warning("pyarrow is not available: layers copied as FlatGeobuf")
+            vector_format = "flatgeobuf"
+        self.directory = directory
+        self.format = vector_format
+        self.extension = VECTOR_FORMATS[vector_format]
+
+    @property
+    def enabled(self):
+        return self.extension is not None
+
+    def path(self, lyr_cfg):
+        """Copy of a layer, named after the layer and a hash of its query.
+
+        The layers of the same name from other sources, or with other columns
+        or `where`, have their own copy. An edit of the source replaces it.
+        """
+        query = {
+            "source": os.path.abspath(lyr_cfg["source"]),
+            "layer": lyr_cfg["layer"],
+            "columns": [lyr_cfg["attribute"]],
+            "where": lyr_cfg["where"],
+        }
+        name = f"{get_valid_filename(lyr_cfg['layer'])}-{fingerprint(query)[:12]}"
+        return os.path.join(self.directory, name + self.extension)
+
+    def signature(self, lyr_cfg):
+        """What the copy of a layer depends on, besides the bbox."""
+        return {
+            "format": self.format,
+            "source": fingerprint(source_signature(lyr_cfg["source"])),
+            "checksum": layer_checksum(lyr_cfg["source"], lyr_cfg["layer"]),
+            "layer": lyr_cfg["layer"],
+            "columns": [lyr_cfg["attribute"]],
+            "where": lyr_cfg["where"],
+        }
+
+    def _read_meta(self, path):
+        try:
+            with open(path + ".json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, lyr_cfg, bbox):
+        """The features of the copy in `bbox`, None if it is missing or stale."""
+        if not self.enabled:
+            return None
+        path = self.path(lyr_cfg)
+        meta = self._read_meta(path)
+        if meta is None or not os.path.exists(path):
+            return None
+        if meta["signature"] != self.signature(lyr_cfg) or not bbox_contains(
+            meta["bbox"], bbox
+        ):
+            logger.info(f"Copy of '{lyr_cfg['layer']}' is outdated: {path}")
+            return None
+
+        try:
+            if self.format == "parquet":
+                gdf = gpd.read_parquet(path)
+            else:
+                gdf = pyogrio.read_dataframe(path)
+        except Exception as e:
+            logger.warning(f"Cannot read the copy of '{lyr_cfg['layer']}': {e}")
+            return None
+        logger.info(f"Reading '{lyr_cfg['layer']}' from {path}")
+        return select_bbox(gdf, bbox)
+
+    def store(self, gdf, lyr_cfg, bbox):
+        """Write the copy of a layer, unless the current one is identical."""
+        if not self.enabled:
+            return None
+        path = self.path(lyr_cfg)
+        meta = {"signature": self.signature(lyr_cfg), "bbox": list(bbox)}
+        if self._read_meta(path) == meta and os.path.exists(path):
+            return path
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        # Written aside then renamed, the metadata last: a reader never sees
+        # a partial copy, nor a copy with the metadata of the former one
+        if os.path.exists(path + ".json"):
+            os.remove(path + ".json")
+        stem, ext = os.path.splitext(path)
+        tmp_path = f"{stem}.{os.getpid()}.tmp{ext}"
+        if self.format == "parquet":
+            gdf.to_parquet(tmp_path)
+        else:
+            # The spatial index would sort the features: the order of the
+            # lines sets which one is burnt last on a pixel
+            pyogrio.write_dataframe(
+                gdf,
+                tmp_path,
+                driver="FlatGeobuf",
+                layer_options={"SPATIAL_INDEX": "NO"},
+            )
+        os.replace(tmp_path, path)
+        with open(path + ".json.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".json.tmp", path + ".json")
+        logger.info(f"Copy of '{lyr_cfg['layer']}' saved to {path}")
+        return path